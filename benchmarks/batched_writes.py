@@ -0,0 +1,123 @@
+"""
+This benchmark stores the messages of many concurrent conversations, a user message and an agent reply per turn, on an `InMemoryDatabase` with a simulated round-trip latency. It compares awaiting every `add_message` directly against the `WriteBehindDatabase`, which returns at once and stores pending messages in batches, and reports wall time, database round trips and the time a turn spends waiting on the database. At the end it checks that every conversation was stored completely and in order.
+
+Run with `python benchmarks/batched_writes.py [--conversations 200] [--turns 10] [--latency 0.005]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.join(SRC, "server"))
+
+from memory_database import InMemoryDatabase  # noqa: E402
+from write_behind import WriteBehindDatabase  # noqa: E402
+
+
+class CountingDatabase(InMemoryDatabase):
+    def __init__(self, latency):
+        super().__init__(latency)
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        await super()._round_trip()
+
+
+class FailingDatabase(InMemoryDatabase):
+    """
+    Every `add_messages` fails while `down` is set.
+    """
+
+    def __init__(self):
+        super().__init__(0)
+        self.down = True
+        self.attempts = 0
+
+    async def add_messages(self, rows):
+        self.attempts += 1
+        if self.down:
+            raise ConnectionError("database unavailable")
+        return await super().add_messages(rows)
+
+
+async def check_outage():
+    """
+    While the database is down the queue stays within `max_pending`, retries back off, and once it is up
+    again the newest messages are stored in order.
+    """
+    failing_database = FailingDatabase()
+    database = WriteBehindDatabase(failing_database, max_batch=20, max_delay=0.01, max_pending=50, max_retry_delay=0.08)
+    for i in range(200):
+        await database.add_message(f"message {i}", "User", "outage")
+    await asyncio.sleep(0.5)
+    # without backoff this would be one retry every 10 ms, plus one per message added past a full batch
+    assert failing_database.attempts <= 12, failing_database.attempts
+    assert len(database.pending) == 50 and database.stats["dropped_messages"] == 150
+
+    failing_database.down = False
+    await database.close()
+    contents = [message["content"] for message in await failing_database.get_messages("outage")]
+    assert contents == [f"message {i}" for i in range(150, 200)]
+    assert database.failures == 0
+
+
+async def conversation(database, conversation_id, turns, llm_latency, waits):
+    for turn in range(turns):
+        start = time.perf_counter()
+        await database.add_message(f"{conversation_id} question {turn}", "User", conversation_id)
+        waits.append(time.perf_counter() - start)
+        await asyncio.sleep(llm_latency)
+        start = time.perf_counter()
+        await database.add_message(f"{conversation_id} answer {turn}", "Agent", conversation_id)
+        waits.append(time.perf_counter() - start)
+
+
+async def run(write_behind, args):
+    counting_database = CountingDatabase(args.latency)
+    database = WriteBehindDatabase(counting_database, args.max_batch, args.max_delay) if write_behind else counting_database
+    waits = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        conversation(database, f"conversation-{i}", args.turns, args.llm_latency, waits)
+        for i in range(args.conversations)
+    ))
+    await database.close()
+    wall = time.perf_counter() - start
+
+    for i in range(args.conversations):
+        contents = [message["content"] for message in await counting_database.get_messages(f"conversation-{i}")]
+        expected = [f"conversation-{i} {kind} {turn}" for turn in range(args.turns) for kind in ("question", "answer")]
+        assert contents == expected, f"conversation-{i} was not stored in order"
+    waits.sort()
+    return wall, counting_database.round_trips - args.conversations, waits[len(waits) // 2], waits[int(len(waits) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per simulated database round trip")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds between the user message and the reply")
+    parser.add_argument("--max-batch", type=int, default=200)
+    parser.add_argument("--max-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(check_outage())
+
+    messages = args.conversations * args.turns * 2
+    print(f"{messages} messages in {args.conversations} conversations, {args.latency * 1000:.0f} ms per round trip")
+    print(f"{'mode':<14} {'wall s':>8} {'round trips':>12} {'p50 wait ms':>12} {'p99 wait ms':>12}")
+    for mode, write_behind in (("direct", False), ("write-behind", True)):
+        wall, round_trips, p50, p99 = asyncio.run(run(write_behind, args))
+        print(f"{mode:<14} {wall:>8.2f} {round_trips:>12} {p50 * 1000:>12.2f} {p99 * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+This file contains `CassetteChatModel`, a chat model that records the replies of a real model to a JSON cassette and replays them offline. In "record" mode every call goes to the model registered under `provider` in `dharmabot.model.MODELS` and its reply (text, tool calls or structured output), with how long it took, is stored under a hash of what was asked: the messages, the tools bound and the schema of a structured output. In "replay" mode the reply comes from the cassette, after the recorded latency (scaled by `latency_scale`, 0 for none), and a call that was never recorded raises `KeyError`, so a replay never reaches the network by accident. `register_cassette` puts it in `MODELS`, so the graph picks it up through the normal `_get_model` path, like the fake models. The purpose of this is to benchmark real replies, with their real lengths and tool calls, without the cost and the noise of the providers.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, convert_to_messages
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from dharmabot.model import MODELS, model_registry
+
+CASSETTE_VERSION = 1
+
+
+class Cassette:
+    """
+    Interactions of one cassette file, by key. Recorded interactions are written out right away.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.interactions = {}
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"{path} is a version {data.get('version')} cassette, expected {CASSETTE_VERSION}")
+            self.interactions = data["interactions"]
+
+    def get(self, key):
+        interaction = self.interactions.get(key)
+        self.stats["hits" if interaction is not None else "misses"] += 1
+        return interaction
+
+    def record(self, key, interaction):
+        with self.lock:
+            self.interactions[key] = interaction
+            self.stats["recorded"] += 1
+            temporary = f"{self.path}.tmp"
+            with open(temporary, "w") as f:
+                json.dump({"version": CASSETTE_VERSION, "interactions": self.interactions}, f, indent=1, sort_keys=True)
+            os.replace(temporary, self.path)
+
+
+cassettes = {}
+
+
+def cassette_key(messages, tools=None, schema=None):
+    # ids of messages and tool calls differ from run to run, so they are left out
+    asked = [
+        [m.type, m.content, [(call["name"], call["args"]) for call in getattr(m, "tool_calls", None) or []]]
+        for m in messages
+    ]
+    data = json.dumps([asked, tools or [], schema], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _as_messages(messages):
+    return convert_to_messages(messages.to_messages() if hasattr(messages, "to_messages") else messages)
+
+
+def _tool_name(tool):
+    return getattr(tool, "__name__", None) or getattr(tool, "name", None) or str(tool)
+
+
+class CassetteChatModel(BaseChatModel):
+    model_name: str = "cassette"
+    path: str
+    mode: str = "replay"
+    # the MODELS entry of the real model, in record mode
+    provider: Optional[str] = None
+    latency_scale: float = 1.0
+    temperature: float = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    @property
+    def cassette(self):
+        if self.path not in cassettes:
+            cassettes[self.path] = Cassette(self.path)
+        return cassettes[self.path]
+
+    def _real_model(self):
+        if self.mode != "record" or self.provider is None:
+            raise ValueError("Only a cassette in record mode with a provider calls a real model")
+        return model_registry.get(self.provider, temperature=self.temperature)
+
+    def _replay(self, key):
+        interaction = self.cassette.get(key)
+        if interaction is None:
+            raise KeyError(f"No recorded reply for this call in {self.path}, record it first")
+        return interaction, interaction["latency"] * self.latency_scale
+
+    @staticmethod
+    def _message(reply):
+        return AIMessage(content=reply["content"], tool_calls=reply["tool_calls"], usage_metadata=reply.get("usage"))
+
+    def _key(self, messages, tools):
+        return cassette_key(messages, [_tool_name(tool) for tool in tools or []])
+
+    def _store(self, key, reply, latency):
+        self.cassette.record(key, {
+            "content": reply.content, "tool_calls": reply.tool_calls,
+            "usage": reply.usage_metadata, "latency": latency,
+        })
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        key = self._key(messages, kwargs.get("tools"))
+        if self.mode == "record" and self.cassette.interactions.get(key) is None:
+            model = self._real_model()
+            if kwargs.get("tools"):
+                model = model.bind_tools(kwargs["tools"])
+            start = time.perf_counter()
+            reply = model.invoke(messages)
+            self._store(key, reply, time.perf_counter() - start)
+            return ChatResult(generations=[ChatGeneration(message=reply)])
+        interaction, latency = self._replay(key)
+        time.sleep(latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(interaction))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        key = self._key(messages, kwargs.get("tools"))
+        if self.mode == "record" and self.cassette.interactions.get(key) is None:
+            model = self._real_model()
+            if kwargs.get("tools"):
+                model = model.bind_tools(kwargs["tools"])
+            start = time.perf_counter()
+            reply = await model.ainvoke(messages)
+            self._store(key, reply, time.perf_counter() - start)
+            return ChatResult(generations=[ChatGeneration(message=reply)])
+        interaction, latency = self._replay(key)
+        await asyncio.sleep(latency)
+        return ChatResult(generations=[ChatGeneration(message=self._message(interaction))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        result = await self._agenerate(messages, stop, **kwargs)
+        reply = result.generations[0].message
+        # the latency was spent before the first chunk, the words follow right away
+        text = isinstance(reply.content, str) and reply.content and not reply.tool_calls
+        words = reply.content.split(" ") if text else [reply.content]
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            chunk = AIMessageChunk(
+                content=word if i == 0 else " " + word,
+                tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                    for index, call in enumerate(reply.tool_calls)
+                ] if last else [],
+                usage_metadata=reply.usage_metadata if last else None,
+            )
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    def bind_tools(self, tools, **kwargs):
+        # the tools themselves, which the real model needs in record mode
+        return self.bind(tools=list(tools), **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        def key(messages):
+            return cassette_key(_as_messages(messages), schema=schema.schema())
+
+        def replayed(key_):
+            interaction, latency = self._replay(key_)
+            return schema(**interaction["structured"]), latency
+
+        def respond(messages):
+            key_ = key(messages)
+            if self.mode == "record" and self.cassette.interactions.get(key_) is None:
+                start = time.perf_counter()
+                response = self._real_model().with_structured_output(schema, **kwargs).invoke(messages)
+                self.cassette.record(key_, {"structured": response.dict(), "latency": time.perf_counter() - start})
+                return response
+            response, latency = replayed(key_)
+            time.sleep(latency)
+            return response
+
+        async def arespond(messages):
+            key_ = key(messages)
+            if self.mode == "record" and self.cassette.interactions.get(key_) is None:
+                start = time.perf_counter()
+                response = await self._real_model().with_structured_output(schema, **kwargs).ainvoke(messages)
+                self.cassette.record(key_, {"structured": response.dict(), "latency": time.perf_counter() - start})
+                return response
+            response, latency = replayed(key_)
+            await asyncio.sleep(latency)
+            return response
+
+        return RunnableLambda(respond, afunc=arespond)
+
+
+def register_cassette(path, mode="replay", provider=None, name="cassette", latency_scale=1.0):
+    """
+    Registers the cassette model in MODELS and returns a graph config that uses it for every node.
+    """
+    MODELS[name] = (CassetteChatModel, {"model_name": name, "path": path, "mode": mode, "provider": provider,
+                                        "latency_scale": latency_scale})
+    return {"configurable": {"gather_model": name, "draft_model": name, "critique_model": name}}
@@ -0,0 +1,89 @@
+"""
+This benchmark grows `dharmaflow` threads on the persistent graph with the fake model: one character build early on that goes through draft, check and critique, then lore questions answered by `gather_requirements`. Each turn sends only the new message. At several thread lengths it reports what the checkpointer writes during one more turn, how long loading the thread's latest checkpoint takes, the size of that checkpoint and how many checkpoint rows the thread has, with compaction (pruned checkpoints and the `compact` node) and without it (every checkpoint kept, every message kept).
+
+Run with `python benchmarks/checkpoints.py [--turns 400]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from dharmabot.agent import dharmaflow  # noqa: E402
+from dharmabot.checkpointer import CompactingSqliteSaver  # noqa: E402
+from fake_models import register_fake_model, seed_github_file, synthetic_test_file  # noqa: E402
+
+GITHUB_URL = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+
+
+class TimedSaver(CompactingSqliteSaver):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_seconds = 0.0
+
+    def put(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().put(*args, **kwargs)
+        finally:
+            self.put_seconds += time.perf_counter() - start
+
+
+def question(turn):
+    if turn == 10:
+        return "ok build my character now"
+    return f"tell me more about the sanghas, question {turn}"
+
+
+async def grow(saver, config, turns, checkpoints):
+    graph = dharmaflow.compile(checkpointer=saver)
+    thread = {**config, "configurable": {**config["configurable"], "thread_id": "benchmark"}}
+    results = []
+    for turn in range(turns):
+        saver.put_seconds = 0.0
+        with contextlib.redirect_stdout(io.StringIO()):
+            await graph.ainvoke({"messages": [HumanMessage(content=question(turn))]}, thread)
+        if turn + 1 in checkpoints:
+            start = time.perf_counter()
+            for _ in range(20):
+                latest = saver.get_tuple(thread)
+            load = (time.perf_counter() - start) / 20
+            size = len(saver.serde.dumps_typed(latest.checkpoint)[1])
+            rows, = saver.conn.execute("SELECT count(*) FROM checkpoints WHERE thread_id = 'benchmark'").fetchone()
+            results.append((turn + 1, saver.put_seconds, load, size, rows, len(latest.checkpoint["channel_values"]["messages"])))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=400)
+    args = parser.parse_args()
+
+    config = register_fake_model("fake", latency=0.0, tool_trigger="build")
+    config["configurable"]["response_cache"] = False
+    seed_github_file(GITHUB_URL, synthetic_test_file(50))
+    checkpoints = {turns for turns in (25, 100, 200, 400, 1000) if turns <= args.turns}
+
+    print(f"{'mode':<10} {'turns':>6} {'turn writes ms':>15} {'load ms':>8} {'checkpoint KB':>14} {'rows':>6} {'messages':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, keep, compact in (("full", None, False), ("compacted", 4, True)):
+            saver = TimedSaver(os.path.join(directory, f"{mode}.db"), keep=keep)
+            mode_config = {"configurable": {**config["configurable"], "compact_messages": compact,
+                                            "thread_max_messages": 50 if compact else 10 ** 9}}
+            for turns, put_seconds, load, size, rows, messages in asyncio.run(grow(saver, mode_config, args.turns, checkpoints)):
+                print(f"{mode:<10} {turns:>6} {put_seconds * 1000:>15.2f} {load * 1000:>8.2f} {size / 1024:>14.1f} "
+                      f"{rows:>6} {messages:>9}")
+            saver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+This benchmark replays the draft -> check -> critique loop of `dharmaflow` over a set of drafts like the ones a model produces: most are right the first time, some have a syntax error, an edge to a misspelled node, no entry point or no path to END and are fixed on the next attempt, and popular questions get the same graph drafted again (with other comments) for the same requirements. The critique is simulated (it rejects the broken drafts and accepts the right ones, like the model does, and its latency is counted instead of slept). With `code_validation` off, static and compile, it reports the critique calls per accepted answer, the critique time that leaves and the local time the validation itself took, after checking that accepted code is only reused for the requirements it was accepted for.
+
+Run with `python benchmarks/code_validation.py [--questions 200] [--critique-latency 3.0]`.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from dharmabot.nodes.check import check  # noqa: E402
+from dharmabot.nodes.critique import Accept, _critique_update  # noqa: E402
+from dharmabot.validation import accepted_code, validate, validation_stats  # noqa: E402
+
+GOOD = """from langgraph.graph import StateGraph, MessagesState, END
+
+def {name}(state: MessagesState):
+    return {{"messages": [{{"role": "assistant", "content": "{name}"}}]}}
+
+def review(state: MessagesState):
+    return {{"messages": [{{"role": "assistant", "content": "reviewed"}}]}}
+
+builder = StateGraph(MessagesState)
+builder.add_node("{name}", {name})
+builder.add_node("review", review)
+builder.set_entry_point("{name}")
+builder.add_edge("{name}", "review")
+builder.add_edge("review", END)
+graph = builder.compile()"""
+
+BREAKAGES = [
+    lambda code: code.replace("def review(state: MessagesState):", "def review(state: MessagesState)"),
+    lambda code: code.replace('builder.add_edge("review", END)', 'builder.add_edge("reveiw", END)'),
+    lambda code: code.replace('builder.add_edge("review", END)', 'builder.add_edge("review", "review")').replace(", END", ""),
+    lambda code: "\n".join(line for line in code.splitlines() if "set_entry_point" not in line),
+]
+
+# right, and with no entry point the static checks can see: the router picks the first node at runtime
+CONDITIONAL_ENTRY = GOOD.format(name="plan").replace(
+    'builder.set_entry_point("plan")',
+    'builder.add_conditional_edges(START, lambda state: "plan")').replace("MessagesState, END", "MessagesState, START, END")
+
+
+def drafts(questions, seed=0):
+    """
+    For each question, its requirements and the drafts the model writes until one is right.
+    """
+    rng = random.Random(seed)
+    popular = [f"popular_{i}" for i in range(10)]
+    for question in range(questions):
+        name = rng.choice(popular) if rng.random() < 0.3 else f"step_{question}"
+        good = GOOD.format(name=name).replace("graph = ", f"# attempt for question {question}\ngraph = ")
+        attempts = []
+        if rng.random() < 0.3:
+            attempts.append((rng.choice(BREAKAGES)(good), False))
+        attempts.append((good, True))
+        yield f"A graph with a {name} node", attempts
+
+
+def run(mode, questions, critique_latency):
+    accepted_code.hashes.clear()
+    for key in validation_stats:
+        validation_stats[key] = 0
+    config = {"configurable": {"code_validation": mode}}
+    critique_calls, accepted, local_time = 0, 0, 0.0
+    for requirements, attempts in drafts(questions):
+        for code, right in attempts:
+            state = {"messages": [AIMessage(content=f"Here it is:\n\n```python\n{code}\n```")],
+                     "requirements": requirements}
+            start = time.perf_counter()
+            update = check(state, config)
+            local_time += time.perf_counter() - start
+            if "messages" in update:
+                # straight back to draft_answer
+                continue
+            if update.get("accepted"):
+                accepted += 1
+                break
+            critique_calls += 1
+            _critique_update({**state, **update}, Accept(logic="", accept=right))
+            if right:
+                accepted += 1
+                break
+    return critique_calls, accepted, critique_calls * critique_latency, local_time
+
+
+def check_conditional_entry():
+    """
+    A graph whose entry is a conditional edge from START without a path map passes both validations.
+    """
+    for mode in ("static", "compile"):
+        assert validate(CONDITIONAL_ENTRY, mode) is None, f"conditional entry from START rejected by {mode} validation"
+
+
+def check_scoped_to_requirements():
+    """
+    Code critique accepted for some requirements is still critiqued when drafted for other ones.
+    """
+    accepted_code.hashes.clear()
+    code = GOOD.format(name="popular_0")
+    accepted_code.add(code, "A graph with a popular_0 node")
+    assert accepted_code.accepts(f"# reformatted\n{code}", "A graph with a popular_0 node")
+    assert not accepted_code.accepts(code, "A graph with a popular_0 node that loops until done"), \
+        "accepted for other requirements"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--critique-latency", type=float, default=3.0, help="seconds per critique call")
+    args = parser.parse_args()
+
+    check_conditional_entry()
+    check_scoped_to_requirements()
+    print(f"{args.questions} questions, {args.critique_latency:.1f} s per critique call")
+    print(f"{'validation':<11} {'critiques':>10} {'per answer':>11} {'critique s':>11} {'local s':>8} {'by hash':>8}")
+    for mode in ("off", "static", "compile"):
+        critique_calls, accepted, critique_seconds, local_time = run(mode, args.questions, args.critique_latency)
+        print(f"{mode:<11} {critique_calls:>10} {critique_calls / accepted:>11.2f} {critique_seconds:>11.0f} "
+              f"{local_time:>8.2f} {validation_stats['accepted_by_hash']:>8}")
+
+
+if __name__ == "__main__":
+    main()
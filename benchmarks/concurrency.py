@@ -0,0 +1,63 @@
+"""
+This benchmark runs many `dharmaflow` conversations at the same time against fake models with a fixed latency, and reports how throughput scales with the number of conversations in flight. It compares the native async path (`graph.ainvoke`) with the old way of running the blocking `graph.invoke` in the default thread pool executor, where throughput stops scaling once every executor thread is parked on a model call.
+
+Run with `python benchmarks/concurrency.py [--latency 0.2] [--levels 1,10,100,500]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from dharmabot.agent import graph  # noqa: E402
+from fake_models import register_fake_model, seed_github_file, synthetic_test_file  # noqa: E402
+
+GITHUB_URL = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+
+
+def conversation(i):
+    return {"messages": [{"role": "user", "content": f"Build me a graph with a router, conversation {i}"}]}
+
+
+async def run_async(conversations, config):
+    return await asyncio.gather(*(graph.ainvoke(conversation(i), config) for i in range(conversations)))
+
+
+async def run_in_executor(conversations, config):
+    return await asyncio.gather(*(asyncio.to_thread(graph.invoke, conversation(i), config) for i in range(conversations)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds each fake model call takes")
+    parser.add_argument("--levels", default="1,10,50,100,250,500", help="comma separated conversations in flight")
+    parser.add_argument("--skip-executor", action="store_true", help="only run the async path")
+    args = parser.parse_args()
+
+    config = register_fake_model(latency=args.latency)
+    seed_github_file(GITHUB_URL, synthetic_test_file())
+    # gather, draft and critique: three model calls per conversation
+    ideal = 3 * args.latency
+    print(f"Each conversation makes 3 model calls, so it takes at least {ideal:.2f}s")
+
+    modes = [("ainvoke", run_async)] + ([] if args.skip_executor else [("invoke+executor", run_in_executor)])
+    print(f"{'mode':<16} {'in flight':>9} {'wall s':>8} {'conv/s':>8} {'speedup':>8}")
+    for mode, runner in modes:
+        for level in (int(level) for level in args.levels.split(",")):
+            start = time.perf_counter()
+            # the graph's test_node prints on every pass, which would drown out the results
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = asyncio.run(runner(level, config))
+            wall = time.perf_counter() - start
+            assert all(result.get("code") for result in results)
+            print(f"{mode:<16} {level:>9} {wall:>8.2f} {level / wall:>8.1f} {level * ideal / wall:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+This benchmark compares the prompt that `draft_answer` builds in `full` context mode (the whole LangGraph unit test file inlined) against `retrieval` mode (only the best matching test functions, packed into a token budget). It reports prompt size, estimated input tokens and the local time spent building the prompt, and with `--live` also the time-to-first-token of the draft model for both prompts.
+
+Run with `python benchmarks/context_selection.py [--file path/to/test_pregel.py] [--live]`.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from dharmabot.loader import load_github_file  # noqa: E402
+from dharmabot.nodes.draft import prompt  # noqa: E402
+from dharmabot.retrieval import build_index, estimate_tokens, select_context  # noqa: E402
+from fake_models import synthetic_test_file  # noqa: E402
+
+GITHUB_URL = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+
+QUERIES = [
+    ("A graph with a router that sends questions to a retriever node or straight to the answer node",
+     "How do I use add_conditional_edges with a function that returns the next node?"),
+    ("Chatbot with MessagesState and a tool node", "Can I interrupt before the tool node and resume later with a checkpointer?"),
+    ("Map-reduce over a list of documents", "How do I use Send to fan out to many nodes in parallel and then aggregate?"),
+    ("Subgraph for research inside a bigger graph", "How do I stream the output of a subgraph?"),
+]
+
+
+def time_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def time_to_first_token(system_prompt, requirements, question):
+    from dharmabot.model import _get_model
+
+    model = _get_model({"configurable": {}}, "anthropic", "draft_model")
+    start = time.perf_counter()
+    for _ in model.stream([{"role": "system", "content": system_prompt}, {"role": "user", "content": requirements},
+                           {"role": "user", "content": question}]):
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", help="path to a local copy of test_pregel.py")
+    parser.add_argument("--budget", type=int, default=None, help="context_token_budget for retrieval mode")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--live", action="store_true", help="also measure time-to-first-token against the real draft model")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as file:
+            file_contents = file.read()
+    else:
+        file_contents = load_github_file(GITHUB_URL)
+        if file_contents.startswith("Failed to load file"):
+            print("Could not load test_pregel.py, using a synthetic file of similar size")
+            file_contents = synthetic_test_file()
+
+    start = time.perf_counter()
+    build_index(file_contents)
+    print(f"Index build (once per file version): {(time.perf_counter() - start) * 1000:.1f} ms, "
+          f"{len(build_index(file_contents)[1].chunks)} chunks")
+
+    configs = {"full": {"configurable": {"context_mode": "full"}},
+               "retrieval": {"configurable": {"context_mode": "retrieval"}}}
+    if args.budget:
+        configs["retrieval"]["configurable"]["context_token_budget"] = args.budget
+
+    print(f"{'mode':<10} {'query':<6} {'chars':>9} {'~tokens':>8} {'build ms':>9} {'ttft s':>7}")
+    for mode, config in configs.items():
+        for i, (requirements, question) in enumerate(QUERIES):
+            messages = [{"role": "user", "content": question}]
+
+            def build():
+                return prompt.format(file=select_context(file_contents, requirements, messages, config))
+
+            system_prompt = build()
+            build_ms = time_ms(build, args.repeat)
+            ttft = f"{time_to_first_token(system_prompt, requirements, question):.2f}" if args.live else "-"
+            print(f"{mode:<10} {i:<6} {len(system_prompt):>9} {estimate_tokens(system_prompt):>8} {build_ms:>9.2f} {ttft:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+This benchmark plays long synthetic conversations through `agroq_basic` with a fake LLM whose latency grows with the number of input tokens, like a real one's time to first token does. It compares sending the whole conversation on every turn with the `ConversationMemory` (a token-budgeted window plus a rolling summary), and reports the input tokens and latency of the turns at several conversation lengths, and how many summary calls the memory needed. Before that it checks that the prompt stays bounded while every summary call fails, and that the blocking `groq_basic` path makes summaries too.
+
+Run with `python benchmarks/conversation_memory.py [--turns 1000] [--budget 3000]`; the "full" mode alone takes about two minutes at 1000 turns.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from dharmabot.retrieval import estimate_tokens  # noqa: E402
+from server.agents.conversation_memory import SUMMARY_PROMPT, ConversationMemory  # noqa: E402
+from server.agents.groq_basic import agroq_basic, groq_basic  # noqa: E402
+from langchain.schema import SystemMessage  # noqa: E402
+
+WORDS = "graph node edge state router memory summary token budget latency agent tool message stream".split()
+
+
+class FakeLLM:
+    def __init__(self, base_latency, seconds_per_token, fail_summaries=False):
+        self.base_latency = base_latency
+        self.seconds_per_token = seconds_per_token
+        # a summary model that is down
+        self.fail_summaries = fail_summaries
+        self.summary_calls = 0
+        self.reply_input_tokens = 0
+
+    def _call(self, messages):
+        tokens = sum(estimate_tokens(message.content) for message in messages)
+        if messages[0].content == SUMMARY_PROMPT:
+            self.summary_calls += 1
+        else:
+            self.reply_input_tokens = tokens
+        return self.base_latency + tokens * self.seconds_per_token
+
+    def _reply(self, messages):
+        if self.fail_summaries and messages[0].content == SUMMARY_PROMPT:
+            raise RuntimeError("summary model unavailable")
+        return AIMessage(content=" ".join(random.choices(WORDS, k=60)))
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self._call(messages))
+        return self._reply(messages)
+
+    def invoke(self, messages):
+        time.sleep(self._call(messages))
+        return self._reply(messages)
+
+
+def message(content, sender_type):
+    return {"id": str(uuid.uuid4()), "content": content, "sender_type": sender_type}
+
+
+async def play(turns, checkpoints, memory_budget, base_latency, seconds_per_token):
+    random.seed(0)
+    llm = FakeLLM(base_latency, seconds_per_token)
+    memory = ConversationMemory(llm, token_budget=memory_budget) if memory_budget else None
+    system_message = SystemMessage(content="You are a helpful AI assistant.")
+    conversation = []
+    results = []
+    for turn in range(1, turns + 1):
+        conversation.append(message(" ".join(random.choices(WORDS, k=random.randint(5, 80))), "User"))
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            reply = await agroq_basic(conversation, system_message, None, llm, memory, "benchmark")
+        latency = time.perf_counter() - start
+        conversation.append(message(reply, "Agent"))
+        if turn in checkpoints:
+            results.append((turn, len(conversation), llm.reply_input_tokens, latency))
+    return results, llm.summary_calls
+
+
+def check_bounded(turns, budget):
+    """
+    The prompt stays bounded when no summary can be made, and the blocking path makes summaries too.
+    """
+    system_message = SystemMessage(content="You are a helpful AI assistant.")
+    # at most the budget verbatim, the messages waiting for a summary up to their limit, and the system message
+    limit = 2 * budget + 100
+    random.seed(0)
+    llm = FakeLLM(0, 0, fail_summaries=True)
+    memory = ConversationMemory(llm, token_budget=budget, max_unsummarized_tokens=budget)
+
+    async def failing():
+        conversation = []
+        for _ in range(turns):
+            conversation.append(message(" ".join(random.choices(WORDS, k=random.randint(5, 80))), "User"))
+            # no backoff to wait out in a check, every turn may try a summary
+            memory._state("failing").retry_at = 0.0
+            conversation.append(message(await agroq_basic(conversation, system_message, None, llm, memory, "failing"), "Agent"))
+            assert llm.reply_input_tokens <= limit, f"{llm.reply_input_tokens} input tokens without summaries"
+            await asyncio.sleep(0)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(failing())
+    assert llm.summary_calls and memory.stats["dropped_messages"], "no summary was tried, or nothing was dropped"
+
+    llm = FakeLLM(0, 0)
+    memory = ConversationMemory(llm, token_budget=budget)
+    conversation = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(turns):
+            conversation.append(message(" ".join(random.choices(WORDS, k=random.randint(5, 80))), "User"))
+            conversation.append(message(groq_basic(conversation, system_message, None, llm, memory, "blocking"), "Agent"))
+            folding = memory._state("blocking").folding
+            if folding is not None:
+                folding.join()
+            assert llm.reply_input_tokens <= limit, f"{llm.reply_input_tokens} input tokens on the blocking path"
+    assert llm.summary_calls and memory.stats["summaries"], "the blocking path made no summaries"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--budget", type=int, default=3000, help="token budget of the memory")
+    parser.add_argument("--base-latency", type=float, default=0.01, help="seconds per LLM call")
+    parser.add_argument("--seconds-per-token", type=float, default=0.000002, help="extra seconds per input token")
+    args = parser.parse_args()
+
+    check_bounded(min(args.turns, 300), args.budget)
+    checkpoints = {turns for turns in (10, 50, 100, 250, 500, 1000, 2000, 5000) if turns <= args.turns}
+    print(f"{'mode':<8} {'turn':>6} {'messages':>9} {'input tokens':>13} {'latency ms':>11}")
+    for mode, budget in (("full", None), ("memory", args.budget)):
+        results, summaries = asyncio.run(play(args.turns, checkpoints, budget, args.base_latency, args.seconds_per_token))
+        for turn, messages, input_tokens, latency in results:
+            print(f"{mode:<8} {turn:>6} {messages:>9} {input_tokens:>13} {latency * 1000:>11.1f}")
+        if budget:
+            print(f"memory made {summaries} summary calls over {args.turns} turns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+This is the offline end-to-end benchmark of the whole server path. Chat turns go through the unchanged `MessageHandler.stream_message` and `GraphHandler`: the graph is refreshed and its versioned updates collected after every message, like `server.py` does. Everything runs on the in-memory store, with every model replaced by the deterministic fake chat models of `fake_models`, so nothing reaches OpenAI, Groq, Anthropic, Neo4j or GitHub. The fakes draw each call's latency from a configurable distribution and can inject critique rejections. `dharmaflow` runs its real graph, `Build` tool calls and checkpoints included. With `--cassette`, the dharmaflow models are recorded to or replayed from a cassette instead (see `cassettes`).
+
+For each agent it reports:
+- turns per second and p50/p99 turn latency;
+- the system's own time per turn, i.e. the mean turn latency minus the model latency the fakes simulated;
+- the memory each conversation keeps, measured with tracemalloc in a second pass.
+
+`--save` writes the results to a JSON baseline. `--baseline` compares with a saved one and exits with 1 when a metric is worse than `--tolerance`.
+
+Run with `python benchmarks/end_to_end.py [--agents groq_basic,dharmaflow] [--conversations 20] [--turns 12] [--latency 0.05] [--save baseline.json] [--baseline baseline.json]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# the server imports its agents as the `server` package and everything else as flat modules from src/server
+sys.path.insert(0, SRC)
+import server.agents.groq_basic  # noqa: E402
+sys.path.insert(1, os.path.join(SRC, "server"))
+
+CHECKPOINTS = tempfile.TemporaryDirectory()
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("groq_api_key", "benchmark")
+os.environ["DHARMABOT_CHECKPOINT_PATH"] = os.path.join(CHECKPOINTS.name, "checkpoints.db")
+
+from server.agents.conversation_memory import ConversationMemory  # noqa: E402
+from server.agents.model_router import ModelRouter  # noqa: E402
+from graph_handler import GraphHandler  # noqa: E402
+from memory_database import InMemoryDatabase  # noqa: E402
+from message_handler import MessageHandler  # noqa: E402
+
+from cassettes import cassettes, register_cassette  # noqa: E402
+from fake_models import (FAKE_LORE_ANSWER, FakeChatModel, fake_calls, fake_random, register_fake_model,  # noqa: E402
+                         seed_github_file, synthetic_test_file)
+
+GITHUB_URL = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+# metric -> whether higher is better
+METRICS = {"turns_per_second": True, "p50_ms": False, "p99_ms": False, "overhead_ms": False, "memory_kb_per_conversation": False}
+
+
+def question(turn):
+    # a build every fourth turn, lore questions otherwise
+    if turn % 4 == 3:
+        return f"ok, build me a graph with {turn % 3 + 2} nodes"
+    return f"what happens in the dharmaverse in chapter {turn}?"
+
+
+def fake_model(name, args):
+    return FakeChatModel(model_name=name, latency=args.latency, jitter=args.jitter, distribution=args.distribution,
+                         script=(FAKE_LORE_ANSWER,))
+
+
+def add_model_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.05, help="median seconds per model call")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--distribution", choices=("uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--reject-rate", type=float, default=0.2, help="share of critiques that reject the draft")
+    parser.add_argument("--cassette", help="record or replay the dharmaflow models with this cassette")
+    parser.add_argument("--cassette-mode", choices=("record", "replay"), default="replay")
+    parser.add_argument("--cassette-provider", default="openai", help="the real model to record")
+
+
+def use_offline_models(args):
+    """
+    Registers the fake (or cassette) model the dharmaflow nodes use and seeds the LangGraph test file.
+    """
+    seed_github_file(GITHUB_URL, synthetic_test_file(50))
+    if args.cassette:
+        register_cassette(args.cassette, args.cassette_mode, args.cassette_provider, name="benchmark")
+    else:
+        register_fake_model("benchmark", latency=args.latency, jitter=args.jitter, distribution=args.distribution,
+                            tool_trigger="build", reject_rate=args.reject_rate)
+    # MessageHandler runs dharmaflow_stream with the graph's default models, so it gets the benchmark ones instead
+    from server.agents import dharmaflow
+    original_stream = dharmaflow.dharmaflow_stream
+
+    def benchmark_stream(conversation, config=None, thread_id=None):
+        configurable = {"gather_model": "benchmark", "draft_model": "benchmark", "critique_model": "benchmark",
+                        "code_validation": "off"}
+        return original_stream(conversation, {"configurable": configurable, "recursion_limit": 100}, thread_id)
+
+    dharmaflow.dharmaflow_stream = benchmark_stream
+
+
+def create_handlers(agent, args):
+    """
+    A MessageHandler and GraphHandler on a fresh in-memory store, with offline models for `agent`.
+    """
+    database = InMemoryDatabase()
+    message_handler = MessageHandler(database)
+    message_handler.agent = agent
+    if agent == "groq_basic":
+        message_handler.llm_groq = fake_model("groq", args)
+        message_handler.llm_openai = fake_model("openai", args)
+        message_handler.memory = ConversationMemory(message_handler.llm_groq)
+        if message_handler.router is not None:
+            message_handler.router = ModelRouter({"groq": message_handler.llm_groq, "openai": message_handler.llm_openai})
+    return message_handler, GraphHandler(database)
+
+
+async def run_conversation(message_handler, graph_handler, conversation_id, turns, latencies):
+    frames = []
+
+    async def send(frame):
+        frames.append(frame)
+
+    version = None
+    await graph_handler.snapshot(conversation_id)
+    for turn in range(turns):
+        start = time.perf_counter()
+        await message_handler.stream_message(question(turn), "User", send, conversation_id)
+        await graph_handler.refresh(conversation_id)
+        for frame in await graph_handler.updates_since(conversation_id, version):
+            version = frame["version"]
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(agent, args, prefix):
+    message_handler, graph_handler = create_handlers(agent, args)
+    latencies = []
+    # the handlers print a few lines per turn
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_conversation(message_handler, graph_handler, f"{prefix}-{i}", args.turns, latencies)
+            for i in range(args.conversations)
+        ))
+        wall = time.perf_counter() - start
+    return message_handler, graph_handler, latencies, wall
+
+
+def measure(agent, args):
+    fake_random.seed(0)
+    fake_calls.clear()
+    _, _, latencies, wall = asyncio.run(run(agent, args, f"{agent}-timed"))
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    result = {
+        "turns_per_second": round(len(latencies) / wall, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+    if not (args.cassette and agent == "dharmaflow"):
+        # the model latency the fakes simulated, in the order the turns ran it
+        result["overhead_ms"] = round((mean - fake_calls["seconds"] / len(latencies)) * 1000, 2)
+
+    # a second pass for memory, tracemalloc slows everything down
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    handlers = asyncio.run(run(agent, args, f"{agent}-memory"))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del handlers
+    result["memory_kb_per_conversation"] = round((after - before) / args.conversations / 1024, 1)
+    return result
+
+
+def compare(baseline, results, tolerance):
+    regressions = []
+    print(f"\ncompared with the baseline of {baseline['meta']['saved_at']}")
+    print(f"{'agent':<11} {'metric':<27} {'baseline':>10} {'now':>10} {'change':>8}")
+    for agent, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline["results"].get(agent, {}).get(metric)
+            if old is None:
+                continue
+            change = (value - old) / old if old else 0.0
+            worse = -change if METRICS[metric] else change
+            mark = "  worse" if worse > tolerance else ""
+            if mark:
+                regressions.append((agent, metric))
+            print(f"{agent:<11} {metric:<27} {old:>10} {value:>10} {change:>+8.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--agents", default="groq_basic,dharmaflow")
+    parser.add_argument("--conversations", type=int, default=20, help="conversations running at the same time")
+    parser.add_argument("--turns", type=int, default=12, help="turns per conversation")
+    add_model_arguments(parser)
+    parser.add_argument("--save", help="write the results to this JSON baseline")
+    parser.add_argument("--baseline", help="compare with this JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="change counted as a regression")
+    args = parser.parse_args()
+
+    use_offline_models(args)
+    print(f"{args.conversations} conversations x {args.turns} turns, "
+          + (f"cassette {args.cassette} ({args.cassette_mode})" if args.cassette else
+             f"{args.latency * 1000:.0f} ms {args.distribution} model latency (jitter {args.jitter}), "
+             f"{args.reject_rate:.0%} critiques reject"))
+    print(f"{'agent':<11} {'turns/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'own ms':>7} {'KB/conv':>8}")
+    results = {}
+    for agent in args.agents.split(","):
+        result = results[agent] = measure(agent, args)
+        print(f"{agent:<11} {result['turns_per_second']:>8.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result.get('overhead_ms', float('nan')):>7.2f} {result['memory_kb_per_conversation']:>8.1f}")
+    if args.cassette:
+        print(f"cassette: {cassettes[args.cassette].stats}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+    if args.save:
+        meta = {"saved_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "python": platform.python_version(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")}}
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"\nbaseline saved to {args.save}")
+    if regressions:
+        print(f"\n{len(regressions)} metrics worse than the baseline by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
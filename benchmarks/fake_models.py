@@ -0,0 +1,211 @@
+"""
+This file contains a deterministic fake chat model for the benchmarks. It answers like the real models do for each node of the `dharmaflow` graph (a `Build` tool call for `gather_requirements`, or with `tool_trigger` a short lore answer to messages that do not contain it, a single python code block for `draft_answer`, an accepting `Accept` for `critique`, unless `broken_rate` and `reject_rate` inject drafts without code and rejecting reviews, or `script` and `review_script` set the replies and verdicts in turn) after a delay drawn from a configurable distribution, and registers itself in `dharmabot.model.MODELS` so the graph picks it up through the normal `_get_model` path without any network access. It also has a synthetic stand-in for the LangGraph unit test file, which can be seeded into the github file cache.
+"""
+
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from dharmabot.loader import github_file_cache, _sha256
+from dharmabot.model import MODELS
+
+FAKE_DRAFT = """Here is a graph that routes between two nodes:
+
+```python
+from langgraph.graph import StateGraph, MessagesState, END
+
+def answer(state: MessagesState):
+    return {"messages": [{"role": "assistant", "content": "hi"}]}
+
+builder = StateGraph(MessagesState)
+builder.add_node("answer", answer)
+builder.set_entry_point("answer")
+builder.add_edge("answer", END)
+graph = builder.compile()
+```"""
+
+
+FAKE_LORE_ANSWER = "Dharmaverse is a scifi world set in the year 2066, where most humans live in virtual realms."
+
+
+# seed it for reproducible rejections
+fake_random = random.Random(0)
+# model calls started, by kind ("tool", "draft", "review"), and under "seconds" the latency they simulated
+fake_calls = Counter()
+# next reply of each model's script
+script_positions = Counter()
+
+
+class FakeChatModel(BaseChatModel):
+    model_name: str = "fake"
+    latency: float = 0.5
+    # each call takes latency * uniform(1 - jitter, 1 + jitter), or with the "lognormal" distribution
+    # latency * lognormvariate(0, jitter): the same median with a long tail, like real providers have
+    jitter: float = 0.0
+    distribution: str = "uniform"
+    # when set, the tool is only called for user messages containing this text, others get a lore answer
+    tool_trigger: Optional[str] = None
+    temperature: float = 0
+    # share of drafts without a code block (sent back by check) and of reviews that reject the draft
+    broken_rate: float = 0.0
+    reject_rate: float = 0.0
+    # replies given in turn instead of the lore answer and the draft, and verdicts of the reviews in turn instead
+    # of reject_rate; tuples, so the model registry can key on them
+    script: Optional[Tuple[str, ...]] = None
+    review_script: Optional[Tuple[bool, ...]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _reply(self, messages: List[BaseMessage], tools=None) -> AIMessage:
+        reply = self._answer(messages, tools)
+        # about four characters per token, like the real tokenizers
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = max(1, len(reply.content) // 4)
+        reply.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        return reply
+
+    def _answer(self, messages: List[BaseMessage], tools=None) -> AIMessage:
+        fake_calls["tool" if tools else "draft"] += 1
+        if tools:
+            last_user_message = next((m.content for m in reversed(messages) if m.type == "human"), "")
+            if self.tool_trigger is not None and self.tool_trigger not in last_user_message:
+                return AIMessage(content=self._next(self.script, "text") if self.script else FAKE_LORE_ANSWER)
+            return AIMessage(content="", tool_calls=[
+                {"name": tools[0], "args": {"requirements": last_user_message}, "id": f"call_{uuid.uuid4().hex[:8]}"}
+            ])
+        if self.script:
+            return AIMessage(content=self._next(self.script, "text"))
+        if fake_random.random() < self.broken_rate:
+            return AIMessage(content=FAKE_DRAFT.split("```")[0].strip())
+        return AIMessage(content=FAKE_DRAFT)
+
+    def _next(self, script, kind):
+        position = script_positions[self.model_name, kind]
+        script_positions[self.model_name, kind] += 1
+        return script[position % len(script)]
+
+    def _latency(self):
+        if self.distribution == "lognormal":
+            latency = self.latency * fake_random.lognormvariate(0, self.jitter)
+        else:
+            latency = self.latency * fake_random.uniform(1 - self.jitter, 1 + self.jitter)
+        fake_calls["seconds"] += latency
+        return latency
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency())
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, kwargs.get("tools")))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency())
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, kwargs.get("tools")))])
+
+    def _chunks(self, reply):
+        if reply.tool_calls:
+            tool_call = reply.tool_calls[0]
+            return [AIMessageChunk(content="", usage_metadata=reply.usage_metadata, tool_call_chunks=[
+                {"name": tool_call["name"], "args": json.dumps(tool_call["args"]), "id": tool_call["id"], "index": 0}
+            ])]
+        words = reply.content.split(" ")
+        chunks = [AIMessageChunk(content=word if i == 0 else " " + word) for i, word in enumerate(words)]
+        # the usage comes with the last chunk, as with stream_usage
+        chunks[-1].usage_metadata = reply.usage_metadata
+        return chunks
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = self._chunks(self._reply(messages, kwargs.get("tools")))
+        latency = self._latency()
+        # half the latency before the first token, the rest spread over the tokens
+        time.sleep(latency / 2)
+        for chunk in chunks:
+            time.sleep(latency / 2 / len(chunks))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        chunks = self._chunks(self._reply(messages, kwargs.get("tools")))
+        latency = self._latency()
+        await asyncio.sleep(latency / 2)
+        for chunk in chunks:
+            await asyncio.sleep(latency / 2 / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[getattr(tool, "__name__", str(tool)) for tool in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        def review():
+            fake_calls["review"] += 1
+            if self.review_script:
+                accept = self._next(self.review_script, "review")
+            else:
+                accept = fake_random.random() >= self.reject_rate
+            if not accept:
+                return schema(logic="The graph never reaches END.", accept=False)
+            return schema(logic="The nodes and edges look right.", accept=True)
+
+        def respond(_):
+            time.sleep(self._latency())
+            return review()
+
+        async def arespond(_):
+            await asyncio.sleep(self._latency())
+            return review()
+
+        return RunnableLambda(respond, afunc=arespond)
+
+
+def synthetic_test_file(tests=400):
+    """
+    A stand-in for test_pregel.py of roughly the same size and vocabulary, for when it cannot be downloaded.
+    """
+    topics = ["conditional_edges", "checkpointer", "interrupt_before", "send", "subgraph", "stream_mode", "messages_state",
+              "retry_policy", "channels", "state_schema", "in_memory_saver", "add_messages", "end_node", "reducer"]
+    lines = ["import operator", "from typing import Annotated, TypedDict", "",
+             "from langgraph.graph import END, START, StateGraph, MessagesState", "from langgraph.checkpoint.memory import MemorySaver", ""]
+    for i in range(tests):
+        topic = topics[i % len(topics)]
+        lines += [
+            f"def test_{topic}_{i}(snapshot) -> None:",
+            "    class State(TypedDict):",
+            "        value: Annotated[list, operator.add]",
+            "",
+            "    def node_a(state: State) -> dict:",
+            f"        return {{'value': ['{topic}']}}",
+            "",
+            "    builder = StateGraph(State)",
+            "    builder.add_node('a', node_a)",
+            "    builder.add_edge(START, 'a')",
+            f"    builder.add_conditional_edges('a', lambda s: END if len(s['value']) > {i % 5} else 'a')",
+            f"    app = builder.compile(checkpointer=MemorySaver(), interrupt_before={['a'] if 'interrupt' in topic else []})",
+            f"    assert app.invoke({{'value': []}}, {{'configurable': {{'thread_id': '{i}'}}}}) == {{'value': ['{topic}'] * {i % 5 + 1}}}",
+            "",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def seed_github_file(url, content):
+    """
+    Put `content` in the in-memory layer of the github file cache so nodes never touch the network.
+    """
+    github_file_cache.memory[url] = {"url": url, "digest": _sha256(content), "fetched_at": time.time(), "content": content}
+
+
+def register_fake_model(name="fake", **params):
+    MODELS[name] = (FakeChatModel, {"model_name": name, **params})
+    return {"configurable": {"gather_model": name, "draft_model": name, "critique_model": name}}
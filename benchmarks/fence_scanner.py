@@ -0,0 +1,74 @@
+"""
+This microbenchmark compares the regex `extract_python_code` used to run (`re.findall(r'```python\s*(.*?)\s*(```|$)', text, re.DOTALL)`) with the `CodeBlockScanner` that replaced it, on replies of a few hundred KB: a normal long reply, one full of stray fences, and adversarial ones whose long whitespace runs make the regex's lazy `.*?` re-scan the same whitespace at every position. For each it reports the time to extract the blocks from the whole text, the time to feed the same text to the scanner in small streamed chunks, and how far into a reply with two code blocks the scanner knows it has more than one.
+
+Run with `python benchmarks/fence_scanner.py [--size 300000] [--chunk 16]`.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from dharmabot.nodes.check import CodeBlockScanner, extract_python_code  # noqa: E402
+
+OLD_PATTERN = re.compile(r'```python\s*(.*?)\s*(```|$)', re.DOTALL)
+
+
+def inputs(size):
+    code = "def node(state):\n    return {'messages': []}\n\n"
+    prose = "LangGraph builds a graph of nodes and edges. "
+    return {
+        "long reply": prose * (size // 2 // len(prose)) + "```python\n" + code * (size // 2 // len(code)) + "```",
+        "stray fences": ("text ``` more `` ```python\n" + code * 3 + "```\n") * (size // 200),
+        "whitespace runs": "```python\n" + (" " * 2000 + "x") * (size // 2001),
+        "unclosed + runs": "intro\n```python\n" + ("\t" * 500 + "\n" * 500 + "y = 2") * (size // 1005),
+    }
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def streamed(text, chunk):
+    scanner = CodeBlockScanner()
+    for i in range(0, len(text), chunk):
+        scanner.feed(text[i:i + chunk])
+    return scanner.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=300_000, help="characters per input")
+    parser.add_argument("--chunk", type=int, default=16, help="characters per streamed chunk")
+    args = parser.parse_args()
+
+    print(f"{'input':<16} {'KB':>5} {'regex ms':>10} {'scanner ms':>11} {'streamed ms':>12} {'same':>5}")
+    for name, text in inputs(args.size).items():
+        regex_time, expected = timed(lambda: OLD_PATTERN.findall(text), repeat=1)
+        scanner_time, blocks = timed(lambda: extract_python_code(text))
+        streamed_time, streamed_blocks = timed(lambda: streamed(text, args.chunk))
+        same = blocks == expected == streamed_blocks
+        print(f"{name:<16} {len(text) // 1000:>5} {regex_time * 1000:>10.1f} {scanner_time * 1000:>11.2f} "
+              f"{streamed_time * 1000:>12.1f} {str(same):>5}")
+
+    # a reply that opens a second block early and then goes on for a long time
+    reply = "```python\nx = 1\n```\nand also\n```python\n" + "y = 2\n" * (args.size // 6)
+    scanner = CodeBlockScanner()
+    for i in range(0, len(reply), args.chunk):
+        if scanner.feed(reply[i:i + args.chunk]).multiple:
+            print(f"\nsecond block detected after {i + args.chunk} of {len(reply)} characters "
+                  f"({(i + args.chunk) / len(reply):.3%} of the reply); the regex needs all of it")
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+This benchmark times the extraction of a conversation graph for a synthetic conversation with a very large number of messages. "before" is the old path: one row of whole (c, m, sender) nodes per message, deduplicated and relabelled row by row in Python. "after" is the aggregated path of `GraphHandler.get_conversation_graph`: one row with only the projected fields, turned into nodes and links by the compact builder, optionally limited to the newest messages.
+
+By default it runs on the `InMemoryDatabase`, which shows the Python side of the work. With `--uri` it seeds a synthetic conversation in a Neo4j instance (in batches, under its own conversation id) and times both Cypher queries there as well.
+
+Run with `python benchmarks/graph_extraction.py [--messages 100000] [--limit 1000] [--uri bolt://localhost:7687 --user neo4j --password ...]`.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.join(SRC, "server"))
+
+from async_database import AsyncNeo4jDatabase  # noqa: E402
+from graph_handler import GraphHandler  # noqa: E402
+from memory_database import FakeNode, InMemoryDatabase  # noqa: E402
+
+CONVERSATION_ID = "benchmark-graph-extraction"
+
+SEED_QUERY = """
+    MERGE (c:Conversation {id: $conversation_id})
+    WITH c
+    MATCH (user:User {id: 'test_user'}), (agent:Agent {id: 'test_agent'})
+    UNWIND $messages AS row
+    CREATE (m:Message {id: row.id, content: row.content, timestamp: datetime(row.timestamp)})
+    CREATE (c)-[:HAS_MESSAGE]->(m)
+    WITH m, row, CASE WHEN row.user THEN user ELSE agent END AS sender
+    CREATE (sender)-[:SENT]->(m)
+"""
+
+
+def build_graph_from_records(result):
+    # the extraction loop GraphHandler.get_conversation_graph used before
+    nodes = []
+    links = []
+    node_ids = set()
+
+    for record in result:
+        conversation = record["c"]
+        message = record["m"]
+        sender = record["sender"]
+
+        if conversation["id"] not in node_ids:
+            nodes.append({
+                "id": conversation["id"],
+                "label": f"Conversation: {conversation['id']}",
+                "type": "conversation"
+            })
+            node_ids.add(conversation["id"])
+
+        if message["id"] not in node_ids:
+            nodes.append({
+                "id": message["id"],
+                "label": f"Message: {message['content'][:20]}...",
+                "type": "message"
+            })
+            node_ids.add(message["id"])
+
+        if sender["id"] not in node_ids:
+            nodes.append({
+                "id": sender["id"],
+                "label": f"{list(sender.labels)[0]}: {sender['id']}",
+                "type": list(sender.labels)[0].lower()
+            })
+            node_ids.add(sender["id"])
+
+        links.append({
+            "source": conversation["id"],
+            "target": message["id"],
+            "type": "HAS_MESSAGE"
+        })
+        links.append({
+            "source": sender["id"],
+            "target": message["id"],
+            "type": "SENT"
+        })
+
+    return {
+        "nodes": nodes,
+        "links": links
+    }
+
+
+def synthetic_messages(count):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        yield {
+            "id": str(uuid.uuid4()),
+            "content": f"synthetic message number {i} " + "lorem ipsum dolor sit amet " * 4,
+            "timestamp": start + timedelta(seconds=i),
+            "user": i % 2 == 0,
+        }
+
+
+def seed_memory(database, count):
+    database._conversation(CONVERSATION_ID)
+    database.messages[CONVERSATION_ID] = [
+        (FakeNode(["Message"], id=row["id"], content=row["content"], timestamp=row["timestamp"]),
+         database.senders["User" if row["user"] else "Agent"])
+        for row in synthetic_messages(count)
+    ]
+
+
+async def seed_neo4j(database, count, batch_size=5000):
+    await database.run_query("MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m) DETACH DELETE m",
+                             {"conversation_id": CONVERSATION_ID})
+    batch = []
+    for row in synthetic_messages(count):
+        batch.append({**row, "timestamp": row["timestamp"].isoformat()})
+        if len(batch) == batch_size:
+            await database.run_query(SEED_QUERY, {"conversation_id": CONVERSATION_ID, "messages": batch})
+            batch = []
+    if batch:
+        await database.run_query(SEED_QUERY, {"conversation_id": CONVERSATION_ID, "messages": batch})
+
+
+async def timed(label, coroutine_function, repeats):
+    best_extract = best_encode = None
+    for _ in range(repeats):
+        # like timeit, keep the collector (which scans every one of these objects) out of the timings
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            graph_data = await coroutine_function()
+            extracted = time.perf_counter()
+            encoded = json.dumps(graph_data)
+            encode = time.perf_counter() - extracted
+        finally:
+            gc.enable()
+        extract = extracted - start
+        best_extract = extract if best_extract is None else min(best_extract, extract)
+        best_encode = encode if best_encode is None else min(best_encode, encode)
+    print(f"{label:<28} {best_extract * 1000:>10.1f} {best_encode * 1000:>10.1f} "
+          f"{len(graph_data['nodes']):>8} {len(graph_data['links']):>8} {len(encoded) / 1e6:>8.2f}")
+
+
+async def run(database, limit, repeats):
+    graph_handler = GraphHandler(database)
+
+    async def before():
+        return build_graph_from_records(await database.get_conversation_records(CONVERSATION_ID))
+
+    print(f"{'path':<28} {'extract ms':>10} {'encode ms':>10} {'nodes':>8} {'links':>8} {'MB json':>8}")
+    await timed("before (row per message)", before, repeats)
+    await timed("after (aggregated)", lambda: graph_handler.get_conversation_graph(CONVERSATION_ID, None), repeats)
+    await timed(f"after, newest {limit}", lambda: graph_handler.get_conversation_graph(CONVERSATION_ID, limit), repeats)
+
+
+async def main_async(args):
+    if args.uri:
+        database = AsyncNeo4jDatabase(args.uri, args.user, args.password)
+        try:
+            print(f"Seeding {args.messages} messages into Neo4j...")
+            await seed_neo4j(database, args.messages)
+            await run(database, args.limit, args.repeats)
+        finally:
+            await database.close()
+    else:
+        database = InMemoryDatabase()
+        seed_memory(database, args.messages)
+        await run(database, args.limit, args.repeats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000, help="messages in the synthetic conversation")
+    parser.add_argument("--limit", type=int, default=1000, help="newest messages for the limited extraction")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per path, the best is reported")
+    parser.add_argument("--uri", help="Neo4j URI, the in-memory database is used without it")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
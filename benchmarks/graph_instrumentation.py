@@ -0,0 +1,71 @@
+"""
+This benchmark measures what `dharmabot.instrumentation` costs. It runs the same `dharmaflow` turns on the fake model with no model latency (so the graph's own overhead is all there is to measure), lore questions answered by `gather_requirements` and builds that go through draft, check and critique, alternately with and without `graph_metrics` in the callbacks, and reports the mean time per turn of each and the difference. At the end it prints the thread summary and the start of the Prometheus text of the instrumented runs.
+
+Run with `python benchmarks/graph_instrumentation.py [--turns 300]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from dharmabot.agent import graph  # noqa: E402
+from dharmabot.instrumentation import graph_metrics, instrument  # noqa: E402
+from fake_models import register_fake_model, seed_github_file, synthetic_test_file  # noqa: E402
+
+GITHUB_URL = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+
+
+async def turn(question, config):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await graph.ainvoke({"messages": [{"role": "user", "content": question}]}, config)
+    return time.perf_counter() - start
+
+
+async def run(turns):
+    config = register_fake_model("fake", latency=0.0, tool_trigger="build")
+    # no cache hits, so both sides make the same calls
+    config["configurable"].update(response_cache=False, code_validation="off", thread_id="benchmark")
+    plain, instrumented = [], []
+    for i in range(turns):
+        question = "ok build it" if i % 4 == 3 else f"what is the dharmaverse, question {i}"
+        # alternate which goes first, so neither side always gets the warmer caches
+        if i % 2:
+            plain.append(await turn(question, config))
+            instrumented.append(await turn(question, instrument(config)))
+        else:
+            instrumented.append(await turn(question, instrument(config)))
+            plain.append(await turn(question, config))
+    return plain, instrumented
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=300)
+    args = parser.parse_args()
+
+    seed_github_file(GITHUB_URL, synthetic_test_file(50))
+    asyncio.run(run(20))
+    graph_metrics.reset()
+    plain, instrumented = asyncio.run(run(args.turns))
+    plain_ms, instrumented_ms = sum(plain) / len(plain) * 1000, sum(instrumented) / len(instrumented) * 1000
+    print(f"{args.turns} turns, one build in four, no model latency")
+    print(f"{'':<14} {'ms per turn':>12}")
+    print(f"{'plain':<14} {plain_ms:>12.3f}")
+    print(f"{'instrumented':<14} {instrumented_ms:>12.3f}")
+    print(f"overhead: {(instrumented_ms - plain_ms) * 1000:.0f} us per turn ({instrumented_ms / plain_ms - 1:.1%})")
+    print()
+    print(json.dumps(graph_metrics.thread_summary("benchmark"), indent=1))
+    print("\n".join(graph_metrics.prometheus().splitlines()[:20]))
+
+
+if __name__ == "__main__":
+    main()
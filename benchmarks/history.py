@@ -0,0 +1,71 @@
+"""
+This benchmark measures what one turn costs the `MessageHandler` in database work as a conversation grows: storing the user message and getting the history the LLM is called with. It compares refetching the whole conversation with `get_messages` (the old way) against the `HistoryCache`, which appends stored messages to a bounded window and only reads the rows after its cursor. It runs on the `InMemoryDatabase`, so the numbers show how the cost scales rather than Neo4j round-trip times.
+
+Run with `python benchmarks/history.py [--sizes 1000,10000,50000] [--turns 200]`.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.join(SRC, "server"))
+
+from history_cache import HistoryCache  # noqa: E402
+from memory_database import InMemoryDatabase  # noqa: E402
+
+
+async def seed(database, size, conversation_id):
+    for i in range(size):
+        await database.add_message(f"message {i} " + "lorem ipsum " * 10, "User" if i % 2 == 0 else "Agent", conversation_id)
+
+
+async def refetch_turn(database, history, conversation_id, i):
+    await database.add_message(f"turn {i}", "User", conversation_id)
+    return await database.get_messages(conversation_id)
+
+
+async def cached_turn(database, history, conversation_id, i):
+    message = await database.add_message(f"turn {i}", "User", conversation_id)
+    history.append(conversation_id, message)
+    return await history.get(conversation_id)
+
+
+async def run(size, turns, window):
+    results = {}
+    for mode, turn in (("refetch", refetch_turn), ("history cache", cached_turn)):
+        database = InMemoryDatabase()
+        await seed(database, size, "bench")
+        history = HistoryCache(database, window=window)
+        # the first get loads the window, every turn after that is incremental
+        await history.get("bench")
+        loaded = history.stats["rows_read"]
+        rows_read = 0
+        start = time.perf_counter()
+        for i in range(turns):
+            messages = await turn(database, history, "bench", i)
+            if mode == "refetch":
+                rows_read += len(messages)
+        if mode == "history cache":
+            rows_read = history.stats["rows_read"] - loaded
+        results[mode] = ((time.perf_counter() - start) / turns * 1000, len(messages), rows_read / turns)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="comma separated conversation lengths")
+    parser.add_argument("--turns", type=int, default=200, help="turns measured per size")
+    parser.add_argument("--window", type=int, default=200, help="messages kept per cached conversation")
+    args = parser.parse_args()
+
+    print(f"{'messages':>9} {'mode':<14} {'ms/turn':>9} {'history len':>12} {'rows/turn':>10}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        for mode, (ms, length, rows_read) in asyncio.run(run(size, args.turns, args.window)).items():
+            print(f"{size:>9} {mode:<14} {ms:>9.3f} {length:>12} {rows_read:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+This benchmark simulates the `ModelRouter` against two fake providers with injected latency distributions: a fast provider (standing in for Groq) with a heavy tail and an outage in the middle of the run, and a slower but steadier one (standing in for OpenAI). The same stream of requests is sent to the fast provider alone, through the router without hedging and through the router with hedging, and the latency percentiles seen by the callers, the failed requests and the extra calls the hedges cost are reported, for whole replies and for the first streamed token. The behaviour itself (routing, hedging, cancelling, routing around errors) is asserted by `tests/test_model_routing.py`, which runs with `python -m pytest`.
+
+Run with `python benchmarks/model_routing.py [--requests 2000] [--concurrency 20] [--scale 0.1]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+
+from server.agents.model_router import ModelRouter  # noqa: E402
+
+
+class FakeProvider:
+    """
+    Latency is lognormal around `median` seconds, and with probability `spike_rate` multiplied by `spike`.
+    Between `outage` fractions of the run every call fails after a short delay.
+    """
+
+    def __init__(self, rng, median, sigma, spike_rate=0.0, spike=1.0, error_rate=0.0, outage=None, scale=1.0):
+        self.rng = rng
+        self.median = median
+        self.sigma = sigma
+        self.spike_rate = spike_rate
+        self.spike = spike
+        self.error_rate = error_rate
+        self.outage = outage
+        self.scale = scale
+        self.progress = lambda: 0.0
+        self.calls = 0
+
+    def _latency(self):
+        latency = self.median * self.rng.lognormvariate(0, self.sigma)
+        if self.rng.random() < self.spike_rate:
+            latency *= self.spike
+        return latency * self.scale
+
+    def _failing(self):
+        if self.outage and self.outage[0] <= self.progress() < self.outage[1]:
+            return True
+        return self.rng.random() < self.error_rate
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        if self._failing():
+            await asyncio.sleep(0.05 * self.scale)
+            raise RuntimeError("provider unavailable")
+        await asyncio.sleep(self._latency())
+        return AIMessage(content="reply")
+
+    async def astream(self, messages):
+        self.calls += 1
+        if self._failing():
+            await asyncio.sleep(0.05 * self.scale)
+            raise RuntimeError("provider unavailable")
+        # the latency distribution is the time to the first token here, the rest streams quickly
+        await asyncio.sleep(self._latency())
+        for _ in range(5):
+            yield AIMessageChunk(content="token ")
+            await asyncio.sleep(0.001 * self.scale)
+
+
+def providers(seed, scale):
+    rng = random.Random(seed)
+    return {
+        "groq": FakeProvider(rng, median=0.4, sigma=0.3, spike_rate=0.03, spike=12, error_rate=0.01,
+                             outage=(0.4, 0.5), scale=scale),
+        "openai": FakeProvider(rng, median=0.9, sigma=0.2, spike_rate=0.01, spike=3, error_rate=0.01, scale=scale),
+    }
+
+
+async def play(mode, kind, args):
+    fakes = providers(0, args.scale)
+    if mode == "groq only":
+        llm = fakes["groq"]
+    else:
+        # errors are forgotten after 5 simulated seconds instead of 60 real ones
+        llm = ModelRouter(fakes, hedge=(mode == "router + hedge"), error_window_seconds=5 * args.scale)
+    done = 0
+    for fake in fakes.values():
+        fake.progress = lambda: done / args.requests
+    latencies, failures = [], 0
+    queue = list(range(args.requests))
+
+    async def worker():
+        nonlocal done, failures
+        while queue:
+            queue.pop()
+            start = time.perf_counter()
+            try:
+                if kind == "invoke":
+                    await llm.ainvoke([])
+                else:
+                    async for _ in llm.astream([]):
+                        break
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                failures += 1
+            done += 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        # cancelled losers finish their cleanup
+        await asyncio.sleep(0.01)
+    latencies.sort()
+    calls = sum(fake.calls for fake in fakes.values())
+    return [latencies[int(len(latencies) * p)] / args.scale for p in (0.5, 0.95, 0.99)], failures, calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scale", type=float, default=0.1, help="simulated seconds -> real seconds")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, latencies in simulated seconds")
+    print(f"{'kind':<7} {'mode':<15} {'p50':>6} {'p95':>6} {'p99':>6} {'failed':>7} {'extra calls':>12}")
+    for kind in ("invoke", "stream"):
+        for mode in ("groq only", "router", "router + hedge"):
+            (p50, p95, p99), failures, calls = asyncio.run(play(mode, kind, args))
+            extra = calls / args.requests - 1
+            print(f"{kind:<7} {mode:<15} {p50:>6.2f} {p95:>6.2f} {p99:>6.2f} {failures:>7} {extra:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
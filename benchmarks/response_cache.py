@@ -0,0 +1,106 @@
+"""
+This benchmark sends a stream of first-turn questions through `gather_requirements` with the fake model, the way users arrive at DharmaBot: most of them ask one of a few Dharmaverse FAQs, in their own words, and some ask to create their character, which ends in a `Build` tool call. It runs the stream with the response cache off and on and reports the hit rate of each tier, the latency of the turns and the seconds the cache saved, checks that no `Build` turn was answered from the cache, and that a reply to a user who introduced themselves is not served to another user.
+
+Run with `python benchmarks/response_cache.py [--turns 500] [--latency 0.05]`.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from dharmabot.nodes.gather_requirements import agather_requirements  # noqa: E402
+from dharmabot.response_cache import ResponseCache, response_cache  # noqa: E402
+from fake_models import register_fake_model  # noqa: E402
+
+BUILD_TRIGGER = "create my character"
+
+# each FAQ in the ways users phrase it, most common first
+FAQS = [
+    ["What is Dharmaverse?", "what is the dharmaverse", "whats dharmaverse", "What's Dharmaverse??"],
+    ["What sanghas are there?", "which sanghas are there", "what sanghas are there"],
+    ["What is DharmaRPG?", "what is dharmarpg", "What's DharmaRPG?"],
+    ["Are you sentient?", "are you sentient", "r u sentient?"],
+    ["Who are the Gaians?", "who are the gaians", "Who are Gaians?"],
+    ["Who are the Wallaians?", "who are the wallaians"],
+    ["What do I get for playing?", "what do i get for playing"],
+]
+BUILD_REQUESTS = [f"I am ready, let's {BUILD_TRIGGER}", f"ok {BUILD_TRIGGER} now", f"Please {BUILD_TRIGGER}"]
+ONE_OFFS = ["How cold is it in 2066?", "Can cybernetics be hacked?", "Is there money in the virtual realms?",
+            "Do the storms ever stop?", "What was the revelation?"]
+
+
+def workload(turns, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(FAQS))]
+    questions = []
+    for _ in range(turns):
+        roll = rng.random()
+        if roll < 0.1:
+            questions.append(rng.choice(BUILD_REQUESTS))
+        elif roll < 0.2:
+            questions.append(f"{rng.choice(ONE_OFFS)} (asked {rng.randint(0, 10 ** 6)})")
+        else:
+            questions.append(rng.choice(rng.choices(FAQS, weights)[0]))
+    return questions
+
+
+def check_personal():
+    """
+    Replies to users who introduced themselves are never served to someone else.
+    """
+    cache = ResponseCache()
+    bob = [HumanMessage(content="Hi, I am Bob. What sanghas are there in the Dharmaverse?")]
+    cache.put(cache.key("v", bob), AIMessage(content="Hi Bob! The sanghas are..."), 1.0)
+    alice = [HumanMessage(content="Hi, I am Alice. What sanghas are there in the Dharmaverse?")]
+    assert cache.get(cache.key("v", alice)) is None, "Bob's reply served to Alice"
+    earlier = [HumanMessage(content="My name is Bob"), AIMessage(content="Hi Bob!"),
+               HumanMessage(content="What is Dharmaverse?"), AIMessage(content="A metaverse.")]
+    cache.put(cache.key("v", earlier + [HumanMessage(content="What is my name?")]), AIMessage(content="Bob."), 1.0)
+    alice = [HumanMessage(content="My name is Alice"), AIMessage(content="Hi Alice!")] + earlier[2:]
+    assert cache.get(cache.key("v", alice + [HumanMessage(content="What is my name?")])) is None, "Bob's name told to Alice"
+    assert cache.report()["stored"] == 0
+
+
+async def run(questions, config):
+    latencies, cached_builds = [], 0
+    for question in questions:
+        start = time.perf_counter()
+        update = await agather_requirements({"messages": [HumanMessage(content=question)]}, config)
+        latencies.append(time.perf_counter() - start)
+        if BUILD_TRIGGER in question and "requirements" not in update:
+            cached_builds += 1
+    latencies.sort()
+    return latencies, cached_builds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake model call")
+    args = parser.parse_args()
+
+    check_personal()
+    config = register_fake_model("fake", latency=args.latency, tool_trigger=BUILD_TRIGGER)
+    questions = workload(args.turns)
+    print(f"{args.turns} first turns, {args.latency * 1000:.0f} ms per model call")
+    print(f"{'cache':<6} {'p50 ms':>8} {'mean ms':>8} {'exact':>6} {'semantic':>9} {'hit rate':>9} {'saved s':>8} {'cached Build':>13}")
+    for enabled in (False, True):
+        # with the cache off the node neither reads nor writes it, so the "on" run starts empty
+        config["configurable"]["response_cache"] = enabled
+        latencies, cached_builds = asyncio.run(run(questions, config))
+        report = response_cache.report() if enabled else ResponseCache().report()
+        print(f"{'on' if enabled else 'off':<6} {latencies[len(latencies) // 2] * 1000:>8.2f} "
+              f"{sum(latencies) / len(latencies) * 1000:>8.2f} {report['exact_hits']:>6} {report['semantic_hits']:>9} "
+              f"{report['hit_rate']:>9.1%} {report['saved_seconds']:>8.2f} {cached_builds:>13}")
+
+
+if __name__ == "__main__":
+    main()
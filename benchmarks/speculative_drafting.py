@@ -0,0 +1,81 @@
+"""
+This benchmark compares the sequential draft -> check -> critique loop of `dharmaflow` with speculative drafting (`draft_candidates` of 2 to 4, see `dharmabot.nodes.speculate`) on the fake model, with injected rejections: a share of the drafts comes without a code block, so `check` sends it back, and a share of the reviews rejects the draft. For each rejection rate and number of candidates it runs the same build questions through the graph and reports the wall-clock time to the accepted answer (mean, p50 and p90) the draft and review calls started per answer, which is what the speed costs, and the candidates cancelled per answer once another was accepted.
+
+Run with `python benchmarks/speculative_drafting.py [--questions 30] [--latency 0.2] [--sync]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from dharmabot.agent import graph  # noqa: E402
+from dharmabot.nodes.speculate import speculation_stats  # noqa: E402
+from fake_models import fake_calls, fake_random, register_fake_model, seed_github_file, synthetic_test_file  # noqa: E402
+
+GITHUB_URL = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+
+
+def question_input(question):
+    return {"messages": [{"role": "user", "content": f"build a graph with {question % 5 + 2} nodes"}]}
+
+
+async def run(config, questions):
+    times = []
+    for question in range(questions):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            await graph.ainvoke(question_input(question), config)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_sync(config, questions):
+    times = []
+    for question in range(questions):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            graph.invoke(question_input(question), config)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per model call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by up to this share either way")
+    parser.add_argument("--broken-rate", type=float, default=0.1, help="share of drafts without a code block")
+    parser.add_argument("--sync", action="store_true", help="run the sync graph, where the candidates run in threads")
+    args = parser.parse_args()
+
+    seed_github_file(GITHUB_URL, synthetic_test_file(50))
+    print(f"{args.questions} build questions, {args.latency:.1f} s per model call, {args.broken_rate:.0%} drafts without code")
+    print(f"{'rejected':>9} {'candidates':>11} {'mean s':>7} {'p50 s':>6} {'p90 s':>6} {'drafts':>7} {'reviews':>8} {'cancelled':>10}")
+    for reject_rate in (0.0, 0.3, 0.6):
+        config = register_fake_model("fake", latency=args.latency, jitter=args.jitter, broken_rate=args.broken_rate, reject_rate=reject_rate)
+        # validation would accept the fake's one draft by hash after the first answer
+        config["configurable"].update(response_cache=False, code_validation="off")
+        # a sequential round is four steps, and at high rejection rates some questions take many rounds
+        config["recursion_limit"] = 200
+        for candidates in (1, 2, 3, 4):
+            fake_random.seed(0)
+            fake_calls.clear()
+            speculation_stats["cancelled"] = 0
+            config["configurable"]["draft_candidates"] = candidates
+            times = run_sync(config, args.questions) if args.sync else asyncio.run(run(config, args.questions))
+            p90 = statistics.quantiles(times, n=10)[-1]
+            print(f"{reject_rate:>9.0%} {candidates:>11} {statistics.mean(times):>7.2f} {statistics.median(times):>6.2f} "
+                  f"{p90:>6.2f} {fake_calls['draft'] / args.questions:>7.2f} {fake_calls['review'] / args.questions:>8.2f} "
+                  f"{speculation_stats['cancelled'] / args.questions:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
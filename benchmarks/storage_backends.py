@@ -0,0 +1,95 @@
+"""
+This benchmark runs chat turns through the unchanged `MessageHandler` and `GraphHandler` on each storage backend and reports the per-turn latency the storage adds. A turn stores the user message, reads the history through the history cache, "answers" with a stub in place of the LLM, stores the reply and refreshes the conversation graph, like the WebSocket server does. It covers the in-memory and SQLite backends, the in-memory one behind the `WriteBehindDatabase` the server uses and, with `--uri`, Neo4j. Every turn's graph delta is checked to include the turn's messages.
+
+Run with `python benchmarks/storage_backends.py [--conversations 20] [--turns 100] [--uri bolt://localhost:7687 --user neo4j --password ...]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# the server imports its agents as the `server` package and everything else as flat modules from src/server
+sys.path.insert(0, SRC)
+import server.agents.groq_basic  # noqa: E402
+sys.path.insert(1, os.path.join(SRC, "server"))
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("groq_api_key", "benchmark")
+
+from async_database import AsyncNeo4jDatabase  # noqa: E402
+from graph_handler import GraphHandler  # noqa: E402
+from memory_database import InMemoryDatabase  # noqa: E402
+from message_handler import MessageHandler  # noqa: E402
+from sqlite_database import SqliteDatabase  # noqa: E402
+from write_behind import WriteBehindDatabase  # noqa: E402
+
+
+async def stub_response(conversation, conversation_id="default"):
+    return f"reply to {len(conversation)} messages"
+
+
+async def run_conversation(message_handler, graph_handler, conversation_id, turns, latencies):
+    await graph_handler.snapshot(conversation_id)
+    for turn in range(turns):
+        start = time.perf_counter()
+        reply = await message_handler.handle_message(f"question {turn}", "User", conversation_id)
+        deltas = await graph_handler.refresh(conversation_id)
+        latencies.append(time.perf_counter() - start)
+        # the delta of a turn has both of its messages, also when they were written behind
+        labels = {node["id"]: node["label"] for delta in deltas for node in delta["add"]["nodes"]}
+        assert reply["id"] in labels and f"Message: question {turn}..." in labels.values(), \
+            f"{conversation_id} turn {turn} is missing from its graph delta"
+
+
+async def run(database, args):
+    message_handler = MessageHandler(database)
+    message_handler.agenerate_ai_response = stub_response
+    graph_handler = GraphHandler(database)
+    latencies = []
+    # the handlers print a few lines per turn
+    with contextlib.redirect_stdout(io.StringIO()):
+        await database.test_connection()
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_conversation(message_handler, graph_handler, f"benchmark-{i}", args.turns, latencies)
+            for i in range(args.conversations)
+        ))
+    wall = time.perf_counter() - start
+    await database.close()
+    latencies.sort()
+    return len(latencies) / wall, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=20, help="conversations running at the same time")
+    parser.add_argument("--turns", type=int, default=100, help="turns per conversation")
+    parser.add_argument("--uri", help="also run on this Neo4j instance")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = [
+            ("memory", lambda: InMemoryDatabase()),
+            ("memory+wb", lambda: WriteBehindDatabase(InMemoryDatabase())),
+            ("sqlite", lambda: SqliteDatabase(os.path.join(directory, "benchmark.db"))),
+        ]
+        if args.uri:
+            backends.append(("neo4j", lambda: AsyncNeo4jDatabase(args.uri, args.user, args.password)))
+
+        print(f"{args.conversations} conversations x {args.turns} turns")
+        print(f"{'backend':<10} {'turns/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        for name, create in backends:
+            turns_per_second, p50, p99 = asyncio.run(run(create(), args))
+            print(f"{name:<10} {turns_per_second:>9.0f} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+This is a load generator for the WebSocket server (`src/server/server.py`). It opens many concurrent clients that speak the server's protocol: each reads the chat history and the graph the server opens with, then sends `{"type": "chat", ...}` messages in its own conversation, with a think time between them, and reads the streamed reply (`chat_delta` frames, then the `chat` frame) and the graph frames that follow. Message sizes and think times are drawn at random around the given means, and after every reply a client reconnects with the `--churn` probability. Clients connect gradually over `--ramp` seconds.
+
+It records:
+- the round trip of every message, from sending it to the `chat` frame with the reply, and the time to the first `chat_delta`;
+- the sizes of the graph frames and of the initial snapshot, in the wire protocol picked with `--protocol` (before compression);
+- connections, reconnects and dropped connections, i.e. closed by the server, failed to open or timed out;
+- the server's event-loop lag, from the `event_loop_lag` of the server's `metrics` message, next to the generator's own loop lag, so an overloaded generator is not mistaken for a slow server.
+
+`--listeners` adds clients that `subscribe` to the conversations and only read what the server broadcasts to them. `--slow-readers` adds clients that subscribe and never read, with a tiny receive window, which the server should disconnect instead of waiting on them.
+
+By default it starts the server itself in a subprocess (`serve`), fully offline: in-memory store and the fake models of `end_to_end`. With `--url`, it drives a server that is already running.
+
+Run with `python benchmarks/websocket_load.py [--clients 1000] [--duration 30] [--think 2] [--message-size 200] [--churn 0.05] [--listeners 0] [--slow-readers 0] [--agent groq_basic] [--latency 0.2] [--url ws://host:3001]`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+# end_to_end sets up the paths and the offline environment of the server
+from end_to_end import add_model_arguments, create_handlers, question, use_offline_models
+from broadcast import BroadcastHub
+from wire_protocol import SUBPROTOCOL_V2, decode_frame, encode_frame, server_options
+from concurrency import LoopLagMonitor
+
+WORDS = "the dharmaverse is a world of virtual realms where sanghas gather and agents act".split()
+
+
+def raise_file_limit():
+    # every client is a socket, and so is every connection on the server side
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def serve(args):
+    """
+    The server of `server.py`, on the in-memory store with offline models.
+    """
+    import server.server as ws_server
+    from websockets.legacy.server import serve as legacy_serve
+
+    raise_file_limit()
+    use_offline_models(args)
+    message_handler, graph_handler = create_handlers(args.agent, args)
+    ws_server.message_handler, ws_server.graph_handler = message_handler, graph_handler
+    ws_server.hub = message_handler.broadcast = BroadcastHub(graph_handler)
+    message_handler.loop_lag = LoopLagMonitor().start()
+    # server.py's handler takes (websocket, path), the signature of the legacy websockets server
+    async with legacy_serve(ws_server.handle_connection, args.host, args.port, ping_interval=20, ping_timeout=60,
+                            process_request=ws_server.process_request, backlog=4096, **server_options()):
+        print(f"serving on ws://{args.host}:{args.port}", file=sys.stderr)
+        await asyncio.Future()
+
+
+class LoadStats:
+    def __init__(self):
+        self.round_trips = []
+        self.first_deltas = []
+        self.graph_frames = []
+        self.snapshots = []
+        self.sent = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.dropped = 0
+        self.failed_connects = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.listener_frames = 0
+        self.listener_bytes = 0
+
+
+def message(turn, size, rng):
+    text = question(turn)
+    words = [text]
+    while sum(len(word) + 1 for word in words) < size:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:max(size, len(text))]
+
+
+def subprotocols(args):
+    return [SUBPROTOCOL_V2] if args.protocol == 2 else None
+
+
+def conversation_of(i):
+    return f"load-{i}-{random.Random(i).getrandbits(32):08x}"
+
+
+async def client(i, url, args, stats, deadline):
+    rng = random.Random(i)
+    conversation_id = conversation_of(i)
+    turn, first = 0, True
+    # clients start spread over the ramp
+    await asyncio.sleep(args.ramp * i / args.clients)
+    while time.monotonic() < deadline:
+        if not first:
+            stats.reconnects += 1
+        first = False
+        try:
+            async with websockets.connect(url, subprotocols=subprotocols(args), max_size=None, open_timeout=args.timeout,
+                                          ping_interval=None) as websocket:
+                stats.connects += 1
+                # the server opens with the chat history and the graph
+                for _ in range(2):
+                    frame = await asyncio.wait_for(websocket.recv(), args.timeout)
+                    if decode_frame(frame)["type"] == "graph":
+                        stats.snapshots.append(len(frame))
+                while True:
+                    await asyncio.sleep(rng.expovariate(1 / args.think) if args.think else 0)
+                    if time.monotonic() >= deadline:
+                        return
+                    size = max(1, int(rng.expovariate(1 / args.message_size)))
+                    sent = time.perf_counter()
+                    await websocket.send(encode_frame({"type": "chat", "content": message(turn, size, rng),
+                                                       "sender_type": "User", "conversation_id": conversation_id}, args.protocol))
+                    stats.sent += 1
+                    turn += 1
+                    first_delta = None
+                    while True:
+                        frame = await asyncio.wait_for(websocket.recv(), args.timeout)
+                        data = decode_frame(frame)
+                        if data["type"] == "chat_delta" and first_delta is None:
+                            first_delta = time.perf_counter() - sent
+                            stats.first_deltas.append(first_delta)
+                        elif data["type"] == "chat" and "message" in data:
+                            stats.round_trips.append(time.perf_counter() - sent)
+                            break
+                        elif data["type"].startswith("graph"):
+                            # the graph of the previous reply
+                            stats.graph_frames.append(len(frame))
+                        elif data["type"] == "error":
+                            stats.errors += 1
+                            break
+                    if rng.random() < args.churn:
+                        break
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            stats.dropped += 1
+        except websockets.exceptions.ConnectionClosed:
+            stats.dropped += 1
+        except OSError:
+            stats.failed_connects += 1
+            stats.dropped += 1
+            await asyncio.sleep(rng.uniform(0.5, 1.5))
+
+
+async def listener(i, url, args, stats, deadline):
+    """
+    Follows the conversation of client `i` without writing to it.
+    """
+    await asyncio.sleep(args.ramp * i / args.clients)
+    try:
+        async with websockets.connect(url, subprotocols=subprotocols(args), max_size=None, open_timeout=args.timeout,
+                                      ping_interval=None) as websocket:
+            stats.connects += 1
+            await websocket.send(json.dumps({"type": "subscribe", "conversation_id": conversation_of(i)}))
+            while (remaining := deadline - time.monotonic()) > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    frame = await asyncio.wait_for(websocket.recv(), remaining)
+                    stats.listener_frames += 1
+                    stats.listener_bytes += len(frame)
+    except websockets.exceptions.ConnectionClosed:
+        stats.dropped += 1
+    except OSError:
+        stats.failed_connects += 1
+        stats.dropped += 1
+
+
+async def slow_reader(i, url, args, stats, deadline):
+    """
+    Follows the conversation of client `i` and never reads, the server should drop it rather than wait for it.
+    """
+    await asyncio.sleep(args.ramp * i / args.clients)
+    host, port = url.split("://")[1].split("/")[0].rsplit(":", 1)
+    sock = socket.socket()
+    # a tiny receive window, so the server's writes back up quickly
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, (host, int(port)))
+        async with websockets.connect(url, sock=sock, max_size=None, max_queue=1, open_timeout=args.timeout,
+                                      ping_interval=None) as websocket:
+            await websocket.send(json.dumps({"type": "subscribe", "conversation_id": conversation_of(i)}))
+            # it cannot see the server close it either, the server's broadcast stats count the drops
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+    except (OSError, websockets.exceptions.ConnectionClosed):
+        pass
+
+
+async def server_metrics(url, timeout):
+    async with websockets.connect(url, max_size=None, open_timeout=timeout) as websocket:
+        await websocket.send(json.dumps({"type": "metrics"}))
+        while True:
+            data = decode_frame(await asyncio.wait_for(websocket.recv(), timeout))
+            if data["type"] == "metrics":
+                return data["data"]
+
+
+async def generate(url, args):
+    stats = LoadStats()
+    client_lag = LoopLagMonitor().start()
+    start = time.monotonic()
+    deadline = start + args.ramp + args.duration
+    await asyncio.gather(
+        *(client(i, url, args, stats, deadline) for i in range(args.clients)),
+        *(listener(i % args.clients, url, args, stats, deadline) for i in range(args.listeners * args.clients)),
+        *(slow_reader(i % args.clients, url, args, stats, deadline) for i in range(args.slow_readers)),
+    )
+    wall = time.monotonic() - start
+    client_lag.stop()
+    try:
+        metrics = await server_metrics(url, args.timeout)
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.ConnectionClosed) as e:
+        print(f"could not read the server metrics: {e}")
+        metrics = {}
+    return stats, wall, client_lag.report(), metrics
+
+
+def report(stats, wall, client_lag, metrics, args):
+    ms = lambda seconds: seconds * 1000  # noqa: E731
+    print(f"{args.clients} protocol v{args.protocol} clients, {args.duration:.0f} s after a {args.ramp:.0f} s ramp, think {args.think} s, "
+          f"~{args.message_size} chars per message, churn {args.churn:.0%}")
+    print(f"messages    sent {stats.sent}, answered {len(stats.round_trips)} ({len(stats.round_trips) / wall:.1f}/s), "
+          f"errors {stats.errors}, timeouts {stats.timeouts}")
+    print(f"round trip  p50 {ms(percentile(stats.round_trips, 0.5)):.0f} ms, p90 {ms(percentile(stats.round_trips, 0.9)):.0f} ms, "
+          f"p99 {ms(percentile(stats.round_trips, 0.99)):.0f} ms, max {ms(max(stats.round_trips, default=float('nan'))):.0f} ms")
+    print(f"1st delta   p50 {ms(percentile(stats.first_deltas, 0.5)):.0f} ms, p99 {ms(percentile(stats.first_deltas, 0.99)):.0f} ms")
+    print(f"graph       {len(stats.graph_frames)} frames, mean {sum(stats.graph_frames) / max(len(stats.graph_frames), 1):.0f} B, "
+          f"p99 {percentile(stats.graph_frames, 0.99)} B, max {max(stats.graph_frames, default=0)} B; "
+          f"initial snapshot mean {sum(stats.snapshots) / max(len(stats.snapshots), 1):.0f} B")
+    print(f"connections {stats.connects} opened, {stats.reconnects} reconnects, {stats.dropped} dropped "
+          f"({stats.failed_connects} failed to open)")
+    if args.listeners:
+        print(f"fan-out     {args.listeners * args.clients} listeners received {stats.listener_frames} frames, "
+              f"{stats.listener_bytes / 1024:.0f} KB")
+    if args.slow_readers:
+        dropped = metrics.get("broadcast", {}).get("slow_clients_dropped", "?")
+        print(f"slow        {dropped} slow clients dropped by the server, {args.slow_readers} readers never read")
+    print(f"loop lag    server {metrics.get('event_loop_lag', 'not reported')}")
+    print(f"            generator {client_lag}")
+    if metrics.get("broadcast"):
+        print(f"broadcast   {metrics['broadcast']}")
+    if metrics:
+        print(f"server      llm in flight max {metrics.get('llm_max_in_flight')}, waiting max {metrics.get('llm_max_waiting')}, "
+              f"conversation queue max {metrics.get('max_conversation_queue_depth')}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_server(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the server exited with {process.returncode}")
+        try:
+            await server_metrics(url, 5)
+            return
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+            await asyncio.sleep(0.5)
+    raise RuntimeError("the server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", nargs="?", choices=("run", "serve"), default="run")
+    parser.add_argument("--url", help="drive this server instead of starting an offline one")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after the ramp")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which the clients connect")
+    parser.add_argument("--think", type=float, default=2.0, help="mean seconds between a reply and the next message")
+    parser.add_argument("--message-size", type=int, default=200, help="mean characters per message")
+    parser.add_argument("--churn", type=float, default=0.05, help="chance of reconnecting after each reply")
+    parser.add_argument("--protocol", type=int, choices=(1, 2), default=1, help="wire protocol of the clients, 2 is MessagePack")
+    parser.add_argument("--listeners", type=int, default=0, help="clients following each conversation without writing")
+    parser.add_argument("--slow-readers", type=int, default=0, help="clients following a conversation that never read")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for a frame")
+    parser.add_argument("--agent", choices=("groq_basic", "dharmaflow"), default="groq_basic")
+    parser.add_argument("--server-log", help="file for the output of the offline server")
+    add_model_arguments(parser)
+    parser.set_defaults(latency=0.2)
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        asyncio.run(serve(args))
+        return
+
+    print(f"open files limit raised to {raise_file_limit()}")
+    process = None
+    url = args.url
+    if url is None:
+        port = args.port or free_port()
+        url = f"ws://{args.host}:{port}"
+        server_args = [a for a in sys.argv[1:] if a not in ("run",)]
+        log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+        process = subprocess.Popen([sys.executable, __file__, "serve", *server_args, "--port", str(port)],
+                                   stdout=log, stderr=log)
+    try:
+        if process is not None:
+            asyncio.run(wait_for_server(url, process))
+        stats, wall, client_lag, metrics = asyncio.run(generate(url, args))
+        report(stats, wall, client_lag, metrics, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                process.wait(10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+This benchmark compares the wire protocols of the WebSocket server (see `src/server/wire_protocol.py`) on the frames of large conversations. Conversations of increasing size are stored in the in-memory database and their frames come from the unchanged `GraphHandler`: the `graph` snapshot a client gets when it connects and the `graph_delta` of one turn, plus the `chat_delta` and `chat` frames of a streamed reply. Each frame is encoded as JSON (v1), as plain MessagePack, and as v2 (MessagePack with columnar graphs).
+
+For each encoding it reports the encode and decode time and the frame size, raw and after permessage-deflate with the zlib defaults, the defaults of `websockets` and the tuned settings of the server. It also reports the bytes of a whole turn sent on one connection, where deflate keeps its window from frame to frame, and the memory the deflate state of one connection takes with each setting.
+
+Run with `python benchmarks/wire_protocol.py [--messages 100,1000,10000] [--window-bits 12] [--mem-level 4]`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import timeit
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, os.path.join(SRC, "server"))
+
+import msgpack  # noqa: E402
+
+from graph_handler import GraphHandler  # noqa: E402
+from memory_database import InMemoryDatabase  # noqa: E402
+from wire_protocol import PROTOCOL_V1, PROTOCOL_V2, WS_COMPRESSION_LEVEL, decode_frame, encode_frame  # noqa: E402
+
+SENTENCES = [
+    "In the dharmaverse every realm is a graph of sanghas, and every sangha keeps its own state.",
+    "The agents walk from node to node, carrying messages between the realms.",
+    "A conditional edge decides which realm an agent visits next, based on what it has seen.",
+    "When two agents meet, their states are merged by the reducers of the channels they share.",
+]
+# (name, window bits, memory level); the server's tuned settings are added from the arguments
+DEFLATE_SETTINGS = [("zlib default", 15, 8), ("websockets default", 12, 5)]
+ENCODINGS = {
+    "json (v1)": (lambda frame: encode_frame(frame, PROTOCOL_V1), decode_frame),
+    "msgpack": (lambda frame: msgpack.packb(frame, use_bin_type=True), lambda message: msgpack.unpackb(message, raw=False)),
+    "v2 columnar": (lambda frame: encode_frame(frame, PROTOCOL_V2), decode_frame),
+}
+
+
+def content(i):
+    return f"{SENTENCES[i % len(SENTENCES)]} (chapter {i})"
+
+
+async def conversation_frames(messages):
+    database = InMemoryDatabase()
+    graph_handler = GraphHandler(database)
+    conversation_id = f"wire-{messages}"
+    # in the past, before the messages of the turn
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    await database.add_messages([
+        {"id": str(uuid.uuid4()), "content": content(i), "sender_type": "User" if i % 2 == 0 else "Agent",
+         "conversation_id": conversation_id, "timestamp": (start + timedelta(milliseconds=i)).isoformat()}
+        for i in range(messages)
+    ])
+    snapshot = await graph_handler.snapshot(conversation_id)
+    # one turn: the user message and the reply
+    await database.add_message(content(messages), "User", conversation_id)
+    reply = await database.add_message(content(messages + 1), "Agent", conversation_id)
+    delta, = await graph_handler.refresh(conversation_id)
+    stream_id = str(uuid.uuid4())
+    chat_deltas = [{"type": "chat_delta", "stream_id": stream_id, "delta": word + " "} for word in reply["content"].split(" ")]
+    chat = {"type": "chat", "message": reply, "stream_id": stream_id}
+    return snapshot, delta, chat_deltas, chat
+
+
+def deflate(messages, window_bits, mem_level):
+    """
+    Bytes of the messages sent through one permessage-deflate context, like a connection with context takeover.
+    """
+    compressor = zlib.compressobj(WS_COMPRESSION_LEVEL, zlib.DEFLATED, -window_bits, mem_level)
+    total = 0
+    for message in messages:
+        data = message.encode() if isinstance(message, str) else message
+        # the 4 bytes of the empty block that ends a sync flush are not sent
+        total += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return total
+
+
+def deflate_memory(window_bits, mem_level):
+    # zlib's own formulas, for the compressor and the decompressor of a connection
+    return (1 << (window_bits + 2)) + (1 << (mem_level + 9)) + (1 << window_bits) + 7 * 1024
+
+
+def best_time(function, argument):
+    timer = timeit.Timer(lambda: function(argument))
+    number, _ = timer.autorange()
+    return min(timer.repeat(3, number)) / number
+
+
+def measure_frame(name, frame, settings):
+    print(f"  {name}")
+    for encoding, (encode, decode) in ENCODINGS.items():
+        message = encode(frame)
+        assert decode(message) == json.loads(json.dumps(frame)), encoding
+        sizes = " ".join(f"{deflate([message], bits, level):>9}" for _, bits, level in settings)
+        print(f"    {encoding:<13} {best_time(encode, frame) * 1e6:>9.1f} {best_time(decode, message) * 1e6:>9.1f} "
+              f"{len(message):>9} {sizes}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", default="100,1000,10000", help="sizes of the conversations")
+    parser.add_argument("--window-bits", type=int, default=int(os.getenv("DHARMABOT_WS_WINDOW_BITS", "12")))
+    parser.add_argument("--mem-level", type=int, default=int(os.getenv("DHARMABOT_WS_MEM_LEVEL", "4")))
+    args = parser.parse_args()
+
+    settings = DEFLATE_SETTINGS + [("tuned", args.window_bits, args.mem_level)]
+    print("deflate state per connection: " + ", ".join(
+        f"{name} ({bits} bits, memLevel {level}) {deflate_memory(bits, level) / 1024:.0f} KB" for name, bits, level in settings))
+    header = " ".join(f"{name.split()[0]:>9}" for name, _, _ in settings)
+    print(f"    {'encoding':<13} {'encode us':>9} {'decode us':>9} {'raw B':>9} {header}")
+    for messages in (int(n) for n in args.messages.split(",")):
+        snapshot, delta, chat_deltas, chat = asyncio.run(conversation_frames(messages))
+        print(f"conversation of {messages} messages")
+        measure_frame(f"graph snapshot, {len(snapshot['data']['nodes'])} nodes, {len(snapshot['data']['links'])} links", snapshot, settings)
+        measure_frame("graph_delta of one turn", delta, settings)
+        measure_frame("chat frame", chat, settings)
+        turn = chat_deltas + [chat, delta]
+        print(f"  one turn on a connection, {len(turn)} frames")
+        for encoding, (encode, _) in ENCODINGS.items():
+            encoded = [encode(frame) for frame in turn]
+            sizes = " ".join(f"{deflate(encoded, bits, level):>9}" for _, bits, level in settings)
+            print(f"    {encoding:<13} {'':>9} {'':>9} {sum(len(m) for m in encoded):>9} {sizes}")
+
+
+if __name__ == "__main__":
+    main()
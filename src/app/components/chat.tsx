@@ -48,11 +48,26 @@ export default function Chat() {
             id: msg.id || `${msg.timestamp}-${Math.random().toString(36).substr(2, 9)}`
           })));
         } else if (data.message) {
-          setMessages(prevMessages => [...prevMessages, {
+          const committedMessage = {
             ...data.message,
             id: data.message.id || `${data.message.timestamp}-${Math.random().toString(36).substr(2, 9)}`
-          }]);
+          };
+          // Replace the streamed draft of this message (if any) with the stored one
+          setMessages(prevMessages => [
+            ...prevMessages.filter(msg => !data.stream_id || msg.id !== data.stream_id),
+            committedMessage
+          ]);
         }
+      } else if (data.type === 'chat_delta' || data.type === 'chat_reset') {
+        setIsLoading(false);
+        setMessages(prevMessages => {
+          const streamed = prevMessages.find(msg => msg.id === data.stream_id);
+          const content = data.type === 'chat_delta' ? (streamed?.content || '') + data.delta : '';
+          if (streamed) {
+            return prevMessages.map(msg => msg.id === data.stream_id ? { ...msg, content } : msg);
+          }
+          return [...prevMessages, { id: data.stream_id, content, timestamp: new Date().toISOString(), sender_type: 'Agent' }];
+        });
       }
     };
     ws.onclose = (event) => {
@@ -13,10 +13,31 @@ import { NodeSelectionProvider } from '../context/node_selection_context'; // Im
 const GRAPH_TYPES = ['Conversation', 'Knowledge', 'Entity'];
 const WS_URL = 'ws://localhost:3001';
 
+const link_key = (link) => {
+  const source_id = typeof link.source === 'object' ? link.source.id : link.source;
+  const target_id = typeof link.target === 'object' ? link.target.id : link.target;
+  return `${source_id}|${target_id}|${link.type}`;
+};
+
+// Adds are idempotent: nodes and links the graph already has are skipped
+const apply_graph_delta = (graph_data, delta) => {
+  const removed_node_ids = new Set(delta.remove.nodes);
+  const removed_link_keys = new Set(delta.remove.links.map(link_key));
+  const nodes = (graph_data?.nodes || []).filter(node => !removed_node_ids.has(node.id));
+  const links = (graph_data?.links || []).filter(link => !removed_link_keys.has(link_key(link)));
+  const node_ids = new Set(nodes.map(node => node.id));
+  const link_keys = new Set(links.map(link_key));
+  return {
+    nodes: [...nodes, ...delta.add.nodes.filter(node => !node_ids.has(node.id))],
+    links: [...links, ...delta.add.links.filter(link => !link_keys.has(link_key(link)))],
+  };
+};
+
 export default function Visualization() {
   const [selected_graph, set_selected_graph] = useState(GRAPH_TYPES[0]);
   const [graph_data, set_graph_data] = useState(null);
   const ws_ref = useRef(null);
+  const graph_version_ref = useRef(null);
 
   useEffect(() => {
     const connect_web_socket = () => {
@@ -34,7 +55,16 @@ export default function Visualization() {
         try {
           const data = JSON.parse(event.data);
           if (data.type === 'graph') {
+            graph_version_ref.current = data.version ?? null;
             set_graph_data(data.data);
+          } else if (data.type === 'graph_delta') {
+            if (graph_version_ref.current !== data.base_version) {
+              // A delta was missed, ask for the whole graph again
+              ws.send(JSON.stringify({ type: 'graph_resync', conversation_id: data.conversation_id }));
+              return;
+            }
+            graph_version_ref.current = data.version;
+            set_graph_data(previous_graph_data => apply_graph_delta(previous_graph_data, data));
           } else {
             console.log('Received non-graph data:', data);
           }
@@ -1,16 +1,20 @@
 """
-This file appears to define a series of functions and configurations related to setting up a graph-based conversation flow for DharmaBot UI. Functions like `route_start`, `route_check`, `route_gather`, and `route_critique` determine the flow of the conversation based on the current state. The file also sets up a `StateGraph` using the defined functions to create a structured conversation flow within the DharmaBot UI.
+This file appears to define a series of functions and configurations related to setting up a graph-based conversation flow for DharmaBot UI. Functions like `route_start`, `route_check`, `route_gather`, and `route_critique` determine the flow of the conversation based on the current state. The file also sets up a `StateGraph` using the defined functions to create a structured conversation flow within the DharmaBot UI. With `draft_candidates` above 1, `speculate` drafts and reviews several candidates at once in place of that loop. Every turn ends in `compact`, and `persistent_graph` is the same graph with a SQLite checkpointer, so a thread can be resumed from its id.
 """
 
 from typing import Literal
 
 from langgraph.graph import StateGraph, END, MessagesState
 from langchain_core.messages import AIMessage
+from langgraph.utils import RunnableCallable
 
 from dharmabot.nodes.check import check
-from dharmabot.nodes.critique import critique
-from dharmabot.nodes.draft import draft_answer
-from dharmabot.nodes.gather_requirements import gather_requirements
+from dharmabot.nodes.compact import compact
+from dharmabot.nodes.critique import critique, acritique
+from dharmabot.nodes.draft import draft_answer, adraft_answer
+from dharmabot.nodes.gather_requirements import gather_requirements, agather_requirements
+from dharmabot.nodes.speculate import speculate, aspeculate, draft_candidates
+from dharmabot.checkpointer import checkpointer
 from dharmabot.state import AgentState, OutputState, GraphConfig
 from neo4j import GraphDatabase
 import os
@@ -57,30 +61,41 @@ import os
 #     driver.close()
 #     return state
 
-def route_start(state: AgentState) -> Literal["draft_answer", "gather_requirements"]:
-    if state.get('context').user:
-        return "draft_answer"
+def route_draft(config) -> Literal["draft_answer", "speculate"]:
+    # with more than one candidate, drafts are written and reviewed side by side in `speculate`
+    return "speculate" if draft_candidates(config) > 1 else "draft_answer"
+
+def route_start(state: AgentState, config) -> Literal["draft_answer", "speculate", "gather_requirements"]:
+    if (state.get('context') or {}).get('user'):
+        return route_draft(config)
     else:
         return "gather_requirements"
     
-def route_check(state: AgentState) -> Literal["critique", "draft_answer"]:
+def route_check(state: AgentState) -> Literal["critique", "draft_answer", "compact"]:
     if isinstance(state['messages'][-1], AIMessage):
-        return "critique"
+        # code critique accepted before is not critiqued again
+        return "compact" if state.get('accepted') else "critique"
     else:
         return "draft_answer"
 
-def route_gather(state: AgentState) -> Literal["draft_answer", END]:
+def route_gather(state: AgentState, config) -> Literal["draft_answer", "speculate", "compact"]:
     if state.get('requirements'):
-        return "draft_answer"
+        return route_draft(config)
     else:
-        return END
+        return "compact"
 
-def route_critique(state: AgentState) -> Literal["draft_answer", END]:
+def route_critique(state: AgentState) -> Literal["draft_answer", "compact"]:
     if state['accepted']:
-        return END
+        return "compact"
     else:
         return "draft_answer"
 
+def route_speculate(state: AgentState) -> Literal["speculate", "compact"]:
+    if state['accepted']:
+        return "compact"
+    else:
+        return "speculate"
+
 def custom_node(state: AgentState, config: GraphConfig) -> AgentState:
     print("---Step 2---")
     pass
@@ -95,14 +110,24 @@ dharmaflow.set_conditional_entry_point(route_start)
 # dharmaflow.add_edge("remember_user", "perceive_message")
 # dharmaflow.add_node("perceive_message")
 
-dharmaflow.add_node(draft_answer)
-dharmaflow.add_node(gather_requirements)
-dharmaflow.add_node(critique)
+# The LLM nodes have native async versions, so `graph.ainvoke`/`graph.astream` never block the event loop on a model call.
+# RunnableCallable (untraced, like add_node does for plain functions) is much cheaper per call than RunnableLambda.
+dharmaflow.add_node("draft_answer", RunnableCallable(draft_answer, adraft_answer, trace=False))
+dharmaflow.add_node("gather_requirements", RunnableCallable(gather_requirements, agather_requirements, trace=False))
+dharmaflow.add_node("critique", RunnableCallable(critique, acritique, trace=False))
+dharmaflow.add_node("speculate", RunnableCallable(speculate, aspeculate, trace=False))
 dharmaflow.add_node(check)
 dharmaflow.add_node("test_node", custom_node)
+# every turn ends here, so the review chatter never outlives the turn
+dharmaflow.add_node(compact)
+dharmaflow.add_edge("compact", END)
 dharmaflow.add_conditional_edges("gather_requirements", route_gather)
 dharmaflow.add_edge("draft_answer", "test_node")
 dharmaflow.add_edge("test_node", "check")
 dharmaflow.add_conditional_edges("check", route_check)
 dharmaflow.add_conditional_edges("critique", route_critique)
+dharmaflow.add_conditional_edges("speculate", route_speculate)
 graph = dharmaflow.compile()
+# The same graph with its state kept per `thread_id`, so a caller only sends the new message. `graph` stays
+# without a checkpointer for the LangGraph platform (langgraph.json), which brings its own.
+persistent_graph = dharmaflow.compile(checkpointer=checkpointer)
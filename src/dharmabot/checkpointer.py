@@ -0,0 +1,83 @@
+"""
+This file contains `CompactingSqliteSaver`, the checkpointer of the persistent `dharmaflow` graph. It is LangGraph's `SqliteSaver` with three changes. It opens its SQLite file on first use instead of at import. It also serves the async methods the graph uses under `astream_events`, by running the sync ones in a worker thread behind the saver's lock. And it compacts as it goes: after every checkpoint only the newest few of that thread are kept, with their pending writes, instead of one full copy of the state for every step of every turn. Together with the `compact` node, which drops the critique chatter and caps the messages a thread keeps, this bounds both the size of a thread's latest checkpoint and the rows behind it, so loading a thread costs the same on turn 500 as on turn 5. The purpose of this file is to let clients send only their new message with a thread id, instead of resending the whole conversation on every call.
+"""
+
+import asyncio
+import os
+import sqlite3
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+CHECKPOINT_PATH = os.getenv("DHARMABOT_CHECKPOINT_PATH", "dharmaflow_checkpoints.db")
+# checkpoints kept per thread; the newest is the one a thread resumes from, a few more allow a short look back
+CHECKPOINTS_KEPT = int(os.getenv("DHARMABOT_CHECKPOINTS_KEPT", "4"))
+
+PRUNE_CHECKPOINTS = """
+    DELETE FROM checkpoints
+    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+        SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+        ORDER BY checkpoint_id DESC LIMIT ?
+    )
+"""
+
+PRUNE_WRITES = """
+    DELETE FROM writes
+    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+        SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+    )
+"""
+
+
+class CompactingSqliteSaver(SqliteSaver):
+    def __init__(self, path=CHECKPOINT_PATH, keep=CHECKPOINTS_KEPT, **kwargs):
+        """
+        `keep` is the number of checkpoints kept per thread, None to keep all of them like `SqliteSaver` does.
+        """
+        super().__init__(None, **kwargs)
+        self.path = path
+        self.keep = keep
+        self.stats = {"puts": 0, "pruned": 0}
+
+    def setup(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+        super().setup()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.is_setup = False
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        self.stats["puts"] += 1
+        if self.keep is not None:
+            thread = (str(saved["configurable"]["thread_id"]), saved["configurable"]["checkpoint_ns"])
+            with self.lock, self.cursor() as cursor:
+                cursor.execute(PRUNE_CHECKPOINTS, thread + thread + (self.keep,))
+                self.stats["pruned"] += cursor.rowcount
+                cursor.execute(PRUNE_WRITES, thread + thread)
+        return saved
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+    def report(self):
+        return {**self.stats, "path": self.path, "kept_per_thread": self.keep}
+
+
+checkpointer = CompactingSqliteSaver()
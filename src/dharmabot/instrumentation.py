@@ -0,0 +1,301 @@
+"""
+This file contains `GraphMetrics`, a callback handler that instruments runs of the `dharmaflow` graph. Passed in the `callbacks` of a run (see `instrument`), it records the wall time of every node run and of the whole turn, the time to the first token and the duration of every model call with its input and output tokens, how many times each node ran in a turn (so how many draft -> check -> critique loops a turn took) and the custom events the nodes dispatch, such as response cache hits. Everything is aggregated in process, into fixed-bucket histograms and counters that `prometheus` renders in the Prometheus text format, and into a summary per thread that `thread_summary` returns as a dict ready for JSON. The handler runs inline and only does a few dict updates per callback, so it can stay on in production. The purpose of this file is to tell where the time of a slow answer went.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+GRAPH_METRICS_ENABLED = os.getenv("DHARMABOT_GRAPH_METRICS", "1") != "0"
+# threads with a summary, the least recently active ones are dropped beyond this
+THREADS_KEPT = int(os.getenv("DHARMABOT_GRAPH_METRICS_THREADS", "1000"))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RUNS_BUCKETS = (1, 2, 3, 4, 5, 8, 13)
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, cumulated (like Prometheus does) only when rendered.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket the q-quantile falls in, None without observations.
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def report(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": self.quantile(0.5), "p95": self.quantile(0.95)}
+
+
+class ThreadSummary:
+    def __init__(self):
+        self.turns = 0
+        self.seconds = 0.0
+        self.nodes = defaultdict(lambda: {"runs": 0, "seconds": 0.0, "errors": 0})
+        self.llm = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "first_token_seconds": 0.0, "input_tokens": 0, "output_tokens": 0})
+        self.events = Counter()
+        self.last_turn = {}
+
+    def report(self):
+        return {
+            "turns": self.turns,
+            "seconds": round(self.seconds, 6),
+            "nodes": {node: {**stats, "seconds": round(stats["seconds"], 6)} for node, stats in self.nodes.items()},
+            "llm": {node: {**stats, "seconds": round(stats["seconds"], 6),
+                           "first_token_seconds": round(stats["first_token_seconds"] / max(stats["calls"], 1), 6)}
+                    for node, stats in self.llm.items()},
+            "events": dict(self.events),
+            "last_turn_node_runs": self.last_turn,
+        }
+
+
+class GraphMetrics(BaseCallbackHandler):
+    # called right in the run instead of through an executor, which would cost far more than the handler itself
+    run_inline = True
+
+    def __init__(self, threads_kept=THREADS_KEPT):
+        self.lock = threading.Lock()
+        self.threads_kept = threads_kept
+        # run_id -> (thread_id, started, node runs) of the graph runs going on
+        self.turns = {}
+        # run_id -> (turn run_id, node, started) of the node runs going on
+        self.nodes = {}
+        # run_id -> [node, thread_id, started, first token time] of the model calls going on
+        self.calls = {}
+        self.turn_seconds = Histogram(SECONDS_BUCKETS)
+        self.node_seconds = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.node_runs = defaultdict(lambda: Histogram(RUNS_BUCKETS))
+        self.llm_seconds = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.first_token_seconds = defaultdict(lambda: Histogram(SECONDS_BUCKETS))
+        self.tokens = Counter()
+        self.node_errors = Counter()
+        self.events = Counter()
+        self.threads = OrderedDict()
+
+    def _thread(self, thread_id):
+        if thread_id is None:
+            return None
+        summary = self.threads.get(thread_id)
+        if summary is None:
+            summary = self.threads[thread_id] = ThreadSummary()
+            if len(self.threads) > self.threads_kept:
+                self.threads.popitem(last=False)
+        else:
+            self.threads.move_to_end(thread_id)
+        return summary
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        started = time.perf_counter()
+        # the async graph calls handlers on the event loop, but nodes of a sync graph start on executor threads
+        with self.lock:
+            if node is None:
+                if parent_run_id not in self.nodes:
+                    self.turns[run_id] = (metadata.get("thread_id"), started, Counter())
+            elif parent_run_id in self.turns and kwargs.get("name") == node and node != "__start__":
+                self.nodes[run_id] = (parent_run_id, node, started)
+
+    def _end_chain(self, run_id, error):
+        ended = time.perf_counter()
+        with self.lock:
+            node_run = self.nodes.pop(run_id, None)
+            if node_run is not None:
+                turn_id, node, started = node_run
+                seconds = ended - started
+                self.node_seconds[node].observe(seconds)
+                if error:
+                    self.node_errors[node] += 1
+                turn = self.turns.get(turn_id)
+                if turn is not None:
+                    turn[2][node] += 1
+                    summary = self._thread(turn[0])
+                    if summary is not None:
+                        stats = summary.nodes[node]
+                        stats["runs"] += 1
+                        stats["seconds"] += seconds
+                        stats["errors"] += error
+                return
+            turn = self.turns.pop(run_id, None)
+            if turn is not None:
+                thread_id, started, node_runs = turn
+                seconds = ended - started
+                self.turn_seconds.observe(seconds)
+                for node, runs in node_runs.items():
+                    self.node_runs[node].observe(runs)
+                summary = self._thread(thread_id)
+                if summary is not None:
+                    summary.turns += 1
+                    summary.seconds += seconds
+                    summary.last_turn = dict(node_runs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_chain(run_id, False)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_chain(run_id, True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        self.calls[run_id] = [metadata.get("langgraph_node"), metadata.get("thread_id"), time.perf_counter(), None]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        call = self.calls.get(run_id)
+        if call is not None and call[3] is None:
+            call[3] = time.perf_counter()
+
+    def _end_call(self, run_id, response):
+        call = self.calls.pop(run_id, None)
+        if call is None:
+            return
+        node, thread_id, started, first_token = call
+        ended = time.perf_counter()
+        # without streaming the first token comes with the whole reply
+        first_token = (first_token or ended) - started
+        usage = {}
+        if response is not None and response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], "message", None)
+            usage = getattr(message, "usage_metadata", None) or {}
+        with self.lock:
+            self.llm_seconds[node].observe(ended - started)
+            self.first_token_seconds[node].observe(first_token)
+            self.tokens[node, "input"] += usage.get("input_tokens", 0)
+            self.tokens[node, "output"] += usage.get("output_tokens", 0)
+            summary = self._thread(thread_id)
+            if summary is not None:
+                stats = summary.llm[node]
+                stats["calls"] += 1
+                stats["seconds"] += ended - started
+                stats["first_token_seconds"] += first_token
+                stats["input_tokens"] += usage.get("input_tokens", 0)
+                stats["output_tokens"] += usage.get("output_tokens", 0)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end_call(run_id, response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end_call(run_id, None)
+
+    def on_custom_event(self, name, data, *, run_id, tags=None, metadata=None, **kwargs):
+        with self.lock:
+            self.events[name] += 1
+            summary = self._thread((metadata or {}).get("thread_id"))
+            if summary is not None:
+                summary.events[name] += 1
+
+    def reset(self):
+        self.__init__(self.threads_kept)
+
+    def thread_summary(self, thread_id):
+        with self.lock:
+            summary = self.threads.get(thread_id)
+            return None if summary is None else {"thread_id": thread_id, **summary.report()}
+
+    def report(self):
+        with self.lock:
+            return {
+                "turns": self.turn_seconds.report(),
+                "nodes": {node: histogram.report() for node, histogram in self.node_seconds.items()},
+                "llm_first_token": {node: histogram.report() for node, histogram in self.first_token_seconds.items()},
+                "node_runs_per_turn": {node: histogram.report() for node, histogram in self.node_runs.items()},
+                "tokens": {f"{node}.{direction}": count for (node, direction), count in self.tokens.items()},
+                "events": dict(self.events),
+                "threads": len(self.threads),
+            }
+
+    def prometheus(self):
+        """
+        All the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            _histogram(lines, "dharmaflow_turn_seconds", "Wall time of a dharmaflow turn", {(): self.turn_seconds})
+            _histogram(lines, "dharmaflow_node_seconds", "Wall time of a node run", _by("node", self.node_seconds))
+            _histogram(lines, "dharmaflow_node_runs_per_turn", "Runs of a node in one turn", _by("node", self.node_runs))
+            _histogram(lines, "dharmaflow_llm_seconds", "Duration of a model call", _by("node", self.llm_seconds))
+            _histogram(lines, "dharmaflow_llm_first_token_seconds", "Time to the first token of a model call",
+                       _by("node", self.first_token_seconds))
+            _counter(lines, "dharmaflow_llm_tokens_total", "Tokens of model calls",
+                     {(("node", node), ("direction", direction)): count for (node, direction), count in self.tokens.items()})
+            _counter(lines, "dharmaflow_node_errors_total", "Node runs that raised",
+                     {(("node", node),): count for node, count in self.node_errors.items()})
+            _counter(lines, "dharmaflow_events_total", "Custom events dispatched by the nodes, e.g. cache hits",
+                     {(("name", name),): count for name, count in self.events.items()})
+        return "\n".join(lines) + "\n"
+
+
+def _by(label, histograms):
+    return {((label, str(key)),): histogram for key, histogram in histograms.items()}
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _histogram(lines, name, help, histograms):
+    lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+    for labels, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+
+def _counter(lines, name, help, counts):
+    lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+    for labels, count in counts.items():
+        lines.append(f"{name}{_labels(labels)} {count}")
+
+
+graph_metrics = GraphMetrics()
+
+
+def instrument(config=None):
+    """
+    `config` with `graph_metrics` added to its callbacks, for runs of the graph that should be measured.
+    """
+    config = dict(config or {})
+    if GRAPH_METRICS_ENABLED:
+        callbacks = config.get("callbacks")
+        if callbacks is None:
+            config["callbacks"] = [graph_metrics]
+        elif isinstance(callbacks, list):
+            config["callbacks"] = callbacks + [graph_metrics]
+        else:
+            # a callback manager
+            callbacks = callbacks.copy()
+            callbacks.add_handler(graph_metrics, inherit=True)
+            config["callbacks"] = callbacks
+    return config
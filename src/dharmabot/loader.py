@@ -1,44 +1,390 @@
 """
-The provided file contains a Python script that defines a function called `load_github_file` that fetches the raw content of a file from a GitHub URL and caches it based on a time duration. This caching mechanism helps in avoiding redundant requests for the same file within the specified time frame. The purpose of this script is to facilitate efficient loading and caching of GitHub files to improve performance and reduce unnecessary API calls in the context of DharmaBot UI.
+The provided file contains a Python script that defines a function called `load_github_file` that fetches the raw content of a file from a GitHub URL and caches it. Fetched files are stored in a content-addressed on-disk cache that is shared by every worker process, revalidated with ETag/If-Modified-Since, served stale while a single background request refreshes them, and evicted least-recently-used once the cache grows past its size limit. When a fetch fails, the failure is remembered for a short while, so with the network down only one request per url waits for the timeout and the following ones serve whatever is cached, however old, right away. When nothing is cached yet either, a bundled offline snapshot (checked against its pinned sha256) is served instead so the graph can still start with no network at all. The purpose of this script is to facilitate efficient loading and caching of GitHub files to improve performance and reduce unnecessary API calls in the context of DharmaBot UI.
 """
 
-import functools
-from functools import lru_cache
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
 import time
+from contextlib import contextmanager
+
 import requests
 
+try:
+    import fcntl
+except ImportError:  # windows: fall back to in-process locking only
+    fcntl = None
+
 
 CACHE_DURATION = 24 * 60 * 60
+# how long past CACHE_DURATION a cached file may still be served while it is refreshed in the background
+STALE_DURATION = 7 * 24 * 60 * 60
+# spread expirations so workers that fetched at the same moment do not all revalidate at the same moment
+CACHE_JITTER = 0.1
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+REQUEST_TIMEOUT = 30
+# how long a failed fetch is remembered before the network is tried again
+FAILURE_TTL = int(os.getenv("DHARMABOT_GITHUB_FAILURE_TTL", "60"))
+
+CACHE_DIR = os.getenv("DHARMABOT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dharmabot", "github"))
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "snapshots")
+
+# urls with a bundled copy in SNAPSHOT_DIR, served when there is no network and no cache yet: url -> (file name, sha256)
+SNAPSHOTS = {
+    "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py": (
+        "test_pregel.py.txt", "713bd3549c063a536c066068272d51757b0048a6c308bef682bcaf8454cdfcc0"),
+}
+
+
+def to_raw_url(url):
+    # Convert GitHub URL to raw content URL
+    return url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+
+
+def _sha256(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_snapshot(url):
+    """
+    The bundled copy of `url`, or None when there is none or it does not match its pinned hash.
+    """
+    if url not in SNAPSHOTS:
+        return None
+    name, digest = SNAPSHOTS[url]
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, name), encoding="utf-8") as file:
+            content = file.read()
+    except OSError:
+        return None
+    if _sha256(content) != digest:
+        print(f"Ignoring snapshot {name}: sha256 does not match the pinned digest")
+        return None
+    return content
+
+
+class GithubFileCache:
+    """
+    On-disk cache of fetched files, laid out as:
+
+        <cache_dir>/blobs/<sha256 of content>   file contents, shared between urls with identical content
+        <cache_dir>/index/<sha256 of url>.json  etag, last-modified, blob digest and timestamps for a url
+        <cache_dir>/locks/<sha256 of url>.lock  flock target so only one process fetches a url at a time
+
+    Every process keeps the entries it has read in memory, so the hot path of `load` is a dict lookup.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, fresh_for=CACHE_DURATION, stale_for=STALE_DURATION, max_bytes=CACHE_MAX_BYTES,
+                 failure_ttl=FAILURE_TTL):
+        self.cache_dir = cache_dir
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.max_bytes = max_bytes
+        self.failure_ttl = failure_ttl
+        self.memory = {}
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        # url -> (time, status code) of its last failed fetch, while it is not retried
+        self.failures = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "stale_hits": 0, "revalidated": 0, "fetched": 0, "failure_hits": 0, "snapshot_hits": 0,
+                      "errors": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    # paths
+
+    def _index_path(self, url):
+        return os.path.join(self.cache_dir, "index", f"{_sha256(url)}.json")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest)
+
+    def _lock_path(self, url):
+        return os.path.join(self.cache_dir, "locks", f"{_sha256(url)}.lock")
+
+    # disk entries
+
+    def _read_entry(self, url):
+        try:
+            with open(self._index_path(url)) as file:
+                entry = json.load(file)
+            with open(self._blob_path(entry["digest"]), encoding="utf-8") as file:
+                entry["content"] = file.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def _write_entry(self, url, entry):
+        blob_path = self._blob_path(entry["digest"])
+        if not os.path.exists(blob_path):
+            _atomic_write(blob_path, entry["content"])
+        metadata = {key: value for key, value in entry.items() if key != "content"}
+        _atomic_write(self._index_path(url), json.dumps(metadata))
+
+    def _touch(self, url):
+        try:
+            os.utime(self._index_path(url))
+        except OSError:
+            pass
+
+    def _expires_at(self, entry, window):
+        # the jitter is derived from the digest so every process agrees on when an entry expires
+        jitter = int(entry["digest"][:8], 16) / 0xFFFFFFFF * CACHE_JITTER
+        return entry["fetched_at"] + window * (1 + jitter)
+
+    def is_fresh(self, entry, now=None):
+        return (now or time.time()) < self._expires_at(entry, self.fresh_for)
 
+    def is_servable(self, entry, now=None):
+        return (now or time.time()) < self._expires_at(entry, self.fresh_for) + self.stale_for
 
-def time_based_cache(seconds):
-    def wrapper_cache(func):
-        func = lru_cache(maxsize=None)(func)
-        func.lifetime = seconds
-        func.expiration = time.time() + func.lifetime
+    # fetching
 
-        @functools.wraps(func)
-        def wrapped_func(*args, **kwargs):
-            if time.time() >= func.expiration:
-                func.cache_clear()
-                func.expiration = time.time() + func.lifetime
-            return func(*args, **kwargs)
+    @contextmanager
+    def _process_lock(self, url):
+        if fcntl is None:
+            yield
+            return
+        path = self._lock_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-        return wrapped_func
+    def _fetch(self, url, entry):
+        """
+        Fetch `url`, revalidating `entry` if there is one. Returns the new entry, or raises on failure.
+        """
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
 
-    return wrapper_cache
+        response = requests.get(to_raw_url(url), headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and entry:
+            self._count("revalidated")
+            entry = dict(entry, fetched_at=time.time())
+        elif response.status_code == 200:
+            self._count("fetched")
+            entry = {
+                "url": url,
+                "digest": _sha256(response.text),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "content": response.text,
+            }
+        else:
+            raise requests.HTTPError(f"Status code: {response.status_code}", response=response)
+
+        self._write_entry(url, entry)
+        self.evict()
+        return entry
+
+    def _claim(self, url):
+        """
+        (event, leader): the leader does the refresh of `url` and sets the event when it is done.
+        """
+        with self.lock:
+            event = self.in_flight.get(url)
+            if event is not None:
+                return event, False
+            event = self.in_flight[url] = threading.Event()
+            return event, True
+
+    def _refresh(self, url):
+        """
+        Bring the cached entry for `url` up to date. Only one thread per process and one process per
+        cache directory does the network request; everyone else waits and reads what it wrote.
+        """
+        event, leader = self._claim(url)
+        if not leader:
+            event.wait()
+            entry = self.memory.get(url) or self._read_entry(url)
+            if entry is None:
+                raise requests.ConnectionError(f"Concurrent refresh of {url} failed")
+            return entry
+        return self._lead_refresh(url, event)
+
+    def _lead_refresh(self, url, event):
+        try:
+            with self._process_lock(url):
+                # another process may have refreshed the entry while we waited for the lock
+                entry = self._read_entry(url)
+                if entry is None or not self.is_fresh(entry):
+                    try:
+                        entry = self._fetch(url, entry)
+                    except (requests.RequestException, OSError) as e:
+                        self._count("errors")
+                        print(f"Failed to refresh {url}: {e}")
+                        status_code = getattr(getattr(e, "response", None), "status_code", None)
+                        self.failures[url] = (time.time(), status_code)
+                        if entry is None:
+                            raise
+                    else:
+                        self.failures.pop(url, None)
+            self.memory[url] = entry
+            return entry
+        finally:
+            with self.lock:
+                del self.in_flight[url]
+            event.set()
+
+    def recent_failure(self, url):
+        """
+        (time, status code) of the last failed fetch of `url` when it is too recent to try again, else None.
+        """
+        failure = self.failures.get(url)
+        if failure is not None and time.time() - failure[0] < self.failure_ttl:
+            return failure
+        return None
+
+    def _refresh_in_background(self, url):
+        if self.recent_failure(url):
+            return
+        # claimed here rather than in the thread, so two callers cannot both start one
+        event, leader = self._claim(url)
+        if not leader:
+            return
+
+        def run():
+            try:
+                self._lead_refresh(url, event)
+            except Exception:
+                pass
+
+        threading.Thread(target=run, name=f"refresh-{_sha256(url)[:8]}", daemon=True).start()
+
+    def load(self, url):
+        entry = self.memory.get(url)
+        if entry is not None and self.is_fresh(entry):
+            self._count("memory_hits")
+            return entry["content"]
+
+        if entry is None:
+            entry = self._read_entry(url)
+            if entry is not None:
+                self.memory[url] = entry
+                self._touch(url)
+                if self.is_fresh(entry):
+                    self._count("disk_hits")
+                    return entry["content"]
+
+        if entry is not None and self.is_servable(entry):
+            self._count("stale_hits")
+            self._refresh_in_background(url)
+            return entry["content"]
+
+        failure = self.recent_failure(url)
+        if failure is not None:
+            # the network just failed for this url, do not wait for the timeout again
+            self._count("failure_hits")
+            if entry is not None:
+                return entry["content"]
+            return self._snapshot_or_error(url, failure[1])
+
+        try:
+            return self._refresh(url)["content"]
+        except (requests.RequestException, OSError) as e:
+            if entry is not None:
+                # too old to serve normally, but still better than nothing when the network is down
+                return entry["content"]
+            status_code = getattr(getattr(e, "response", None), "status_code", None)
+            return self._snapshot_or_error(url, status_code)
+
+    def _snapshot_or_error(self, url, status_code):
+        snapshot = load_snapshot(url)
+        if snapshot is not None:
+            self._count("snapshot_hits")
+            return snapshot
+        return f"Failed to load file. Status code: {status_code}"
+
+    async def aload(self, url):
+        entry = self.memory.get(url)
+        if entry is not None and self.is_fresh(entry):
+            self._count("memory_hits")
+            return entry["content"]
+        # the slow paths read from disk, take file locks and hit the network, so keep them off the event loop
+        return await asyncio.to_thread(self.load, url)
+
+    def evict(self):
+        """
+        Delete least recently used urls until the blobs fit in `max_bytes`.
+        """
+        index_dir = os.path.join(self.cache_dir, "index")
+        try:
+            names = os.listdir(index_dir)
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            path = os.path.join(index_dir, name)
+            try:
+                with open(path) as file:
+                    digest = json.load(file)["digest"]
+                entries.append((os.path.getmtime(path), path, digest))
+            except (OSError, ValueError, KeyError):
+                continue
+
+        sizes = {}
+        for _, _, digest in entries:
+            try:
+                sizes[digest] = os.path.getsize(self._blob_path(digest))
+            except OSError:
+                sizes[digest] = 0
+        total = sum(sizes.values())
+
+        entries.sort()
+        while total > self.max_bytes and len(entries) > 1:
+            _, path, digest = entries.pop(0)
+            _remove(path)
+            if all(other != digest for _, _, other in entries):
+                _remove(self._blob_path(digest))
+                total -= sizes[digest]
+
+    def clear(self):
+        self.memory.clear()
+        self.failures.clear()
+        for sub_dir in ("index", "blobs"):
+            directory = os.path.join(self.cache_dir, sub_dir)
+            for name in os.listdir(directory) if os.path.isdir(directory) else []:
+                _remove(os.path.join(directory, name))
+
+
+def _atomic_write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{random.getrandbits(32):08x}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+github_file_cache = GithubFileCache()
 
 
-@time_based_cache(CACHE_DURATION)
 def load_github_file(url):
-    # Convert GitHub URL to raw content URL
-    raw_url = url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+    return github_file_cache.load(url)
 
-    # Send a GET request to the raw URL
-    response = requests.get(raw_url)
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        return response.text
-    else:
-        return f"Failed to load file. Status code: {response.status_code}"
+async def aload_github_file(url):
+    return await github_file_cache.aload(url)
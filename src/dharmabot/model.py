@@ -1,16 +1,181 @@
 """
-This file contains a function that is responsible for getting a specific chat model based on the configuration provided. It checks the model type specified in the configuration and returns an instance of either ChatOpenAI or ChatAnthropic with predefined parameters. This function is crucial for dynamically selecting and initializing the appropriate chat model based on the user's choice within the DharmaBot UI.
+This file contains a function that is responsible for getting a specific chat model based on the configuration provided. It checks the model type specified in the configuration and returns either a ChatOpenAI or ChatAnthropic instance with predefined parameters. Instances come from a process-wide registry, so every node invocation reuses the same client and the same pooled HTTP connections instead of paying for client setup and a fresh TLS handshake on every draft, critique and gather call. This function is crucial for dynamically selecting and initializing the appropriate chat model based on the user's choice within the DharmaBot UI.
 """
 
+import os
+import threading
+from typing import Any
+
+import anthropic
+import httpx
+from langchain_core.pydantic_v1 import Field, root_validator
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 
 
+class PooledChatAnthropic(ChatAnthropic):
+    """
+    ChatAnthropic on the given `http_client` and `http_async_client`, which ChatAnthropic itself has no parameters for.
+    Its sdk clients are built in its `validate_environment`; this subclass builds them again, in a validator that runs
+    after that one, with the same parameters plus the http clients. Written against langchain-anthropic 0.1: a version
+    that builds its sdk clients some other way makes this raise, rather than silently leave the pool unused.
+    """
+
+    http_client: Any = Field(default=None, exclude=True)
+    http_async_client: Any = Field(default=None, exclude=True)
+
+    @root_validator(skip_on_failure=True)
+    def use_http_clients(cls, values):
+        if values.get("http_client") is None and values.get("http_async_client") is None:
+            return values
+        if "_client" not in values or "_async_client" not in values:
+            raise TypeError("This langchain-anthropic builds its clients differently, PooledChatAnthropic needs updating")
+        client_params = {
+            "api_key": values["anthropic_api_key"].get_secret_value(),
+            "base_url": values["anthropic_api_url"],
+            "max_retries": values["max_retries"],
+            "default_headers": values.get("default_headers"),
+        }
+        # the same rule as ChatAnthropic: a timeout <= 0 is left out, None is passed on
+        if values["default_request_timeout"] is None or values["default_request_timeout"] > 0:
+            client_params["timeout"] = values["default_request_timeout"]
+        if values.get("http_client") is not None:
+            values["_client"] = anthropic.Client(**client_params, http_client=values["http_client"])
+        if values.get("http_async_client") is not None:
+            values["_async_client"] = anthropic.AsyncClient(**client_params, http_client=values["http_async_client"])
+        return values
+
+
+MODELS = {
+    # stream_usage, so streamed replies report their tokens too
+    "openai": (ChatOpenAI, {"temperature": 0, "model_name": "gpt-4o-2024-08-06", "stream_usage": True}),
+    "anthropic": (PooledChatAnthropic, {"temperature": 0, "model_name": "claude-3-5-sonnet-20240620"}),
+}
+
+BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com",
+}
+
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=120)
+POOL_TIMEOUT = httpx.Timeout(600, connect=10)
+
+
+class ModelRegistry:
+    """
+    Hands out one shared chat model per (provider, model, params). All models of a provider share one
+    sync and one async httpx client, so connections to the provider are kept alive across calls.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models = {}
+        self.http_clients = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _http_clients_for(self, provider):
+        if provider not in self.http_clients:
+            self.http_clients[provider] = (
+                httpx.Client(limits=POOL_LIMITS, timeout=POOL_TIMEOUT),
+                httpx.AsyncClient(limits=POOL_LIMITS, timeout=POOL_TIMEOUT),
+            )
+        return self.http_clients[provider]
+
+    def _create(self, provider, params):
+        model_class, _ = MODELS[provider]
+        if provider not in BASE_URLS:
+            # models registered in MODELS by benchmarks do not talk to a provider, so they get no pool
+            return model_class(**params)
+        http_client, http_async_client = self._http_clients_for(provider)
+        return model_class(**params, http_client=http_client, http_async_client=http_async_client)
+
+    def get(self, provider, **overrides):
+        if provider not in MODELS:
+            raise ValueError(f"Unknown model provider: {provider}")
+        params = {**MODELS[provider][1], **overrides}
+        key = (provider, params["model_name"], tuple(sorted(params.items())))
+
+        model = self.models.get(key)
+        if model is not None:
+            self.stats["hits"] += 1
+            return model
+        with self.lock:
+            model = self.models.get(key)
+            if model is None:
+                self.stats["misses"] += 1
+                model = self.models[key] = self._create(provider, params)
+            else:
+                self.stats["hits"] += 1
+        return model
+
+    def warm_up(self, providers=("openai", "anthropic"), connect=False):
+        """
+        Create the default model for each provider ahead of the first request. With `connect=True`, also
+        open a connection to each provider so the TLS handshake is out of the way too.
+        """
+        for provider in providers:
+            try:
+                self.get(provider)
+                if connect:
+                    # any response (even a 404) leaves a warm keep-alive connection in the pool
+                    self.http_clients[provider][0].head(BASE_URLS[provider])
+            except Exception as e:
+                print(f"Failed to warm up {provider} model: {e}")
+
+    def live_connections(self):
+        counts = {}
+        for provider, clients in self.http_clients.items():
+            counts[provider] = sum(_pool_size(client) for client in clients)
+        return counts
+
+    def report(self):
+        return {**self.stats, "models": len(self.models), "live_connections": self.live_connections()}
+
+    def close(self):
+        """
+        Close the sync http clients. The async ones belong to an event loop, close them with `aclose` on it.
+        """
+        for http_client, _ in self.http_clients.values():
+            http_client.close()
+        self.http_clients.clear()
+        self.models.clear()
+
+    async def aclose(self):
+        """
+        Close the sync and the async http clients of every provider.
+        """
+        for http_client, http_async_client in self.http_clients.values():
+            http_client.close()
+            await http_async_client.aclose()
+        self.http_clients.clear()
+        self.models.clear()
+
+    def start_warm_up(self):
+        """
+        Warm up the models and their connections in a background thread, unless DHARMABOT_WARM_UP=0.
+        Called by the server at startup, not on import, so scripts and benchmarks never touch the network for it.
+        """
+        if os.getenv("DHARMABOT_WARM_UP", "1") == "0":
+            return None
+        thread = threading.Thread(target=self.warm_up, kwargs={"connect": True}, name="model-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+def _pool_size(client):
+    # httpx does not expose its pool publicly, so this is best effort
+    try:
+        return len(client._transport._pool.connections)
+    except AttributeError:
+        return 0
+
+
+model_registry = ModelRegistry()
+
+
 def _get_model(config, default, key):
     model = config['configurable'].get(key, default)
-    if model == "openai":
-        return ChatOpenAI(temperature=0, model_name="gpt-4o-2024-08-06")
-    elif model == "anthropic":
-        return ChatAnthropic(temperature=0, model_name="claude-3-5-sonnet-20240620")
+    if model in MODELS:
+        return model_registry.get(model)
     else:
         raise ValueError
@@ -1,15 +1,84 @@
 """
-This file appears to contain Python functions related to handling and processing Python code blocks within text messages. The `extract_python_code` function extracts Python code snippets from text, while the `check` function checks for the presence and correctness of a single Python code block in the last answer of the conversation, providing appropriate error messages if needed. This file seems to be part of the DharmaBot UI's functionality to assist users in interacting with Python code snippets.
+This file appears to contain Python functions related to handling and processing Python code blocks within text messages. The `extract_python_code` function extracts Python code snippets from text with a `CodeBlockScanner`, which can also follow a reply as it streams in, while the `check` function checks for the presence and correctness of a single Python code block in the last answer of the conversation, providing appropriate error messages if needed. The code block is then validated locally (see `dharmabot.validation`): a draft that is certainly wrong goes straight back to `draft_answer` with a precise error, and code that critique already accepted is accepted again without a critique call. This file seems to be part of the DharmaBot UI's functionality to assist users in interacting with Python code snippets.
 """
 
-import re
+from dharmabot.nodes.compact import chatter_id
 from dharmabot.state import AgentState
+from dharmabot.validation import validate, accepted_code, validation_stats, DEFAULT_CODE_VALIDATION
+
+PYTHON_FENCE = "```python"
+FENCE = "```"
+
+
+class CodeBlockScanner:
+    """
+    Finds the ```python blocks of a reply while it streams in, one chunk at a time, in linear time: each
+    character is looked at once, apart from the few at the end of a chunk that may start a fence.
+
+    `blocks` is what `re.findall(r'```python\s*(.*?)\s*(```|$)', text, re.DOTALL)` returns for the whole text,
+    (code, "```") for each closed block and (code, "") for one left open at the end, once `close` is called.
+    `count` is known as soon as a fence opens, so a reply with more than one block can be abandoned early.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        # pieces of the block being read, None outside of a block
+        self.current = None
+        # the end of the input so far that may be the beginning of a fence split over two chunks
+        self.tail = ""
+
+    @property
+    def count(self):
+        return len(self.blocks) + (self.current is not None)
+
+    @property
+    def multiple(self):
+        return self.count > 1
+
+    def feed(self, text):
+        text = self.tail + text
+        position = 0
+        while True:
+            if self.current is None:
+                start = text.find(PYTHON_FENCE, position)
+                if start < 0:
+                    self.tail = text[max(position, len(text) - len(PYTHON_FENCE) + 1):]
+                    return self
+                position = start + len(PYTHON_FENCE)
+                self.current = []
+            else:
+                end = text.find(FENCE, position)
+                if end < 0:
+                    keep_from = max(position, len(text) - len(FENCE) + 1)
+                    self.current.append(text[position:keep_from])
+                    self.tail = text[keep_from:]
+                    return self
+                self.current.append(text[position:end])
+                self.blocks.append(("".join(self.current).strip(), FENCE))
+                self.current = None
+                position = end + len(FENCE)
+
+    def close(self):
+        """
+        End of the reply: a block still open runs to the end. Returns the blocks.
+        """
+        if self.current is not None:
+            self.current.append(self.tail)
+            self.blocks.append(("".join(self.current).strip(), ""))
+            self.current = None
+        self.tail = ""
+        return self.blocks
+
+
+def chunk_text(content):
+    # anthropic streams content as a list of blocks
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content or ""
 
 
 def extract_python_code(text):
-    pattern = r'```python\s*(.*?)\s*(```|$)'
-    matches = re.findall(pattern, text, re.DOTALL)
-    return matches
+    return CodeBlockScanner().feed(text).close()
 
 
 error_parsing = """Make sure your response contains a code block in the following format:
@@ -20,15 +89,29 @@ error_parsing = """Make sure your response contains a code block in the followin
 
 When trying to parse out that code block, got this error: {error}"""
 
+error_validation = """Your code block has a problem that was found before running a review:
+
+{error}
+
+Fix it and answer with the whole corrected code block again."""
+
 
-def check(state: AgentState):
+def check(state: AgentState, config):
     last_answer = state['messages'][-1]
     try:
         code_blocks = extract_python_code(last_answer.content)
     except Exception as e:
-        return {"messages": [{"role": "user", "content": error_parsing.format(error=str(e))}]}
+        return {"messages": [{"role": "user", "id": chatter_id("check"), "content": error_parsing.format(error=str(e))}]}
     if len(code_blocks) == 0:
-        return {"messages": [{"role": "user", "content": error_parsing.format(error="Did not find a code block!")}]}
+        return {"messages": [{"role": "user", "id": chatter_id("check"), "content": error_parsing.format(error="Did not find a code block!")}]}
     if len(code_blocks) > 1:
-        return {"messages": [{"role": "user", "content": error_parsing.format(error="Found multiple code blocks!")}]}
-    return {"code": f"```python\n{code_blocks[0][0]}\n```"}
+        return {"messages": [{"role": "user", "id": chatter_id("check"), "content": error_parsing.format(error="Found multiple code blocks!")}]}
+    code = code_blocks[0][0]
+    mode = (config or {}).get("configurable", {}).get("code_validation", DEFAULT_CODE_VALIDATION)
+    if mode != "off" and accepted_code.accepts(code, state.get('requirements')):
+        validation_stats["accepted_by_hash"] += 1
+        return {"code": f"```python\n{code}\n```", "accepted": True}
+    error = validate(code, mode)
+    if error:
+        return {"messages": [{"role": "user", "id": chatter_id("check"), "content": error_validation.format(error=error)}]}
+    return {"code": f"```python\n{code}\n```", "accepted": False}
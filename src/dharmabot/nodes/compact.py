@@ -0,0 +1,44 @@
+"""
+This file contains the `compact` node, which runs at the end of every `dharmaflow` turn. The review loop leaves its chatter in the state: the errors `check` sends back, the feedback `critique` gives and the drafts it rejected. Once the turn is over none of that is needed any more, so this node removes it and keeps only the user's messages and the final answer of each turn, and beyond a cap it drops the oldest messages of the thread. The purpose of this is to keep the state of a long thread, and with it every checkpoint and every prompt built from it, from growing with the review round trips.
+"""
+
+import os
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+
+from dharmabot.state import AgentState
+
+THREAD_MAX_MESSAGES = int(os.getenv("DHARMABOT_THREAD_MAX_MESSAGES", "50"))
+# ids of the messages the review loop adds, so they can be told apart from the user's
+CHATTER_PREFIXES = ("check-", "critique-")
+
+
+def chatter_id(node):
+    return f"{node}-{uuid.uuid4()}"
+
+
+def is_chatter(message):
+    return (message.id or "").startswith(CHATTER_PREFIXES)
+
+
+def compact(state: AgentState, config):
+    configurable = (config or {}).get("configurable", {})
+    if not configurable.get("compact_messages", True):
+        # a node has to write something
+        return {"messages": []}
+    messages = state['messages']
+    # the turn started at the last message the user wrote (none is left after `gather_requirements` called Build)
+    turn_start = next((i for i in range(len(messages) - 1, -1, -1)
+                       if isinstance(messages[i], HumanMessage) and not is_chatter(messages[i])), -1)
+    answer = next((i for i in range(len(messages) - 1, turn_start, -1)
+                   if isinstance(messages[i], AIMessage) and not is_chatter(messages[i])), None)
+    removed = [
+        message for i, message in enumerate(messages)
+        if is_chatter(message) or (i > turn_start and i != answer and isinstance(message, AIMessage))
+    ]
+    removed_ids = {message.id for message in removed}
+    kept = [message for message in messages if message.id not in removed_ids]
+    max_messages = configurable.get("thread_max_messages", THREAD_MAX_MESSAGES)
+    removed += kept[:max(0, len(kept) - max_messages)]
+    return {"messages": [RemoveMessage(id=message.id) for message in removed]}
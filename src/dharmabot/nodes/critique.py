@@ -1,15 +1,18 @@
 """
-This Python file seems to be a part of the DharmaBot UI system. It includes functions related to critiquing a developer's work on building a LangGraph application. The `critique` function loads a unit test file from a GitHub URL, prompts for a critique based on the content, swaps message roles between AI and user, and then invokes a model to provide feedback on the developer's work.
+This Python file seems to be a part of the DharmaBot UI system. It includes functions related to critiquing a developer's work on building a LangGraph application. The `critique` function (and its async counterpart `acritique`) loads a unit test file from a GitHub URL, prompts for a critique based on the content, swaps message roles between AI and user, and then invokes a model to provide feedback on the developer's work. Accepted code is remembered, so `check` can accept the same code again without another critique.
 """
 
-from dharmabot.loader import load_github_file
+from dharmabot.loader import load_github_file, aload_github_file
 from dharmabot.model import _get_model
+from dharmabot.retrieval import select_context
+from dharmabot.nodes.compact import chatter_id
 from dharmabot.state import AgentState
+from dharmabot.validation import accepted_code
 from langchain_core.messages import AIMessage
 from langchain_core.pydantic_v1 import BaseModel
 
 critique_prompt = """You are tasked with critiquing a junior developers first attempt at building a LangGraph application. \
-Here is a long unit test file for LangGraph. This should contain a lot (but possibly not all) \
+Here is a long unit test file for LangGraph (or the parts of it most relevant to this conversation). This should contain a lot (but possibly not all) \
 relevant information on how to use LangGraph.
 
 <unit_test_file>
@@ -53,28 +56,47 @@ def _swap_messages(messages):
     return new_messages
 
 
-def critique(state: AgentState, config):
-    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
-    file_contents = load_github_file(github_url)
-    messages = [
+def _critique_messages(state: AgentState, file_contents, config):
+    file_contents = select_context(file_contents, state.get('requirements'), state['messages'], config)
+    return [
                    {"role": "user", "content": critique_prompt.format(file=file_contents)},
                    {"role": "assistant", "content": state.get('requirements')},
 
                ] + _swap_messages(state['messages'])
-    model = _get_model(config, "openai", "critique_model").with_structured_output(Accept)
-    response = model.invoke(messages)
+
+
+def _critique_update(state: AgentState, response):
     accepted = response.accept
     if accepted:
+        # check accepts the same code for the same requirements without asking again
+        code = state.get('code', '').removeprefix("```python\n").removesuffix("\n```")
+        accepted_code.add(code, state.get('requirements'))
         return {
             "messages": [
-                {"role": "user", "content": response.logic},
-                {"role": "assistant", "content": "okay, sending to user"}],
+                {"role": "user", "id": chatter_id("critique"), "content": response.logic},
+                {"role": "assistant", "id": chatter_id("critique"), "content": "okay, sending to user"}],
             "accepted": True
         }
     else:
         return {
             "messages": [
-                {"role": "user", "content": response.logic},
+                {"role": "user", "id": chatter_id("critique"), "content": response.logic},
             ],
             "accepted": False
         }
+
+
+def critique(state: AgentState, config):
+    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+    messages = _critique_messages(state, load_github_file(github_url), config)
+    model = _get_model(config, "openai", "critique_model").with_structured_output(Accept)
+    response = model.invoke(messages)
+    return _critique_update(state, response)
+
+
+async def acritique(state: AgentState, config):
+    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+    messages = _critique_messages(state, await aload_github_file(github_url), config)
+    model = _get_model(config, "openai", "critique_model").with_structured_output(Accept)
+    response = await model.ainvoke(messages)
+    return _critique_update(state, response)
@@ -1,13 +1,19 @@
 """
-This file contains a function called `draft_answer` that retrieves a unit test file from a specific GitHub URL related to LangGraph, incorporates it into a prompt message, and then uses a model to generate a response based on user input and the provided file content. The purpose of this script is to draft answers to user questions about LangGraph functionality and bugs by leveraging the information from the unit test file and a machine learning model.
+This file contains a function called `draft_answer` (and its async counterpart `adraft_answer`) that retrieves a unit test file from a specific GitHub URL related to LangGraph, incorporates it into a prompt message, and then uses a model to generate a response based on user input and the provided file content. The reply is streamed through a `CodeBlockScanner`, and a draft that opens a second code block is cut off right there, since `check` would reject it anyway. The purpose of this script is to draft answers to user questions about LangGraph functionality and bugs by leveraging the information from the unit test file and a machine learning model.
 """
 
-from dharmabot.loader import load_github_file
+from contextlib import aclosing, closing
+
+from langchain_core.messages import AIMessage, message_chunk_to_message
+
+from dharmabot.loader import load_github_file, aload_github_file
 from dharmabot.model import _get_model
+from dharmabot.nodes.check import CodeBlockScanner, chunk_text
+from dharmabot.retrieval import select_context
 from dharmabot.state import AgentState
 
 prompt = """You are tasked with answering questions about LangGraph functionality and bugs.
-Here is a long unit test file for LangGraph. This should contain a lot (but possibly not all) \
+Here is a long unit test file for LangGraph (or the parts of it most relevant to this conversation). This should contain a lot (but possibly not all) \
 relevant information on how to use LangGraph.
 
 <unit_test_file>
@@ -34,13 +40,63 @@ You generate code using markdown python syntax, eg:
 Remember, only generate one of those code blocks!"""
 
 
-def draft_answer(state: AgentState, config):
-    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
-    file_contents = load_github_file(github_url)
-    messages = [
+def _draft_messages(state: AgentState, file_contents, config):
+    file_contents = select_context(file_contents, state.get('requirements'), state['messages'], config)
+    return [
         {"role": "system", "content": prompt.format(file=file_contents)},
                    {"role": "user", "content": state.get('requirements')}
     ] + state['messages']
+
+
+def _add_chunk(response, chunk, scanner):
+    """
+    The reply so far with `chunk` added, and whether it already has more than one code block, in which case
+    `check` will send it back anyway and the rest of it is not worth waiting (and paying) for.
+    """
+    response = chunk if response is None else response + chunk
+    if scanner.feed(chunk_text(chunk.content)).multiple:
+        print(f"Draft abandoned after {len(chunk_text(response.content))} characters: more than one code block")
+        return response, True
+    return response, False
+
+
+def _draft_message(response):
+    # a stream that yielded nothing, or was stopped before its first chunk, is an empty draft that `check` sends back
+    return AIMessage(content="") if response is None else message_chunk_to_message(response)
+
+
+def _stream_draft(model, messages, stop=None):
+    """
+    The streamed reply. Once the `stop` event, if any, is set the stream is closed and the reply so far returned.
+    """
+    response, scanner = None, CodeBlockScanner()
+    with closing(model.stream(messages)) as chunks:
+        for chunk in chunks:
+            response, abandon = _add_chunk(response, chunk, scanner)
+            if abandon or (stop is not None and stop.is_set()):
+                break
+    return _draft_message(response)
+
+
+async def _astream_draft(model, messages):
+    response, scanner = None, CodeBlockScanner()
+    async with aclosing(model.astream(messages)) as chunks:
+        async for chunk in chunks:
+            response, abandon = _add_chunk(response, chunk, scanner)
+            if abandon:
+                break
+    return _draft_message(response)
+
+
+def draft_answer(state: AgentState, config):
+    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+    messages = _draft_messages(state, load_github_file(github_url), config)
+    model = _get_model(config, "anthropic", "draft_model")
+    return {"messages": [_stream_draft(model, messages)]}
+
+
+async def adraft_answer(state: AgentState, config):
+    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+    messages = _draft_messages(state, await aload_github_file(github_url), config)
     model = _get_model(config, "anthropic", "draft_model")
-    response = model.invoke(messages)
-    return {"messages": [response]}
+    return {"messages": [await _astream_draft(model, messages)]}
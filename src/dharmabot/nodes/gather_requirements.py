@@ -1,11 +1,14 @@
 """
-This file contains Python code related to gathering requirements for the DharmaBot UI. It includes functions to flatten a nested list of prompts, define a build class with requirements, and gather requirements based on prompts provided in the 'gather_prompt' list. The purpose of this code is to facilitate the process of collecting user requirements for the DharmaBot UI by presenting specific prompts and extracting necessary information for further processing.
+This file contains Python code related to gathering requirements for the DharmaBot UI. It includes functions to flatten a nested list of prompts, define a build class with requirements, and gather requirements based on prompts provided in the 'gather_prompt' list. Plain text replies to the lore questions are cached in `response_cache`, so a question that was already answered (or a close rephrasing of it) is served without an LLM call; turns that call the `Build` tool always go to the model. The purpose of this code is to facilitate the process of collecting user requirements for the DharmaBot UI by presenting specific prompts and extracting necessary information for further processing.
 """
 
 from dharmabot.model import _get_model
+from dharmabot.response_cache import response_cache, prompt_version, RESPONSE_CACHE_ENABLED
 from dharmabot.state import AgentState
 from typing import TypedDict
-from langchain_core.messages import RemoveMessage
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langchain_core.messages import AIMessage, RemoveMessage
+import time
 from itertools import chain
 from collections.abc import Iterable
 
@@ -51,20 +54,66 @@ gather_prompt = [
 
 gather_prompt = "\n".join(flatten(gather_prompt))
 
+# sent instead of the model's token events when a reply comes from the cache, so streaming clients still see it
+CACHED_RESPONSE_EVENT = "cached_response"
+
 
 class Build(TypedDict):
     requirements: str
 
 
+def _gather_update(state: AgentState, response):
+    if len(response.tool_calls) == 0:
+        # requirements of an earlier turn of a persistent thread must not send this one to draft_answer
+        return {"messages": [response], "requirements": ""}
+    else:
+        requirements = response.tool_calls[0]['args']['requirements']
+        delete_messages = [RemoveMessage(id=m.id) for m in state['messages']]
+        return {"requirements": requirements, "messages": delete_messages}
+
+
+def _cache_key(state: AgentState, config):
+    configurable = config['configurable']
+    if not configurable.get("response_cache", RESPONSE_CACHE_ENABLED):
+        return None
+    version = prompt_version(gather_prompt, configurable.get("gather_model", "openai"))
+    return response_cache.key(version, state['messages'])
+
+
 def gather_requirements(state: AgentState, config):
+    key = _cache_key(state, config)
+    cached = response_cache.get(key)
+    if cached is not None:
+        try:
+            dispatch_custom_event(CACHED_RESPONSE_EVENT, {"content": cached}, config=config)
+        except RuntimeError:
+            # called outside of a graph run, nobody is listening
+            pass
+        return _gather_update(state, AIMessage(content=cached))
     messages = [
        {"role": "system", "content": gather_prompt}
    ] + state['messages']
     model = _get_model(config, "openai", "gather_model").bind_tools([Build])
+    start = time.perf_counter()
     response = model.invoke(messages)
-    if len(response.tool_calls) == 0:
-        return {"messages": [response]}
-    else:
-        requirements = response.tool_calls[0]['args']['requirements']
-        delete_messages = [RemoveMessage(id=m.id) for m in state['messages']]
-        return {"requirements": requirements, "messages": delete_messages}
+    response_cache.put(key, response, time.perf_counter() - start)
+    return _gather_update(state, response)
+
+
+async def agather_requirements(state: AgentState, config):
+    key = _cache_key(state, config)
+    cached = response_cache.get(key)
+    if cached is not None:
+        try:
+            await adispatch_custom_event(CACHED_RESPONSE_EVENT, {"content": cached}, config=config)
+        except RuntimeError:
+            pass
+        return _gather_update(state, AIMessage(content=cached))
+    messages = [
+       {"role": "system", "content": gather_prompt}
+   ] + state['messages']
+    model = _get_model(config, "openai", "gather_model").bind_tools([Build])
+    start = time.perf_counter()
+    response = await model.ainvoke(messages)
+    response_cache.put(key, response, time.perf_counter() - start)
+    return _gather_update(state, response)
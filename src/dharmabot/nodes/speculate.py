@@ -0,0 +1,177 @@
+"""
+This file contains the `speculate` node, which takes the place of the `draft_answer` -> `check` -> `critique` loop when `draft_candidates` in the config is more than 1. It drafts that many candidate answers at the same time, each at its own temperature (and, with `draft_candidate_models`, with its own model), runs `check` on each candidate as soon as it is written and has the ones that pass critiqued, all concurrently. The first candidate critique accepts is the answer, and the drafts and critiques still running are cancelled (in the sync graph, where the candidates run in threads on the sync model clients, the drafts stop at their next chunk and a critique already sent runs to its end unread). Only when every candidate is rejected does the graph go round again, with the feedback on one of them. The purpose of this is to pay for a few model calls in parallel instead of a whole sequential round trip whenever the first draft would have been rejected.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+
+from dharmabot.loader import aload_github_file, load_github_file
+from dharmabot.model import MODELS, model_registry, _get_model
+from dharmabot.nodes.check import check, chunk_text
+from dharmabot.nodes.critique import Accept, _critique_messages, _critique_update
+from dharmabot.nodes.draft import _draft_messages, _astream_draft, _stream_draft
+from dharmabot.state import AgentState
+
+DRAFT_CANDIDATES = int(os.getenv("DHARMABOT_DRAFT_CANDIDATES", "1"))
+# candidate i drafts at CANDIDATE_TEMPERATURES[i % len(CANDIDATE_TEMPERATURES)], so they do not all write the same draft
+CANDIDATE_TEMPERATURES = (0, 0.7, 1.0, 0.4)
+# the winning draft arrives whole, the candidates are not streamed to the user
+SPECULATIVE_DRAFT_EVENT = "speculative_draft"
+
+speculation_stats = {"rounds": 0, "candidates": 0, "accepted": 0, "rejected_rounds": 0, "cancelled": 0, "failed": 0}
+
+
+def draft_candidates(config):
+    return max(1, int((config or {}).get("configurable", {}).get("draft_candidates", DRAFT_CANDIDATES)))
+
+
+def _candidate_model(config, i):
+    configurable = config['configurable']
+    models = configurable.get("draft_candidate_models") or [configurable.get("draft_model", "anthropic")]
+    model = models[i % len(models)]
+    if model not in MODELS:
+        raise ValueError(f"Unknown model provider: {model}")
+    return model_registry.get(model, temperature=CANDIDATE_TEMPERATURES[i % len(CANDIDATE_TEMPERATURES)])
+
+
+def _check_candidate(state: AgentState, config, message):
+    """
+    Runs `check` on a draft. Returns its update, and the candidate state to critique when it needs a critique.
+    """
+    candidate = {**state, "messages": state['messages'] + [message]}
+    update = check(candidate, config)
+    if "messages" in update or update.get("accepted"):
+        # sent back by check, or accepted by hash without a critique
+        return update, None
+    candidate.update(update)
+    return update, candidate
+
+
+async def _candidate(state: AgentState, config, file_contents, draft_messages, i):
+    """
+    Drafts candidate `i` and reviews it. Returns the draft and the update `check` and `critique` made for it.
+    """
+    message = await _astream_draft(_candidate_model(config, i), draft_messages)
+    update, candidate = _check_candidate(state, config, message)
+    if candidate is None:
+        return message, update
+    model = _get_model(config, "openai", "critique_model").with_structured_output(Accept)
+    response = await model.ainvoke(_critique_messages(candidate, file_contents, config))
+    return message, {**update, **_critique_update(candidate, response)}
+
+
+def _candidate_sync(state: AgentState, config, file_contents, draft_messages, i, decided):
+    """
+    Like `_candidate`, in a worker thread. Gives up as soon as the `decided` event is set.
+    """
+    message = _stream_draft(_candidate_model(config, i), draft_messages, stop=decided)
+    if decided.is_set():
+        raise CancelledError()
+    update, candidate = _check_candidate(state, config, message)
+    if candidate is None:
+        return message, update
+    if decided.is_set():
+        raise CancelledError()
+    model = _get_model(config, "openai", "critique_model").with_structured_output(Accept)
+    response = model.invoke(_critique_messages(candidate, file_contents, config))
+    return message, {**update, **_critique_update(candidate, response)}
+
+
+def _rejected_update(rejected):
+    speculation_stats["rejected_rounds"] += 1
+    # a critique says more about what to fix than a parsing error does, so go round again with one if there is one
+    message, update = next((r for r in rejected if "code" in r[1]), rejected[0])
+    return {**update, "messages": [message] + update["messages"], "accepted": False}
+
+
+async def aspeculate(state: AgentState, config):
+    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+    file_contents = await aload_github_file(github_url)
+    draft_messages = _draft_messages(state, file_contents, config)
+    candidates = draft_candidates(config)
+    speculation_stats["rounds"] += 1
+    speculation_stats["candidates"] += candidates
+
+    tasks = [asyncio.create_task(_candidate(state, config, file_contents, draft_messages, i)) for i in range(candidates)]
+    rejected, error = [], None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                message, update = await next_done
+            except Exception as e:
+                # one failing provider call does not stop the other candidates
+                print(f"Draft candidate failed: {e}")
+                speculation_stats["failed"] += 1
+                error = error or e
+                continue
+            if update.get("accepted"):
+                speculation_stats["accepted"] += 1
+                try:
+                    await adispatch_custom_event(SPECULATIVE_DRAFT_EVENT, {"content": chunk_text(message.content)}, config=config)
+                except RuntimeError:
+                    # called outside of a graph run, nobody is listening
+                    pass
+                return {**update, "messages": [message] + update.get("messages", [])}
+            rejected.append((message, update))
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        speculation_stats["cancelled"] += len(pending)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    if not rejected:
+        raise error
+    return _rejected_update(rejected)
+
+
+def speculate(state: AgentState, config):
+    # the sync graph runs its nodes without an event loop, so the candidates run side by side in threads, on the
+    # sync model clients, rather than on an event loop of their own that the pooled async clients are not bound to
+    github_url = "https://github.com/langchain-ai/langgraph/blob/main/libs/langgraph/tests/test_pregel.py"
+    file_contents = load_github_file(github_url)
+    draft_messages = _draft_messages(state, file_contents, config)
+    candidates = draft_candidates(config)
+    speculation_stats["rounds"] += 1
+    speculation_stats["candidates"] += candidates
+
+    decided = threading.Event()
+    executor = ThreadPoolExecutor(candidates, thread_name_prefix="speculate")
+    # every candidate runs in its own copy of the context, which carries the callbacks of the graph run
+    futures = [
+        executor.submit(contextvars.copy_context().run, _candidate_sync, state, config, file_contents, draft_messages, i, decided)
+        for i in range(candidates)
+    ]
+    rejected, error = [], None
+    try:
+        for next_done in as_completed(futures):
+            try:
+                message, update = next_done.result()
+            except Exception as e:
+                print(f"Draft candidate failed: {e}")
+                speculation_stats["failed"] += 1
+                error = error or e
+                continue
+            if update.get("accepted"):
+                speculation_stats["accepted"] += 1
+                try:
+                    dispatch_custom_event(SPECULATIVE_DRAFT_EVENT, {"content": chunk_text(message.content)}, config=config)
+                except RuntimeError:
+                    # called outside of a graph run, nobody is listening
+                    pass
+                return {**update, "messages": [message] + update.get("messages", [])}
+            rejected.append((message, update))
+    finally:
+        # the drafts still streaming stop at their next chunk, a critique call already sent runs to its end unread
+        decided.set()
+        speculation_stats["cancelled"] += sum(not future.done() for future in futures)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if not rejected:
+        raise error
+    return _rejected_update(rejected)
@@ -0,0 +1,207 @@
+"""
+This file contains a response cache for `gather_requirements`. That node answers from the fixed Dharmaverse lore prompt, so many users ask it nearly the same questions ("what is Dharmaverse?", "what sanghas are there?") and every one of them used to be a full LLM call. Replies are keyed on a version of the prompt and model plus the normalized recent messages of the conversation. The exact tier serves a reply when those match exactly after normalization (case, punctuation and whitespace). The semantic tier serves it when the latest message opens the conversation and is close enough to a cached first message under a small local embedding (hashed word and character trigram counts, compared by cosine similarity), so no embedding model or network call is needed. A conversation in which the user says something about themselves ("I'm Bob", "my sangha is...") is never cached, in either tier: the reply may be about that user, and "hi I'm Bob" is as close to "hi I'm Alice" as any rephrasing. Entries expire after a TTL and the least recently used ones are dropped beyond a size cap. Only plain text replies are stored: a turn that ends in a `Build` tool call changes the state of the graph and is never served from the cache. The purpose of this file is to answer the frequent lore questions without an LLM call, and to report how often that happens and how much latency it saves.
+"""
+
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from dharmabot.retrieval import tokenize
+
+RESPONSE_CACHE_ENABLED = os.getenv("DHARMABOT_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("DHARMABOT_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("DHARMABOT_RESPONSE_CACHE_TTL", str(24 * 60 * 60)))
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("DHARMABOT_RESPONSE_CACHE_THRESHOLD", "0.8"))
+# how many of the latest messages make up the key; the latest one is compared semantically, the others exactly
+RESPONSE_CACHE_MESSAGES = 3
+EMBEDDING_DIMENSIONS = 2 ** 16
+
+# first person statements in normalized text, "I'm" and "I've" normalize to "i m" and "i ve"
+_personal = re.compile(r"\b(?:i m|im|i am|i ve|i have|i was|i live|i work|my|mine|myself|call me)\b")
+_punctuation = re.compile(r"[^\w\s]")
+_whitespace = re.compile(r"\s+")
+
+
+def normalize(text):
+    return _whitespace.sub(" ", _punctuation.sub(" ", text.lower())).strip()
+
+
+def prompt_version(*parts):
+    """
+    A short digest of the prompt, model and anything else a cached reply depends on.
+    """
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _role_and_text(message):
+    if isinstance(message, dict):
+        role, content = message.get("role", ""), message.get("content", "")
+    else:
+        role, content = message.type, message.content
+    return ("user" if role in ("user", "human") else "assistant"), (content if isinstance(content, str) else "")
+
+
+def is_personal(messages):
+    """
+    Whether any user message of the conversation tells something about the user.
+    """
+    return any(role == "user" and _personal.search(normalize(text)) for role, text in map(_role_and_text, messages))
+
+
+def embed(text):
+    """
+    A sparse, L2-normalized vector of hashed word and character trigram counts. Words catch rephrasings
+    that keep the key terms, trigrams catch typos and inflections.
+    """
+    normalized = normalize(text)
+    features = Counter(f"w:{word}" for word in tokenize(normalized))
+    padded = f" {normalized} "
+    features.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    vector = Counter()
+    for feature, count in features.items():
+        vector[int(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += count
+    norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+    return {index: value / norm for index, value in vector.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(index, 0.0) for index, value in a.items())
+
+
+class CacheEntry:
+    def __init__(self, content, vector, latency):
+        self.content = content
+        self.vector = vector
+        # how long the LLM call took, i.e. what a hit saves
+        self.latency = latency
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL, threshold=RESPONSE_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        # (version, context, latest message) -> entry, least recently used first
+        self.entries = OrderedDict()
+        # (version, context) -> keys of its entries, the candidates of the semantic tier
+        self.by_context = {}
+        self.lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stored": 0, "not_cacheable": 0,
+                      "personal": 0, "expired": 0, "evicted": 0, "saved_seconds": 0.0}
+
+    def key(self, version, messages):
+        """
+        (version, context, latest message) for a conversation ending in a user message, None for anything else
+        and for personal conversations.
+        """
+        recent = [_role_and_text(message) for message in messages[-RESPONSE_CACHE_MESSAGES:]]
+        if not recent or recent[-1][0] != "user":
+            return None
+        if is_personal(messages):
+            with self.lock:
+                self.stats["personal"] += 1
+            return None
+        context = tuple((role, normalize(text)) for role, text in recent[:-1])
+        return version, context, normalize(recent[-1][1])
+
+    def get(self, key):
+        """
+        The cached reply for `key`, from the exact tier or else the semantic one, or None.
+        """
+        if key is None:
+            return None
+        start = time.perf_counter()
+        with self.lock:
+            entry = self._live(key)
+            tier = "exact_hits"
+            if entry is None:
+                tier = "semantic_hits"
+                entry = self._nearest(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats[tier] += 1
+            self.stats["saved_seconds"] += max(0.0, entry.latency - (time.perf_counter() - start))
+            return entry.content
+
+    def put(self, key, response, latency):
+        """
+        Store a reply that took `latency` seconds to generate. Replies with tool calls are never stored.
+        """
+        if key is None:
+            return
+        if getattr(response, "tool_calls", None) or not isinstance(response.content, str) or not response.content:
+            with self.lock:
+                self.stats["not_cacheable"] += 1
+            return
+        vector = embed(key[2])
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = CacheEntry(response.content, vector, latency)
+            self.by_context.setdefault(key[:2], set()).add(key)
+            self.stats["stored"] += 1
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats["evicted"] += 1
+
+    def _live(self, key, touch=True):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.ttl:
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        if touch:
+            self.entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, key):
+        # first turns only, a follow-up is read against earlier messages that are not all in the key
+        if key[1]:
+            return None
+        candidates = self.by_context.get(key[:2])
+        if not candidates:
+            return None
+        vector = embed(key[2])
+        best_key, best_similarity = None, self.threshold
+        for candidate in list(candidates):
+            entry = self._live(candidate, touch=False)
+            if entry is None:
+                continue
+            similarity = cosine(vector, entry.vector)
+            if similarity >= best_similarity:
+                best_key, best_similarity = candidate, similarity
+        return None if best_key is None else self._live(best_key)
+
+    def _remove(self, key):
+        if self.entries.pop(key, None) is not None:
+            keys = self.by_context[key[:2]]
+            keys.discard(key)
+            if not keys:
+                del self.by_context[key[:2]]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_context.clear()
+
+    def report(self):
+        lookups = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return {
+            **self.stats,
+            "saved_seconds": round(self.stats["saved_seconds"], 3),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,154 @@
+"""
+This file contains a small local retrieval index over the LangGraph unit test file. The file is split into one chunk per test function (plus the shared imports and helpers at the top), the chunks are ranked against the user's requirements and latest messages with BM25, and the best ones are packed into a token budget; when nothing matches, the start of the file is packed instead. The purpose of this is to let `draft_answer` and `critique` inline only the relevant parts of the test file instead of the whole thing, which keeps prompts small and time-to-first-token low.
+"""
+
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+DEFAULT_CONTEXT_MODE = "retrieval"
+DEFAULT_CONTEXT_TOKEN_BUDGET = 8000
+DEFAULT_CONTEXT_TOP_K = 12
+# how many of the latest messages are used, together with the requirements, as the retrieval query
+QUERY_MESSAGES = 4
+
+CHARS_PER_TOKEN = 4
+
+_test_start = re.compile(r"^(?:@[^\n]*\n)*(?:async\s+)?def\s+test_\w+", re.MULTILINE)
+_token = re.compile(r"[A-Za-z][a-z]+|[A-Z]+(?![a-z])|\d+")
+_stop_words = frozenset("""
+a an and are as assert at be by def do for from if in is it none not of on or return self the this to true
+false with what how can i you my me we should would want use using make get set
+""".split())
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def tokenize(text):
+    # split snake_case and CamelCase so "add_conditional_edges" matches "conditional edges"
+    return [token for token in (match.lower() for match in _token.findall(text)) if token not in _stop_words]
+
+
+def split_test_file(text):
+    """
+    Split a pytest file into a header (the imports and helpers before the first test) and one chunk per
+    top-level `test_*` function, decorators included. Helpers between tests stay with the test above them.
+    """
+    starts = [match.start() for match in _test_start.finditer(text)]
+    if not starts:
+        return "", [text]
+    tests = [text[start:end].strip("\n") for start, end in zip(starts, starts[1:] + [len(text)])]
+    return text[:starts[0]].strip("\n"), tests
+
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(tokenize(chunk)) for chunk in chunks]
+        self.lengths = [sum(frequencies.values()) for frequencies in self.term_frequencies]
+        # 1 when there are no chunks or none has a token, so length normalization never divides by zero
+        self.average_length = (sum(self.lengths) / len(chunks) if chunks else 0) or 1
+        self.token_counts = [estimate_tokens(chunk) for chunk in chunks]
+
+        document_frequencies = Counter()
+        for frequencies in self.term_frequencies:
+            document_frequencies.update(frequencies.keys())
+        self.idf = {
+            term: math.log(1 + (len(chunks) - count + 0.5) / (count + 0.5))
+            for term, count in document_frequencies.items()
+        }
+
+        # term -> [(chunk index, term frequency)] so scoring only touches chunks that share a query term
+        self.postings = {}
+        for index, frequencies in enumerate(self.term_frequencies):
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, []).append((index, frequency))
+
+    def scores(self, query):
+        scores = [0.0] * len(self.chunks)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for index, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def search(self, query, top_k=DEFAULT_CONTEXT_TOP_K, token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET):
+        """
+        Return the indexes of the best matching chunks, best first, that together fit in `token_budget`.
+        """
+        scores = self.scores(query)
+        ranked = sorted((index for index, score in enumerate(scores) if score > 0), key=lambda index: -scores[index])
+        selected = []
+        used = 0
+        for index in ranked:
+            if len(selected) >= top_k:
+                break
+            if used + self.token_counts[index] > token_budget:
+                continue
+            selected.append(index)
+            used += self.token_counts[index]
+        return selected
+
+    def leading(self, token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET):
+        """
+        Return the indexes of the chunks from the start of the file that fit in `token_budget`, skipping any too large to fit in what is left of it.
+        """
+        selected = []
+        used = 0
+        for index, tokens in enumerate(self.token_counts):
+            if used + tokens > token_budget:
+                continue
+            selected.append(index)
+            used += tokens
+        return selected
+
+
+@lru_cache(maxsize=4)
+def build_index(text):
+    header, tests = split_test_file(text)
+    return header, BM25Index(tests)
+
+
+def _message_text(message):
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+    return content if isinstance(content, str) else ""
+
+
+def build_query(requirements, messages):
+    return "\n".join([requirements or ""] + [_message_text(message) for message in messages[-QUERY_MESSAGES:]])
+
+
+def select_context(file_contents, requirements, messages, config=None):
+    """
+    Pick the part of `file_contents` to inline in a prompt, according to the `context_mode`,
+    `context_token_budget` and `context_top_k` values in the graph config.
+    """
+    configurable = (config or {}).get("configurable", {})
+    mode = configurable.get("context_mode", DEFAULT_CONTEXT_MODE)
+    if mode == "full":
+        return file_contents
+    if mode != "retrieval":
+        raise ValueError(f"Unknown context_mode: {mode}")
+
+    token_budget = configurable.get("context_token_budget", DEFAULT_CONTEXT_TOKEN_BUDGET)
+    top_k = configurable.get("context_top_k", DEFAULT_CONTEXT_TOP_K)
+    header, index = build_index(file_contents)
+    # the imports at the top of the file only earn their place if they are a small part of the budget
+    if estimate_tokens(header) > token_budget // 4:
+        header = ""
+    budget = token_budget - (estimate_tokens(header) if header else 0)
+
+    selected = index.search(build_query(requirements, messages), top_k=top_k, token_budget=budget)
+    if not selected:
+        # nothing matched the query: the file from the top, cut to the budget, rather than no tests at all
+        selected = index.leading(budget)
+    # keep file order so related tests read naturally
+    return "\n\n\n".join(([header] if header else []) + [index.chunks[i] for i in sorted(selected)])
@@ -18,3 +18,12 @@ class GraphConfig(TypedDict):
     gather_model: Literal['openai', 'anthropic']
     draft_model: Literal['openai', 'anthropic']
     critique_model: Literal['openai', 'anthropic']
+    context_mode: Literal['retrieval', 'full']
+    context_token_budget: int
+    context_top_k: int
+    response_cache: bool
+    code_validation: Literal['off', 'static', 'compile']
+    compact_messages: bool
+    thread_max_messages: int
+    draft_candidates: int
+    draft_candidate_models: list[str]
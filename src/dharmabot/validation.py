@@ -0,0 +1,348 @@
+"""
+This file contains the local validation that `check` runs on a drafted code block before it is sent to `critique`. The code is parsed with `ast`, the `StateGraph` (or `MessageGraph`) builders are found, and their `add_node`, `add_edge`, `add_conditional_edges`, entry and finish point calls are collected into the graph they describe. Failures that are certain from the code alone, a syntax error, an edge to a node that was never added, a graph without an entry point or without any path to `END`, are returned as a precise error so the draft goes straight back to `draft_answer` instead of costing a full-context critique call. Anything the code does not pin down (node names built at runtime, conditional edges without a path map) is left to the critique. Optionally the code is also run in a separate, isolated Python process with a timeout and resource limits, and the graphs it builds are compiled, which catches the errors LangGraph itself raises at compile time. Code that critique accepted is remembered by the hash of the requirements it was accepted for together with the hash of its syntax tree, so the same graph drafted again for the same requirements, even with other comments or formatting, is accepted without another critique call; a graph right for one user's requirements is still critiqued against another's.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_CODE_VALIDATION = os.getenv("DHARMABOT_CODE_VALIDATION", "static")
+COMPILE_TIMEOUT = float(os.getenv("DHARMABOT_CODE_VALIDATION_TIMEOUT", "10"))
+COMPILE_MEMORY_BYTES = 1024 * 1024 * 1024
+MAX_ACCEPTED_HASHES = 10_000
+
+GRAPH_CLASSES = {"StateGraph", "MessageGraph", "Graph"}
+START_NAMES = {"START", "__start__"}
+END_NAMES = {"END", "__end__"}
+UNKNOWN = object()
+
+
+class GraphSpec:
+    def __init__(self, name):
+        self.name = name
+        self.nodes = set()
+        # False once a node is added under a name that is only known at runtime
+        self.nodes_known = True
+        self.edges = []
+        self.entry = set()
+        # conditional edges whose targets are not written out in the code
+        self.open_edges = 0
+        self.compiled = False
+
+    def successors(self, node):
+        return {target for source, target in self.edges if source == node}
+
+
+def _literal(node):
+    """
+    The node name an argument stands for: a string, START/END, a function (named after itself), or UNKNOWN.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        if node.value in START_NAMES:
+            return "__start__"
+        if node.value in END_NAMES:
+            return "__end__"
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in START_NAMES:
+            return "__start__"
+        if node.id in END_NAMES:
+            return "__end__"
+    return UNKNOWN
+
+
+def _path_targets(node):
+    # the path map of add_conditional_edges: {"label": "node", ...} or ["node", ...]
+    if isinstance(node, ast.Dict):
+        targets = [_literal(value) for value in node.values]
+    elif isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        targets = [_literal(element) for element in node.elts]
+    else:
+        return None
+    return None if UNKNOWN in targets else targets
+
+
+def _argument(call, position, keyword):
+    if len(call.args) > position:
+        return call.args[position]
+    return next((k.value for k in call.keywords if k.arg == keyword), None)
+
+
+def find_graphs(tree):
+    """
+    A GraphSpec per variable that is assigned a graph builder, with the calls made on it.
+    """
+    functions = {node.name for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    graphs = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            function = node.value.func
+            class_name = function.id if isinstance(function, ast.Name) else getattr(function, "attr", None)
+            if class_name in GRAPH_CLASSES:
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        graphs[target.id] = GraphSpec(target.id)
+
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and isinstance(node.func.value, ast.Name) and node.func.value.id in graphs):
+            continue
+        graph, method = graphs[node.func.value.id], node.func.attr
+        if method == "add_node":
+            first = _argument(node, 0, "node")
+            name = _literal(first)
+            # add_node(function) names the node after the function; other objects name it after themselves
+            if name is UNKNOWN and len(node.args) == 1 and isinstance(first, ast.Name) and first.id in functions:
+                name = first.id
+            if name is UNKNOWN:
+                graph.nodes_known = False
+            else:
+                graph.nodes.add(name)
+        elif method == "add_edge":
+            sources, target = _argument(node, 0, "start_key"), _literal(_argument(node, 1, "end_key"))
+            # add_edge(["a", "b"], "c") waits for all of the sources
+            sources = [_literal(s) for s in sources.elts] if isinstance(sources, (ast.List, ast.Tuple)) else [_literal(sources)]
+            for source in sources:
+                graph.edges.append((source, target))
+        elif method == "add_conditional_edges":
+            source = _literal(_argument(node, 0, "source"))
+            path_map = _argument(node, 2, "path_map")
+            targets = _path_targets(path_map) if path_map is not None else None
+            if targets is None:
+                graph.open_edges += 1
+                if source == "__start__":
+                    # like set_conditional_entry_point without a path map, the graph starts somewhere
+                    graph.entry.add(UNKNOWN)
+            else:
+                graph.edges.extend((source, target) for target in targets)
+        elif method == "set_entry_point":
+            graph.edges.append(("__start__", _literal(_argument(node, 0, "key"))))
+        elif method == "set_conditional_entry_point":
+            path_map = _argument(node, 1, "path_map")
+            targets = _path_targets(path_map) if path_map is not None else None
+            if targets is None:
+                graph.open_edges += 1
+                graph.entry.add(UNKNOWN)
+            else:
+                graph.edges.extend(("__start__", target) for target in targets)
+        elif method == "set_finish_point":
+            graph.edges.append((_literal(_argument(node, 0, "key")), "__end__"))
+        elif method == "compile":
+            graph.compiled = True
+    for graph in graphs.values():
+        graph.entry |= graph.successors("__start__")
+    return list(graphs.values())
+
+
+def _mentions_end(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in END_NAMES:
+            return True
+        if isinstance(node, ast.Constant) and node.value in END_NAMES:
+            return True
+        if isinstance(node, ast.Attribute) and node.attr in END_NAMES | {"set_finish_point"}:
+            return True
+    return False
+
+
+def check_graph(graph, mentions_end):
+    """
+    The first certain problem of one graph, or None.
+    """
+    if graph.nodes_known:
+        for source, target in graph.edges:
+            for name in (source, target):
+                if name is not UNKNOWN and name not in graph.nodes | {"__start__", "__end__"}:
+                    return (f"`{graph.name}` has an edge {'from' if name == source else 'to'} {name!r}, but no node named "
+                            f"{name!r} was added. The nodes are: {', '.join(sorted(graph.nodes)) or 'none'}.")
+    if not graph.entry:
+        return (f"`{graph.name}` has no entry point. Add an edge from START (or call `set_entry_point`) "
+                f"to the node the graph should start at.")
+    if not mentions_end:
+        return f"Nothing in `{graph.name}` leads to END, so the graph can never finish. Add an edge to END."
+    if graph.open_edges or any(UNKNOWN in edge for edge in graph.edges):
+        return None
+    reachable, frontier = set(), ["__start__"]
+    while frontier:
+        node = frontier.pop()
+        for successor in graph.successors(node):
+            if successor not in reachable:
+                reachable.add(successor)
+                frontier.append(successor)
+    if "__end__" not in reachable:
+        return (f"No path in `{graph.name}` leads from START to END; the reachable nodes are "
+                f"{', '.join(sorted(reachable)) or 'none'}. Add an edge to END.")
+    return None
+
+
+def validate_static(code):
+    """
+    A precise error message if the code is certainly wrong, otherwise None.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        line = (e.text or "").strip()
+        return f"The code has a syntax error on line {e.lineno}: {e.msg}" + (f"\n    {line}" if line else "")
+    mentions_end = _mentions_end(tree)
+    # a builder that is never compiled may be a fragment of an explanation rather than a whole graph
+    for graph in find_graphs(tree):
+        if not graph.compiled:
+            continue
+        error = check_graph(graph, mentions_end)
+        if error:
+            return error
+    return None
+
+
+# Runs in the isolated process: executes the draft, compiles every builder it left behind and reports
+# {"error": ..., "certain": ...}. Only errors that come from the graph itself are certain; a missing
+# package, API key or network is a problem of this environment, not of the draft.
+COMPILE_RUNNER = r"""
+import json, sys, traceback
+
+def report(error=None, certain=False):
+    sys.stdout = sys.__stdout__
+    print(json.dumps({"error": error, "certain": certain}))
+    sys.exit(0)
+
+code = sys.stdin.read()
+sys.stdout = open("/dev/null", "w") if sys.platform != "win32" else sys.stdout
+namespace = {"__name__": "__validation__"}
+
+def from_langgraph(error):
+    frames = traceback.extract_tb(error.__traceback__)
+    return bool(frames) and "langgraph" in frames[-1].filename
+
+try:
+    exec(compile(code, "<draft>", "exec"), namespace)
+except (NameError, AttributeError) as e:
+    report(f"{type(e).__name__}: {e}", certain=True)
+except ImportError as e:
+    report(f"{type(e).__name__}: {e}", certain=not isinstance(e, ModuleNotFoundError) and "langgraph" in str(e))
+except Exception as e:
+    report(f"{type(e).__name__}: {e}", certain=isinstance(e, ValueError) and from_langgraph(e))
+
+try:
+    from langgraph.graph.state import StateGraph
+    from langgraph.graph.graph import Graph
+except ImportError:
+    report()
+for value in list(namespace.values()):
+    if isinstance(value, (Graph, StateGraph)):
+        try:
+            value.compile()
+        except Exception as e:
+            report(f"{type(e).__name__}: {e}", certain=from_langgraph(e))
+report()
+"""
+
+
+def _limit_resources():
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (int(COMPILE_TIMEOUT) + 1, int(COMPILE_TIMEOUT) + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (COMPILE_MEMORY_BYTES, COMPILE_MEMORY_BYTES))
+
+
+def validate_compile(code, timeout=COMPILE_TIMEOUT):
+    """
+    Run the code and compile its graphs in a separate Python process (isolated mode, no environment
+    variables, so no API keys, an empty working directory, CPU and memory limits). This is a guard against
+    accidents, not a sandbox for hostile code. Returns an error message if the draft is certainly wrong.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            result = subprocess.run(
+                [sys.executable, "-I", "-c", COMPILE_RUNNER], input=code, capture_output=True, text=True,
+                timeout=timeout, cwd=directory, env={"PATH": os.environ.get("PATH", "")},
+                preexec_fn=_limit_resources if os.name == "posix" else None,
+            )
+            outcome = json.loads(result.stdout.strip().splitlines()[-1])
+        except (subprocess.TimeoutExpired, ValueError, IndexError) as e:
+            # a timeout or a crash says nothing certain about the draft
+            print(f"Could not compile the draft: {e}")
+            return None
+    if outcome["error"] and outcome["certain"]:
+        return f"Running the code and compiling the graph failed with {outcome['error']}"
+    return None
+
+
+def code_hash(code):
+    """
+    A hash of the code's syntax tree, so comments and formatting do not matter. None if it does not parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    return hashlib.sha256(ast.dump(tree).encode("utf-8")).hexdigest()
+
+
+class AcceptedCode:
+    def __init__(self, max_entries=MAX_ACCEPTED_HASHES):
+        self.max_entries = max_entries
+        # (requirements hash, code hash) -> True, least recently used first
+        self.hashes = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(code, requirements):
+        digest = code_hash(code)
+        if digest is None:
+            return None
+        return hashlib.sha256((requirements or "").encode("utf-8")).hexdigest(), digest
+
+    def add(self, code, requirements):
+        """
+        Remember that critique accepted `code` for `requirements`.
+        """
+        key = self.key(code, requirements)
+        if key is None:
+            return
+        with self.lock:
+            self.hashes[key] = True
+            self.hashes.move_to_end(key)
+            if len(self.hashes) > self.max_entries:
+                self.hashes.popitem(last=False)
+
+    def accepts(self, code, requirements):
+        """
+        Whether critique already accepted `code`, up to comments and formatting, for the same requirements.
+        """
+        key = self.key(code, requirements)
+        with self.lock:
+            if key is None or key not in self.hashes:
+                return False
+            self.hashes.move_to_end(key)
+            return True
+
+
+accepted_code = AcceptedCode()
+validation_stats = {"validated": 0, "rejected_static": 0, "rejected_compile": 0, "accepted_by_hash": 0}
+
+
+def validate(code, mode=DEFAULT_CODE_VALIDATION):
+    """
+    An error message for a draft that is certainly wrong, or None. `mode` is "off", "static" or "compile".
+    """
+    if mode == "off":
+        return None
+    if mode not in ("static", "compile"):
+        raise ValueError(f"Unknown code_validation: {mode}")
+    validation_stats["validated"] += 1
+    error = validate_static(code)
+    if error:
+        validation_stats["rejected_static"] += 1
+        return error
+    if mode == "compile":
+        error = validate_compile(code)
+        if error:
+            validation_stats["rejected_compile"] += 1
+            return error
+    return None
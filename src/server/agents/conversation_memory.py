@@ -0,0 +1,182 @@
+"""
+This file contains `ConversationMemory`, which decides what part of a conversation `groq_basic` sends to the LLM. The newest messages are kept verbatim as long as they fit a token budget; older ones are folded into a rolling summary of the conversation so far. Token counts are estimated once per message and cached by message id, and the summary is updated incrementally: only the messages that left the window since the last update are summarized, together with the previous summary, in a background LLM call (a background thread on the blocking `groq_basic` path, which has no event loop). Until that call finishes the messages it covers are still sent verbatim, so nothing is lost and no turn waits for a summary. When summaries keep failing, they are retried with an exponential backoff, and the messages waiting for one are sent verbatim only up to a hard limit (`MEMORY_MAX_UNSUMMARIZED_TOKENS`), past which the oldest of them are dropped, so the prompt stays bounded even with the summary model down. The purpose of this file is to keep the latency and input cost of a DharmaBot UI reply flat as a conversation grows, instead of growing with its length until the context overflows.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.schema import HumanMessage, SystemMessage
+
+from dharmabot.retrieval import estimate_tokens
+
+MEMORY_TOKEN_BUDGET = int(os.getenv("DHARMABOT_MEMORY_TOKEN_BUDGET", "3000"))
+# messages that left the window are summarized once they add up to this many tokens
+MEMORY_SUMMARY_BATCH_TOKENS = int(os.getenv("DHARMABOT_MEMORY_SUMMARY_BATCH_TOKENS", "500"))
+# messages waiting for a summary that are still sent verbatim, the oldest beyond it are dropped
+MEMORY_MAX_UNSUMMARIZED_TOKENS = int(os.getenv("DHARMABOT_MEMORY_MAX_UNSUMMARIZED_TOKENS", str(MEMORY_TOKEN_BUDGET)))
+# seconds before a failed summary is tried again, doubling with every failure in a row up to the maximum
+MEMORY_SUMMARY_RETRY_DELAY = 1.0
+MEMORY_SUMMARY_MAX_RETRY_DELAY = 300.0
+MEMORY_MAX_CONVERSATIONS = 1000
+MEMORY_MAX_CACHED_COUNTS = 100_000
+# role and formatting tokens each message adds on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an AI assistant. \
+You will be given the current summary and the messages that came after it. \
+Return an updated summary that keeps the facts, decisions, open questions and user preferences that could matter later, in at most 200 words. \
+Return only the summary."""
+
+
+class MemoryState:
+    def __init__(self):
+        self.summary = ""
+        self.summary_tokens = 0
+        # id of the newest message folded into the summary
+        self.summarized_through = None
+        # the task or thread updating the summary
+        self.folding = None
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class ConversationMemory:
+    def __init__(self, llm, token_budget=MEMORY_TOKEN_BUDGET, summary_batch_tokens=MEMORY_SUMMARY_BATCH_TOKENS,
+                 max_unsummarized_tokens=MEMORY_MAX_UNSUMMARIZED_TOKENS):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.summary_batch_tokens = summary_batch_tokens
+        self.max_unsummarized_tokens = max_unsummarized_tokens
+        self.conversations = OrderedDict()
+        # message id -> estimated tokens, least recently used first
+        self.token_counts = OrderedDict()
+        self.stats = {"counted": 0, "count_hits": 0, "summaries": 0, "summary_errors": 0,
+                      "dropped_messages": 0}
+
+    def count_tokens(self, message):
+        key = message.get("id") or message["content"]
+        tokens = self.token_counts.get(key)
+        if tokens is None:
+            tokens = estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            self.token_counts[key] = tokens
+            self.stats["counted"] += 1
+            if len(self.token_counts) > MEMORY_MAX_CACHED_COUNTS:
+                self.token_counts.popitem(last=False)
+        else:
+            self.token_counts.move_to_end(key)
+            self.stats["count_hits"] += 1
+        return tokens
+
+    def _state(self, conversation_id):
+        state = self.conversations.get(conversation_id)
+        if state is None:
+            state = self.conversations[conversation_id] = MemoryState()
+            if len(self.conversations) > MEMORY_MAX_CONVERSATIONS:
+                self.conversations.popitem(last=False)
+        self.conversations.move_to_end(conversation_id)
+        return state
+
+    def select(self, conversation_id, conversation):
+        """
+        (summary, messages to send verbatim) for a conversation, oldest first. Starts folding the
+        messages that no longer fit into the summary when enough of them have piled up.
+        """
+        state = self._state(conversation_id)
+        budget = self.token_budget - state.summary_tokens
+        start = len(conversation)
+        used = 0
+        while start > 0:
+            tokens = self.count_tokens(conversation[start - 1])
+            # the newest message is always sent, whatever its size
+            if used + tokens > budget and start < len(conversation):
+                break
+            used += tokens
+            start -= 1
+
+        # messages that left the window but are not in the summary yet; when the summarized one is no longer
+        # in the conversation it is older than all of it, so none of these are summarized
+        first_unsummarized = 0
+        if state.summarized_through is not None:
+            for index in range(len(conversation) - 1, -1, -1):
+                if conversation[index].get("id") == state.summarized_through:
+                    first_unsummarized = index + 1
+                    break
+        unsummarized = conversation[first_unsummarized:start] if first_unsummarized < start else []
+
+        # while no summary can be made the messages waiting for one would grow with the conversation
+        pending_tokens = sum(self.count_tokens(message) for message in unsummarized)
+        dropped = 0
+        while dropped < len(unsummarized) and pending_tokens > self.max_unsummarized_tokens:
+            pending_tokens -= self.count_tokens(unsummarized[dropped])
+            dropped += 1
+        if dropped:
+            unsummarized = unsummarized[dropped:]
+            # counted on every turn they are left out of, until a summary covers them
+            self.stats["dropped_messages"] += dropped
+
+        if unsummarized and state.folding is None and time.monotonic() >= state.retry_at:
+            if pending_tokens >= self.summary_batch_tokens:
+                self._fold_in_background(state, unsummarized)
+        return state.summary, unsummarized + conversation[start:]
+
+    def _fold_in_background(self, state, messages):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # the blocking groq_basic path has no loop to run the summary on, it gets a thread of its own
+            state.folding = threading.Thread(target=self.fold_sync, args=(state, messages), daemon=True)
+            state.folding.start()
+            return
+        state.folding = loop.create_task(self.fold(state, messages))
+
+    def _summary_request(self, state, messages):
+        transcript = "\n".join(
+            f"{'Assistant' if message['sender_type'] == 'Agent' else 'User'}: {message['content']}"
+            for message in messages
+        )
+        return [
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(content=f"Current summary:\n{state.summary or '(none)'}\n\nNew messages:\n{transcript}"),
+        ]
+
+    def _folded(self, state, messages, response):
+        state.summary = response.content
+        state.summary_tokens = estimate_tokens(state.summary)
+        state.summarized_through = messages[-1].get("id")
+        state.failures = 0
+        state.retry_at = 0.0
+        self.stats["summaries"] += 1
+
+    def _fold_failed(self, state, error):
+        # the messages stay verbatim, up to the limit, and are folded again once the backoff is over
+        print(f"Error summarizing conversation: {error}")
+        self.stats["summary_errors"] += 1
+        state.failures += 1
+        delay = min(MEMORY_SUMMARY_RETRY_DELAY * 2 ** (state.failures - 1), MEMORY_SUMMARY_MAX_RETRY_DELAY)
+        state.retry_at = time.monotonic() + delay
+
+    async def fold(self, state, messages):
+        try:
+            self._folded(state, messages, await self.llm.ainvoke(self._summary_request(state, messages)))
+        except Exception as e:
+            self._fold_failed(state, e)
+        finally:
+            state.folding = None
+
+    def fold_sync(self, state, messages):
+        try:
+            self._folded(state, messages, self.llm.invoke(self._summary_request(state, messages)))
+        except Exception as e:
+            self._fold_failed(state, e)
+        finally:
+            state.folding = None
+
+    def summary_message(self, summary):
+        return SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+
+    def report(self):
+        return {**self.stats, "conversations": len(self.conversations), "token_budget": self.token_budget,
+                "max_unsummarized_tokens": self.max_unsummarized_tokens}
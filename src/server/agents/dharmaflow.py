@@ -0,0 +1,57 @@
+"""
+This file contains `dharmaflow_stream`, which runs a conversation through the `dharmaflow` LangGraph agent from `dharmabot.agent` and turns its event stream into reply deltas. Tokens generated by `gather_requirements` and `draft_answer` are forwarded as they arrive, and a reply `gather_requirements` serves from its response cache, like the draft that won when `speculate` drafts several candidates at once, is forwarded whole; when a draft is sent back for another attempt by `check` or `critique`, a reset is emitted so the client drops the rejected text. The reply is final once the graph ends, i.e. once critique accepts the draft. Given a thread id (the server uses the conversation id), the conversation runs on the checkpointed graph, so only the new message is sent and the graph keeps its own state, requirements included, between turns.
+"""
+
+from dharmabot.agent import graph, persistent_graph
+from dharmabot.instrumentation import instrument
+from dharmabot.nodes.check import chunk_text
+from dharmabot.nodes.gather_requirements import CACHED_RESPONSE_EVENT
+from dharmabot.nodes.speculate import SPECULATIVE_DRAFT_EVENT
+
+# nodes whose model output is shown to the user while it is generated
+STREAMED_NODES = {"gather_requirements", "draft_answer"}
+# events carrying a whole reply, sent instead of the model output of their node
+WHOLE_REPLY_EVENTS = {CACHED_RESPONSE_EVENT, SPECULATIVE_DRAFT_EVENT}
+
+
+def to_graph_messages(conversation):
+    return [
+        {"role": "assistant" if msg["sender_type"] == "Agent" else "user", "content": msg["content"]}
+        for msg in conversation
+    ]
+
+
+async def dharmaflow_stream(conversation, config=None, thread_id=None):
+    """
+    With a `thread_id` the graph resumes that thread from its checkpoint and only the newest message is sent;
+    the whole conversation is sent only to start a thread.
+    """
+    shown_text = False
+    runner = graph
+    # per node timings and tokens, see dharmabot.instrumentation
+    config = instrument(config)
+    if thread_id is not None:
+        runner = persistent_graph
+        config = {**config, "configurable": {**config.get("configurable", {}), "thread_id": thread_id}}
+        if (await persistent_graph.aget_state(config)).values:
+            conversation = conversation[-1:]
+    async for event in runner.astream_events({"messages": to_graph_messages(conversation)}, config, version="v2"):
+        node = event.get("metadata", {}).get("langgraph_node")
+        if event["event"] == "on_custom_event" and event["name"] in WHOLE_REPLY_EVENTS:
+            # a cached reply, or the draft that won in `speculate`, arrives whole
+            if shown_text:
+                yield "reset", None
+            shown_text = True
+            yield "delta", event["data"]["content"]
+            continue
+        if node not in STREAMED_NODES:
+            continue
+        if event["event"] == "on_chat_model_start" and shown_text:
+            # a new draft replaces the one that was just rejected
+            shown_text = False
+            yield "reset", None
+        elif event["event"] == "on_chat_model_stream":
+            content = chunk_text(event["data"]["chunk"].content)
+            if content:
+                shown_text = True
+                yield "delta", content
@@ -1,12 +1,16 @@
 """
-This file contains a function `groq_basic` that formats a conversation for the Groq language model and generates a response. It allows for routing conversations to different agents and processing messages in various ways.
+This file contains a function `groq_basic` that formats a conversation for the Groq language model and generates a response, its async counterpart `agroq_basic`, and `groq_basic_stream`, which yields the same response token by token as it is generated. When given a `ConversationMemory`, only the recent messages that fit its token budget are sent verbatim, preceded by a summary of the older ones. When given a `ModelRouter`, the call goes through it, so it is sent to the fastest healthy provider and hedged on another one, instead of always to Groq. It allows for routing conversations to different agents and processing messages in various ways.
 """
 
 from langchain.schema import HumanMessage, SystemMessage
 
-def groq_basic(conversation, system_message, llm_openai, llm_groq):
+def format_conversation(conversation, system_message, memory=None, conversation_id="default"):
     # Convert conversation to a format suitable for the LLM
     messages = [system_message]  # This is already a SystemMessage object
+    if memory is not None:
+        summary, conversation = memory.select(conversation_id, conversation)
+        if summary:
+            messages.append(memory.summary_message(summary))
     for msg in conversation:
         role = "assistant" if msg["sender_type"] == "Agent" else "user"
         messages.append(HumanMessage(content=msg["content"]) if role == "user" else SystemMessage(content=msg["content"]))
@@ -14,9 +18,13 @@ def groq_basic(conversation, system_message, llm_openai, llm_groq):
     print("Debug: Formatted messages for LLM:")
     for msg in messages:
         print(f"  Role: {msg.__class__.__name__}, Content: {msg.content[:50]}...")
+    return messages
+
+def groq_basic(conversation, system_message, llm_openai, llm_groq, memory=None, conversation_id="default", router=None):
+    messages = format_conversation(conversation, system_message, memory, conversation_id)
     
     # Choose which LLM to use (you can implement logic to switch between them)
-    llm = llm_groq  # or llm_openai
+    llm = router or llm_groq  # or llm_openai
     print(f"Debug: Using LLM: {type(llm).__name__}")
     
     try:
@@ -25,4 +33,29 @@ def groq_basic(conversation, system_message, llm_openai, llm_groq):
         return response.content
     except Exception as e:
         print(f"Debug: Error invoking LLM: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+async def agroq_basic(conversation, system_message, llm_openai, llm_groq, memory=None, conversation_id="default", router=None):
+    messages = format_conversation(conversation, system_message, memory, conversation_id)
+    llm = router or llm_groq  # or llm_openai
+    print(f"Debug: Using LLM: {type(llm).__name__}")
+
+    try:
+        response = await llm.ainvoke(messages)
+        print(f"Debug: LLM response received. Length: {len(response.content)}")
+        return response.content
+    except Exception as e:
+        print(f"Debug: Error invoking LLM: {str(e)}")
+        raise
+
+async def groq_basic_stream(conversation, system_message, llm_openai, llm_groq, memory=None, conversation_id="default", router=None):
+    messages = format_conversation(conversation, system_message, memory, conversation_id)
+    llm = router or llm_groq  # or llm_openai
+    print(f"Debug: Streaming from LLM: {type(llm).__name__}")
+
+    try:
+        async for chunk in llm.astream(messages):
+            yield "delta", chunk.content
+    except Exception as e:
+        print(f"Debug: Error streaming from LLM: {str(e)}")
+        raise
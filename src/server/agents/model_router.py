@@ -0,0 +1,214 @@
+"""
+This file contains `ModelRouter`, which spreads the LLM calls of `groq_basic` over several chat models (Groq and OpenAI in DharmaBot UI) instead of always using one. For every provider it keeps a rolling window of latencies and outcomes, separately for whole replies and for the time to the first streamed token, and sends each call to the healthy provider with the lowest median latency; a provider whose recent error rate is too high is only used when no other one is left. With hedging on, when the chosen provider has not answered (or started streaming) after its own p95 latency, the same request is also sent to the next provider, the first answer wins and the other call is cancelled. A cancelled call still counts as a latency sample of at least the time it ran, so a provider that keeps losing the race also loses the routing. The purpose of this file is to keep a tail latency spike or an outage of one provider from reaching the users, for the price of a few percent of duplicate calls.
+
+The router has the `invoke`, `ainvoke` and `astream` methods of a chat model, so it can be passed wherever a model is.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+
+ROUTER_ENABLED = os.getenv("DHARMABOT_LLM_ROUTING", "1") != "0"
+ROUTER_HEDGE = os.getenv("DHARMABOT_LLM_HEDGE", "1") != "0"
+# per-request timeout of the chat model clients, which used to wait forever
+LLM_TIMEOUT = float(os.getenv("DHARMABOT_LLM_TIMEOUT", "60"))
+ROUTER_WINDOW = 200
+# outcomes older than this no longer count towards the error rate, so a provider that failed gets another chance
+ROUTER_ERROR_WINDOW_SECONDS = 60.0
+ROUTER_MAX_ERROR_RATE = 0.2
+# below this many samples a provider keeps its configured position and the default hedge delay is used
+ROUTER_MIN_SAMPLES = 10
+ROUTER_DEFAULT_HEDGE_DELAY = 2.0
+ROUTER_MIN_HEDGE_DELAY = 0.05
+
+
+class ProviderStats:
+    def __init__(self, window=ROUTER_WINDOW, error_window_seconds=ROUTER_ERROR_WINDOW_SECONDS):
+        self.error_window_seconds = error_window_seconds
+        self.latencies = deque(maxlen=window)
+        # (time, succeeded)
+        self.outcomes = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, latency, succeeded=True):
+        self.latencies.append(latency)
+        self.outcomes.append((time.monotonic(), succeeded))
+        self.calls += 1
+        self.errors += not succeeded
+
+    def record_cancelled(self, elapsed):
+        # the call would have taken at least this long; it is neither a success nor an error
+        self.latencies.append(elapsed)
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def error_rate(self):
+        horizon = time.monotonic() - self.error_window_seconds
+        recent = [succeeded for at, succeeded in self.outcomes if at >= horizon]
+        if not recent:
+            return 0.0
+        return 1 - sum(recent) / len(recent)
+
+    def report(self):
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 3),
+            "p50_ms": None if p50 is None else round(p50 * 1000, 1),
+            "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+        }
+
+
+class ModelRouter:
+    def __init__(self, providers, hedge=ROUTER_HEDGE, error_window_seconds=ROUTER_ERROR_WINDOW_SECONDS):
+        """
+        `providers` maps a name to a chat model, in order of preference while there are too few samples to rank them.
+        """
+        self.providers = dict(providers)
+        self.hedge = hedge
+        self.stats = {
+            kind: {name: ProviderStats(error_window_seconds=error_window_seconds) for name in self.providers}
+            for kind in ("invoke", "stream")
+        }
+        self.hedges = {"sent": 0, "won": 0}
+
+    def ranked(self, kind="invoke"):
+        """
+        Provider names, best first: healthy ones by median latency, then the ones with a high error rate.
+        """
+        stats = self.stats[kind]
+        order = list(self.providers)
+
+        def key(name):
+            provider_stats = stats[name]
+            unhealthy = provider_stats.error_rate() > ROUTER_MAX_ERROR_RATE
+            if len(provider_stats.latencies) < ROUTER_MIN_SAMPLES:
+                return (unhealthy, 0, order.index(name))
+            return (unhealthy, 1, provider_stats.percentile(0.5))
+        # unmeasured providers keep their configured order ahead of measured ones, so each gets its first samples
+        return sorted(order, key=key)
+
+    def hedge_delay(self, name, kind="invoke"):
+        stats = self.stats[kind][name]
+        if len(stats.latencies) < ROUTER_MIN_SAMPLES:
+            return ROUTER_DEFAULT_HEDGE_DELAY
+        return max(ROUTER_MIN_HEDGE_DELAY, stats.percentile(0.95))
+
+    def invoke(self, messages):
+        # the blocking path cannot race two calls, it only falls back to the next provider on an error
+        names = self.ranked()
+        for position, name in enumerate(names):
+            start = time.perf_counter()
+            try:
+                response = self.providers[name].invoke(messages)
+            except Exception as e:
+                self.stats["invoke"][name].record(time.perf_counter() - start, succeeded=False)
+                print(f"Debug: {name} failed: {e}")
+                if position == len(names) - 1:
+                    raise
+                continue
+            self.stats["invoke"][name].record(time.perf_counter() - start)
+            return response
+
+    async def ainvoke(self, messages):
+        return await self._race("invoke", lambda llm: llm.ainvoke(messages))
+
+    async def astream(self, messages):
+        iterator, first = await self._race(
+            "stream", lambda llm: _first_chunk(llm.astream(messages)), discard=lambda result: result[0].aclose())
+        if first is None:
+            return
+        try:
+            yield first
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            await iterator.aclose()
+
+    async def _race(self, kind, call, discard=None):
+        """
+        Run `call` on the best provider, hedging on the next one when it is slow, and return the first result.
+        Falls back to the remaining providers when a call fails. `discard` cleans up the result of a call that
+        finished but lost.
+        """
+        stats = self.stats[kind]
+        waiting = self.ranked(kind)
+        first = waiting[0]
+        running = {}
+
+        def start(name):
+            task = asyncio.ensure_future(call(self.providers[name]))
+            running[task] = (name, time.perf_counter())
+
+        start(waiting.pop(0))
+        last_error = None
+        try:
+            while running:
+                timeout = None
+                if self.hedge and waiting and len(running) == 1:
+                    (name, started), = running.values()
+                    timeout = max(0.0, self.hedge_delay(name, kind) - (time.perf_counter() - started))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedges["sent"] += 1
+                    start(waiting.pop(0))
+                    continue
+                for task in done:
+                    name, started = running[task]
+                    if task.exception() is None:
+                        break
+                    del running[task]
+                    stats[name].record(time.perf_counter() - started, succeeded=False)
+                    last_error = task.exception()
+                    print(f"Debug: {name} failed: {last_error}")
+                else:
+                    if not running and waiting:
+                        start(waiting.pop(0))
+                    continue
+                del running[task]
+                stats[name].record(time.perf_counter() - started)
+                if name != first:
+                    self.hedges["won"] += 1
+                return task.result()
+            raise last_error
+        finally:
+            for task, (name, started) in running.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    # finished in the same moment as the winner
+                    stats[name].record(time.perf_counter() - started)
+                    if discard is not None:
+                        asyncio.ensure_future(discard(task.result()))
+                else:
+                    task.cancel()
+                    stats[name].record_cancelled(time.perf_counter() - started)
+
+    def report(self):
+        return {
+            "order": self.ranked(),
+            "hedge": self.hedge,
+            "hedges": dict(self.hedges),
+            "providers": {
+                kind: {name: provider_stats.report() for name, provider_stats in stats.items()}
+                for kind, stats in self.stats.items()
+            },
+        }
+
+
+async def _first_chunk(iterator):
+    """
+    (iterator, its first chunk or None), so the time to the first token can be raced like a whole reply.
+    """
+    try:
+        return iterator, await iterator.__anext__()
+    except StopAsyncIteration:
+        return iterator, None
+    except BaseException:
+        await iterator.aclose()
+        raise
@@ -0,0 +1,236 @@
+"""
+This Python file defines `AsyncNeo4jDatabase`, the asyncio counterpart of `Neo4jDatabase`. It is built on the neo4j async driver with an explicitly sized connection pool, and every query runs as a managed read or write transaction, which the driver retries on transient errors such as leader switches or dropped connections. Its methods mirror `Neo4jDatabase`, so the WebSocket handlers of DharmaBot UI can await database round trips instead of blocking the event loop on them.
+"""
+
+import os
+
+from neo4j import AsyncGraphDatabase
+
+from storage import MessageStore
+
+MAX_CONNECTION_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+CONNECTION_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))
+MAX_TRANSACTION_RETRY_TIME = float(os.getenv("NEO4J_MAX_RETRY_TIME", "15"))
+
+GET_MESSAGES_QUERY = """
+    MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
+    RETURN m.id AS id, m.content AS content, m.timestamp AS timestamp,
+           labels(sender) AS sender_labels, sender.id AS sender_id
+    ORDER BY m.timestamp
+"""
+
+# (timestamp, id) is the cursor, so messages written in the same instant are neither skipped nor repeated
+GET_MESSAGES_AFTER_QUERY = """
+    MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
+    WHERE $after_timestamp IS NULL
+       OR m.timestamp > datetime($after_timestamp)
+       OR (m.timestamp = datetime($after_timestamp) AND m.id > $after_id)
+    RETURN m.id AS id, m.content AS content, m.timestamp AS timestamp,
+           labels(sender) AS sender_labels, sender.id AS sender_id
+    ORDER BY m.timestamp, m.id
+    LIMIT $limit
+"""
+
+GET_RECENT_MESSAGES_QUERY = """
+    MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
+    RETURN m.id AS id, m.content AS content, m.timestamp AS timestamp,
+           labels(sender) AS sender_labels, sender.id AS sender_id
+    ORDER BY m.timestamp DESC, m.id DESC
+    LIMIT $limit
+"""
+
+ADD_MESSAGE_QUERY = """
+    MERGE (c:Conversation {id: $conversation_id})
+    WITH c
+    MATCH (sender:User {id: 'test_user'})
+    WITH c, sender, CASE WHEN $sender_type = 'User' THEN sender ELSE null END as user_sender
+    OPTIONAL MATCH (agent:Agent {id: 'test_agent'})
+    WITH c, CASE WHEN $sender_type = 'User' THEN user_sender ELSE agent END as actual_sender
+    CREATE (m:Message {id: randomUUID(), content: $content, timestamp: datetime()})
+    CREATE (c)-[:HAS_MESSAGE]->(m)
+    CREATE (actual_sender)-[:SENT]->(m)
+    RETURN m
+"""
+
+# The batch form of ADD_MESSAGE_QUERY, ids and timestamps are chosen by the caller; UNWIND keeps the list order
+ADD_MESSAGES_QUERY = """
+    UNWIND $messages AS row
+    MERGE (c:Conversation {id: row.conversation_id})
+    WITH c, row
+    MATCH (user:User {id: 'test_user'})
+    OPTIONAL MATCH (agent:Agent {id: 'test_agent'})
+    WITH c, row, CASE WHEN row.sender_type = 'User' THEN user ELSE agent END AS actual_sender
+    CREATE (m:Message {id: row.id, content: row.content, timestamp: datetime(row.timestamp)})
+    CREATE (c)-[:HAS_MESSAGE]->(m)
+    CREATE (actual_sender)-[:SENT]->(m)
+"""
+
+CONVERSATION_RECORDS_QUERY = """
+    MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
+    RETURN c, m, sender
+"""
+
+# One row per conversation: only the fields the graph shows, with messages and senders collected server-side
+CONVERSATION_GRAPH_QUERY = """
+    MATCH (c:Conversation {id: $conversation_id})
+    WITH c, COUNT { (c)-[:HAS_MESSAGE]->() } AS total_messages
+    MATCH (c)-[:HAS_MESSAGE]->(m:Message)
+    WITH c, total_messages, m ORDER BY m.timestamp DESC, m.id DESC SKIP $skip LIMIT $limit
+    MATCH (m)<-[:SENT]-(sender)
+    WITH c, total_messages, m, sender ORDER BY m.timestamp, m.id
+    RETURN c.id AS conversation_id, total_messages,
+           collect([m.id, left(m.content, 20), sender.id]) AS messages,
+           collect(DISTINCT [sender.id, labels(sender)[0]]) AS senders,
+           last(collect(m.timestamp)) AS newest_timestamp, last(collect(m.id)) AS newest_id
+"""
+
+# LIMIT needs an integer, this stands for "no limit"
+NO_LIMIT = 2 ** 63 - 1
+
+
+def _message_from_record(record):
+    return {
+        "id": record["id"],
+        "content": record["content"],
+        "timestamp": record["timestamp"].isoformat(),
+        "sender_type": record["sender_labels"][0],
+        "sender_id": record["sender_id"]
+    }
+
+
+async def _fetch_all(tx, query, parameters):
+    result = await tx.run(query, parameters)
+    return [record async for record in result]
+
+
+async def _fetch_single(tx, query, parameters):
+    result = await tx.run(query, parameters)
+    return await result.single()
+
+
+class AsyncNeo4jDatabase(MessageStore):
+    def __init__(self, uri, user, password, max_connection_pool_size=MAX_CONNECTION_POOL_SIZE,
+                 connection_acquisition_timeout=CONNECTION_ACQUISITION_TIMEOUT,
+                 max_transaction_retry_time=MAX_TRANSACTION_RETRY_TIME):
+        """
+        Initialize the AsyncNeo4jDatabase instance. The driver (and its pool) is shared by every caller.
+        """
+        self.driver = AsyncGraphDatabase.driver(
+            uri,
+            auth=(user, password),
+            max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout,
+            max_transaction_retry_time=max_transaction_retry_time,
+        )
+
+    async def close(self):
+        """
+        Close the connection pool.
+        """
+        await self.driver.close()
+
+    async def test_connection(self):
+        await self.driver.verify_connectivity()
+        print("Successfully connected to Neo4j")
+
+    async def read(self, query, parameters=None):
+        """
+        Run a read query as a managed transaction (retried on transient errors) and return all records.
+        """
+        async with self.driver.session(database="neo4j") as session:
+            return await session.execute_read(_fetch_all, query, parameters or {})
+
+    async def write(self, query, parameters=None):
+        """
+        Run a write query as a managed transaction (retried on transient errors) and return all records.
+        """
+        async with self.driver.session(database="neo4j") as session:
+            return await session.execute_write(_fetch_all, query, parameters or {})
+
+    async def get_messages(self, conversation_id='default'):
+        """
+        Retrieve all messages attached to a conversation (the default one unless specified).
+        """
+        records = await self.read(GET_MESSAGES_QUERY, {"conversation_id": conversation_id})
+        return [_message_from_record(record) for record in records]
+
+    async def get_messages_after(self, conversation_id='default', after_timestamp=None, after_id='', limit=1000):
+        """
+        Retrieve up to `limit` messages that come after the (timestamp, id) cursor, oldest first.
+        Without a cursor this starts at the beginning of the conversation.
+        """
+        records = await self.read(GET_MESSAGES_AFTER_QUERY, {
+            "conversation_id": conversation_id, "after_timestamp": after_timestamp, "after_id": after_id, "limit": limit,
+        })
+        return [_message_from_record(record) for record in records]
+
+    async def get_recent_messages(self, conversation_id='default', limit=100):
+        """
+        Retrieve the last `limit` messages of a conversation, oldest first.
+        """
+        records = await self.read(GET_RECENT_MESSAGES_QUERY, {"conversation_id": conversation_id, "limit": limit})
+        return [_message_from_record(record) for record in reversed(records)]
+
+    async def add_message(self, content, sender_type, conversation_id='default'):
+        """
+        Add a new message to a conversation, creating the conversation if needed.
+        """
+        async with self.driver.session(database="neo4j") as session:
+            record = await session.execute_write(_fetch_single, ADD_MESSAGE_QUERY, {
+                "content": content, "sender_type": sender_type, "conversation_id": conversation_id,
+            })
+        message = record['m']
+        return {
+            'id': message['id'],
+            'content': message['content'],
+            'timestamp': message['timestamp'].isoformat(),
+            'sender_type': sender_type
+        }
+
+    async def add_messages(self, messages):
+        """
+        Store many messages in one transaction. Each is a dict with id, conversation_id, content,
+        sender_type and an ISO timestamp, as queued by the WriteBehindDatabase.
+        """
+        await self.write(ADD_MESSAGES_QUERY, {"messages": messages})
+
+    async def get_conversation_records(self, conversation_id='default'):
+        """
+        Rows of whole (c, m, sender) nodes for every message in a conversation. The GraphHandler uses the
+        aggregated `get_conversation_graph_data` instead.
+        """
+        return await self.read(CONVERSATION_RECORDS_QUERY, {"conversation_id": conversation_id})
+
+    async def get_conversation_graph_data(self, conversation_id='default', limit=None, skip=0):
+        """
+        The newest `limit` messages of a conversation (after skipping the `skip` newest), oldest first, as
+        [id, first 20 characters, sender id] triples, with the distinct [sender id, label] pairs. None if it has no messages.
+        """
+        records = await self.read(CONVERSATION_GRAPH_QUERY, {
+            "conversation_id": conversation_id, "skip": skip, "limit": NO_LIMIT if limit is None else limit,
+        })
+        if not records:
+            return None
+        record = records[0]
+        return {
+            "conversation_id": record["conversation_id"],
+            "total_messages": record["total_messages"],
+            "messages": record["messages"],
+            "senders": record["senders"],
+            "newest": (record["newest_timestamp"].isoformat(), record["newest_id"]),
+        }
+
+    async def explain(self, query, parameters=None):
+        """
+        The plan Neo4j would use for a query, without running it, as the nested dict of `ResultSummary.plan`.
+        """
+        async with self.driver.session(database="neo4j") as session:
+            result = await session.run(f"EXPLAIN {query}", parameters or {})
+            summary = await result.consume()
+        return summary.plan
+
+    async def run_query(self, query, parameters=None):
+        """
+        Run a custom query. It may write, so it runs as a write transaction.
+        """
+        return await self.write(query, parameters)
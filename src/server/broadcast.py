@@ -0,0 +1,209 @@
+"""
+This file contains the `BroadcastHub`, which delivers the chat and graph updates of a conversation to every WebSocket client subscribed to it, instead of only to the client that sent the message. Frames are encoded in the wire protocol each client negotiated (see `wire_protocol`). Every client gets a bounded outbound queue drained by its own writer task, so publishing never waits on a socket: the chat frames of a reply go to each subscriber in order, and graph updates are coalesced, a client holds at most one pending graph update per conversation, which is turned into frames (the deltas since the version that client has, or a snapshot) only when its writer gets to it, so the latest state wins however many refreshes happened in between. A client whose queue overflows, or whose socket does not take a frame within the send timeout, is disconnected. The purpose of this file is that one slow reader cannot stall the server or the other clients of its conversation.
+"""
+
+import asyncio
+import os
+from collections import Counter, defaultdict, deque
+
+import websockets
+
+from wire_protocol import PROTOCOL_V1, encode_frame
+
+# frames waiting for one client before it is considered too slow and disconnected
+CLIENT_QUEUE_SIZE = int(os.getenv("DHARMABOT_CLIENT_QUEUE_SIZE", "256"))
+# seconds a client's socket may take to accept one frame
+CLIENT_SEND_TIMEOUT = float(os.getenv("DHARMABOT_CLIENT_SEND_TIMEOUT", "10"))
+# close code for a client that cannot keep up, "try again later"
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+
+class GraphUpdate:
+    """
+    A pending graph update of one conversation in a client queue, materialized when it is sent.
+    """
+
+    __slots__ = ("conversation_id",)
+
+    def __init__(self, conversation_id):
+        self.conversation_id = conversation_id
+
+
+class Client:
+    def __init__(self, hub, websocket, queue_size, send_timeout, protocol=PROTOCOL_V1):
+        self.hub = hub
+        self.websocket = websocket
+        # the wire protocol negotiated at connect time, see wire_protocol
+        self.protocol = protocol
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        # encoded frames and GraphUpdates, in order
+        self.queue = deque()
+        self.wake_up = asyncio.Event()
+        # conversation_id -> graph version this client has
+        self.graph_versions = {}
+        # conversations with a GraphUpdate in the queue
+        self.pending_graphs = set()
+        self.conversations = set()
+        self.closed = False
+        self.writer = None
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+        return self
+
+    def _enqueue(self, item):
+        if self.closed:
+            return False
+        if len(self.queue) >= self.queue_size:
+            self.hub.drop(self, "queue full")
+            return False
+        self.queue.append(item)
+        self.wake_up.set()
+        return True
+
+    def send(self, frame):
+        """
+        Queue a frame (a dict, or its message in this client's protocol) for this client. Never waits, a client
+        that falls too far behind is dropped instead.
+        """
+        return self._enqueue(frame if isinstance(frame, (str, bytes)) else encode_frame(frame, self.protocol))
+
+    def send_graph(self, conversation_id):
+        """
+        Queue a graph update of the conversation, unless one is already queued: that one will send the latest state.
+        """
+        if conversation_id in self.pending_graphs:
+            self.hub.stats["graph_updates_coalesced"] += 1
+            return True
+        if self._enqueue(GraphUpdate(conversation_id)):
+            self.pending_graphs.add(conversation_id)
+            return True
+        return False
+
+    async def _send(self, data):
+        await asyncio.wait_for(self.websocket.send(data), self.send_timeout)
+        self.hub.stats["frames_sent"] += 1
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.wake_up.clear()
+                    await self.wake_up.wait()
+                    continue
+                item = self.queue.popleft()
+                if isinstance(item, GraphUpdate):
+                    self.pending_graphs.discard(item.conversation_id)
+                    frames = await self.hub.graph_handler.updates_since(
+                        item.conversation_id, self.graph_versions.get(item.conversation_id))
+                    for frame in frames:
+                        await self._send(encode_frame(frame, self.protocol))
+                        self.graph_versions[item.conversation_id] = frame["version"]
+                else:
+                    await self._send(item)
+        except asyncio.TimeoutError:
+            self.hub.drop(self, "send timeout")
+        except websockets.exceptions.ConnectionClosed:
+            # the reader of the connection notices it too
+            self.hub.disconnect(self)
+        except Exception as e:
+            print(f"Error sending to client: {e}")
+            self.hub.disconnect(self)
+
+
+class BroadcastHub:
+    def __init__(self, graph_handler, queue_size=CLIENT_QUEUE_SIZE, send_timeout=CLIENT_SEND_TIMEOUT):
+        self.graph_handler = graph_handler
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.clients = set()
+        # conversation_id -> clients subscribed to it
+        self.subscribers = defaultdict(set)
+        self.stats = Counter()
+        self.max_queue_depth = 0
+
+    def connect(self, websocket, protocol=PROTOCOL_V1):
+        client = Client(self, websocket, self.queue_size, self.send_timeout, protocol).start()
+        self.clients.add(client)
+        self.stats["connects"] += 1
+        return client
+
+    def disconnect(self, client):
+        if client.closed:
+            return
+        client.closed = True
+        self.clients.discard(client)
+        for conversation_id in client.conversations:
+            subscribers = self.subscribers.get(conversation_id)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.subscribers[conversation_id]
+        client.queue.clear()
+        if client.writer is not None and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+
+    def drop(self, client, reason):
+        """
+        Disconnect a client that cannot keep up. The close handshake runs in the background, it may never complete.
+        """
+        if client.closed:
+            return
+        print(f"Dropping slow client {client.websocket.remote_address}: {reason}")
+        self.stats["slow_clients_dropped"] += 1
+        self.disconnect(client)
+        asyncio.create_task(self._close(client.websocket))
+
+    async def _close(self, websocket):
+        try:
+            await websocket.close(SLOW_CLIENT_CLOSE_CODE, "client too slow")
+        except Exception as e:
+            print(f"Error closing slow client: {e}")
+
+    def subscribe(self, client, conversation_id):
+        if client.closed or conversation_id in client.conversations:
+            return
+        client.conversations.add(conversation_id)
+        self.subscribers[conversation_id].add(client)
+
+    def unsubscribe(self, client, conversation_id):
+        client.conversations.discard(conversation_id)
+        subscribers = self.subscribers.get(conversation_id)
+        if subscribers is not None:
+            subscribers.discard(client)
+            if not subscribers:
+                del self.subscribers[conversation_id]
+
+    def publish(self, conversation_id, frame, exclude=None):
+        """
+        Queue a frame for every client subscribed to the conversation, but `exclude`.
+        """
+        self.stats["frames_published"] += 1
+        # encoded once per protocol for all the subscribers
+        messages = {}
+        for client in list(self.subscribers.get(conversation_id, ())):
+            if client is exclude:
+                continue
+            message = messages.get(client.protocol)
+            if message is None:
+                message = messages[client.protocol] = encode_frame(frame, client.protocol)
+            client.send(message)
+            self.max_queue_depth = max(self.max_queue_depth, len(client.queue))
+
+    def publish_graph(self, conversation_id):
+        """
+        Queue an update of the conversation graph for every client subscribed to it.
+        """
+        for client in list(self.subscribers.get(conversation_id, ())):
+            client.send_graph(conversation_id)
+            self.max_queue_depth = max(self.max_queue_depth, len(client.queue))
+
+    def report(self):
+        return {
+            **self.stats,
+            "clients": len(self.clients),
+            "conversations": len(self.subscribers),
+            "queued_frames": sum(len(client.queue) for client in self.clients),
+            "max_queue_depth": self.max_queue_depth,
+        }
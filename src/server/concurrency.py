@@ -0,0 +1,112 @@
+"""
+This file contains the concurrency primitives used by the `MessageHandler`: a `KeyedLock` that serializes work within one conversation while letting different conversations run in parallel, and an `LLMLimiter` that caps how many LLM calls are in flight across the whole server, and a `LoopLagMonitor` that measures how late the event loop runs its callbacks, which is what every connection waits on once the server is busy. They keep queue-depth counters so saturation can be observed, which DharmaBot UI exposes through the `metrics` WebSocket message.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+MAX_LLM_CALLS = int(os.getenv("DHARMABOT_MAX_LLM_CALLS", "32"))
+LOOP_LAG_INTERVAL = 0.1
+# samples kept for the percentiles, a minute's worth
+LOOP_LAG_SAMPLES = 600
+
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, created on first use and dropped once nobody holds or waits for it.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        # key -> number of tasks holding or waiting for that key's lock
+        self.users = {}
+        self.max_queue_depth = 0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.users[key] = self.users.get(key, 0) + 1
+        self.max_queue_depth = max(self.max_queue_depth, self.users[key] - 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            self.users[key] -= 1
+            if self.users[key] == 0:
+                del self.users[key]
+                del self.locks[key]
+
+    def queue_depths(self):
+        """
+        Number of tasks waiting (not counting the one running) per conversation that has any.
+        """
+        return {key: users - 1 for key, users in self.users.items() if users > 1}
+
+
+class LLMLimiter:
+    def __init__(self, max_in_flight=MAX_LLM_CALLS):
+        self.max_in_flight = max_in_flight
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_calls = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.total_calls += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+
+class LoopLagMonitor:
+    """
+    Sleeps `interval` over and over and records how much later than asked it woke up.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, samples=LOOP_LAG_SAMPLES):
+        self.interval = interval
+        self.lags = deque(maxlen=samples)
+        self.max_lag = 0.0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def report(self):
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "p50_ms": round(lags[len(lags) // 2] * 1000, 2),
+            "p99_ms": round(lags[int(len(lags) * 0.99)] * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
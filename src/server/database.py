@@ -22,17 +22,17 @@ class Neo4jDatabase:
             result = session.run("RETURN 1 AS num")
             print("Successfully connected to Neo4j")
 
-    def get_messages(self):
+    def get_messages(self, conversation_id='default'):
         """
-        Retrieve all messages attached to the default conversation from the Neo4j database.
+        Retrieve all messages attached to a conversation (the default one unless specified) from the Neo4j database.
         """
         with self.driver.session(database="neo4j") as session:
             result = session.run("""
-                MATCH (c:Conversation {id: 'default'})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
+                MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
                 RETURN m.content AS content, m.timestamp AS timestamp,
                        labels(sender) AS sender_labels, sender.id AS sender_id
                 ORDER BY m.timestamp
-            """)
+            """, conversation_id=conversation_id)
             return [
                 {
                     "content": record["content"],
@@ -43,13 +43,14 @@ class Neo4jDatabase:
                 for record in result
             ]
 
-    def add_message(self, content, sender_type):
+    def add_message(self, content, sender_type, conversation_id='default'):
         """
-        Add a new message to the Neo4j database.
+        Add a new message to a conversation in the Neo4j database, creating the conversation if needed.
         """
         with self.driver.session(database="neo4j") as session:
             result = session.run("""
-                MATCH (c:Conversation {id: 'default'})
+                MERGE (c:Conversation {id: $conversation_id})
+                WITH c
                 MATCH (sender:User {id: 'test_user'})
                 WITH c, sender, CASE WHEN $sender_type = 'User' THEN sender ELSE null END as user_sender
                 OPTIONAL MATCH (agent:Agent {id: 'test_agent'})
@@ -58,7 +59,7 @@ class Neo4jDatabase:
                 CREATE (c)-[:HAS_MESSAGE]->(m)
                 CREATE (actual_sender)-[:SENT]->(m)
                 RETURN m
-            """, content=content, sender_type=sender_type)
+            """, content=content, sender_type=sender_type, conversation_id=conversation_id)
             
             message = result.single()['m']
             return {
@@ -1,65 +1,176 @@
 """
-This Python file defines a `GraphHandler` class that interacts with a Neo4j database to retrieve conversation data and represent it as nodes and links for a graph visualization. The purpose of this file is to handle the logic of querying the database for conversation-related information and formatting it into a graph structure that can be used by DharmaBot UI to display conversation graphs.
+This Python file defines a `GraphHandler` class that interacts with the database (Neo4j, or any other `MessageStore`) to retrieve conversation data and represent it as nodes and links for a graph visualization. The purpose of this file is to handle the logic of querying the database for conversation-related information and formatting it into a graph structure that can be used by DharmaBot UI to display conversation graphs.
+
+Clients are kept up to date with versioned deltas instead of the whole graph after every message. The handler keeps a version and a (timestamp, id) cursor per conversation; `refresh` reads only the messages stored after the cursor and turns them into a `graph_delta` that moves the graph from `base_version` to `version`. A client that is behind by more than the deltas still kept, or that asks for a resync, gets a full `graph` snapshot.
 """
 
-from database import Neo4jDatabase
+import os
+from collections import deque
+
+from storage import MessageStore
+
+# deltas kept per conversation for clients that are a few versions behind
+GRAPH_DELTA_LOG = int(os.getenv("DHARMABOT_GRAPH_DELTA_LOG", "64"))
+# messages read per cursor read when refreshing a conversation graph
+GRAPH_REFRESH_LIMIT = 500
+# newest messages shown in a snapshot of a very large conversation, unset shows them all
+GRAPH_MAX_MESSAGES = int(os.getenv("DHARMABOT_GRAPH_MAX_MESSAGES", "0")) or None
+
+
+class ConversationGraphState:
+    def __init__(self, conversation_id):
+        self.conversation_id = conversation_id
+        self.version = 0
+        self.cursor = None
+        # conversation and sender nodes the clients already have, message nodes are always new
+        self.known_node_ids = set()
+        self.deltas = deque(maxlen=GRAPH_DELTA_LOG)
+
+    def apply(self, messages):
+        """
+        Record the messages stored since the cursor as the next version and return its delta.
+        Adds are idempotent on the client, a node it already has is skipped.
+        """
+        nodes = []
+        links = []
+        if self.conversation_id not in self.known_node_ids:
+            nodes.append(conversation_node(self.conversation_id))
+            self.known_node_ids.add(self.conversation_id)
+        for message in messages:
+            nodes.append(message_node(message["id"], message["content"]))
+            if message["sender_id"] not in self.known_node_ids:
+                nodes.append(sender_node(message["sender_id"], message["sender_type"]))
+                self.known_node_ids.add(message["sender_id"])
+            links.extend(message_links(self.conversation_id, message["sender_id"], message["id"]))
+            self.cursor = (message["timestamp"], message["id"])
+
+        delta = {
+            "type": "graph_delta",
+            "conversation_id": self.conversation_id,
+            "base_version": self.version,
+            "version": self.version + 1,
+            "add": {"nodes": nodes, "links": links},
+            "remove": {"nodes": [], "links": []},
+        }
+        self.version += 1
+        self.deltas.append(delta)
+        return delta
+
+
+def conversation_node(conversation_id):
+    return {
+        "id": conversation_id,
+        "label": f"Conversation: {conversation_id}",
+        "type": "conversation"
+    }
+
+
+def message_node(message_id, content):
+    return {
+        "id": message_id,
+        "label": f"Message: {content[:20]}...",
+        "type": "message"
+    }
+
+
+def sender_node(sender_id, sender_label):
+    return {
+        "id": sender_id,
+        "label": f"{sender_label}: {sender_id}",
+        "type": sender_label.lower()
+    }
+
+
+def message_links(conversation_id, sender_id, message_id):
+    return [
+        {"source": conversation_id, "target": message_id, "type": "HAS_MESSAGE"},
+        {"source": sender_id, "target": message_id, "type": "SENT"},
+    ]
+
 
 class GraphHandler:
-    def __init__(self, db: Neo4jDatabase):
+    def __init__(self, db: MessageStore):
         self.db = db
+        self.conversations = {}
+
+    async def get_conversation_graph(self, conversation_id: str = "default", limit=GRAPH_MAX_MESSAGES, skip=0):
+        graph_data = await self.db.get_conversation_graph_data(conversation_id, limit, skip)
+        return self.build_graph(graph_data)
 
-    def get_conversation_graph(self, conversation_id: str = "default"):
-        query = """
-        MATCH (c:Conversation {id: $conversation_id})-[:HAS_MESSAGE]->(m:Message)<-[:SENT]-(sender)
-        RETURN c, m, sender
+    def build_graph(self, graph_data):
         """
-        result = self.db.run_query(query, {"conversation_id": conversation_id})
+        Nodes and links from the one aggregated row of `get_conversation_graph_data`.
+        """
+        if graph_data is None:
+            return {"nodes": [], "links": [], "total_messages": 0}
+        conversation_id = graph_data["conversation_id"]
+        messages = graph_data["messages"]
 
-        nodes = []
-        links = []
-        node_ids = set()
-
-        for record in result:
-            conversation = record["c"]
-            message = record["m"]
-            sender = record["sender"]
-
-            if conversation["id"] not in node_ids:
-                nodes.append({
-                    "id": conversation["id"],
-                    "label": f"Conversation: {conversation['id']}",
-                    "type": "conversation"
-                })
-                node_ids.add(conversation["id"])
-
-            if message["id"] not in node_ids:
-                nodes.append({
-                    "id": message["id"],
-                    "label": f"Message: {message['content'][:20]}...",
-                    "type": "message"
-                })
-                node_ids.add(message["id"])
-
-            if sender["id"] not in node_ids:
-                nodes.append({
-                    "id": sender["id"],
-                    "label": f"{list(sender.labels)[0]}: {sender['id']}",
-                    "type": list(sender.labels)[0].lower()
-                })
-                node_ids.add(sender["id"])
-
-            links.append({
-                "source": conversation["id"],
-                "target": message["id"],
-                "type": "HAS_MESSAGE"
-            })
-            links.append({
-                "source": sender["id"],
-                "target": message["id"],
-                "type": "SENT"
-            })
+        nodes = [conversation_node(conversation_id)]
+        nodes += [sender_node(sender_id, sender_label) for sender_id, sender_label in graph_data["senders"]]
+        # the same shapes as message_node and message_links, spelled out because this runs once per message
+        nodes += [{"id": message_id, "label": f"Message: {content[:20]}...", "type": "message"} for message_id, content, _ in messages]
+        links = [{"source": conversation_id, "target": message_id, "type": "HAS_MESSAGE"} for message_id, _, _ in messages]
+        links += [{"source": sender_id, "target": message_id, "type": "SENT"} for message_id, _, sender_id in messages]
 
         return {
             "nodes": nodes,
-            "links": links
-        }
\ No newline at end of file
+            "links": links,
+            "total_messages": graph_data["total_messages"]
+        }
+
+    async def snapshot(self, conversation_id: str = "default"):
+        """
+        The whole graph of a conversation (its newest `GRAPH_MAX_MESSAGES` messages when that is set) as a `graph` frame, tagged with its current version.
+        """
+        state = self.conversations.get(conversation_id)
+        if state is not None:
+            # deltas already sent stay valid, the snapshot just has to include them
+            await self.refresh(conversation_id)
+        graph_data = await self.db.get_conversation_graph_data(conversation_id, GRAPH_MAX_MESSAGES)
+
+        if state is None:
+            state = ConversationGraphState(conversation_id)
+            state.version = 1
+            if graph_data is not None:
+                state.known_node_ids = {conversation_id} | {sender_id for sender_id, _ in graph_data["senders"]}
+                state.cursor = graph_data["newest"]
+            self.conversations[conversation_id] = state
+
+        return {"type": "graph", "conversation_id": conversation_id, "version": state.version, "data": self.build_graph(graph_data)}
+
+    async def refresh(self, conversation_id: str = "default"):
+        """
+        Turn the messages stored since the last refresh into deltas. Conversations nobody has a snapshot of are skipped.
+        """
+        state = self.conversations.get(conversation_id)
+        if state is None:
+            return []
+        # messages of this turn may still be queued in a write-behind store, the cursor would miss them
+        await self.db.flush_conversation(conversation_id)
+        deltas = []
+        while True:
+            after_timestamp, after_id = state.cursor or (None, "")
+            messages = await self.db.get_messages_after(conversation_id, after_timestamp, after_id, GRAPH_REFRESH_LIMIT)
+            if messages:
+                deltas.append(state.apply(messages))
+            if len(messages) < GRAPH_REFRESH_LIMIT:
+                return deltas
+
+    async def updates_since(self, conversation_id: str, version=None):
+        """
+        The frames that bring a client holding `version` of the graph up to date: the deltas after it
+        when they are still kept, a snapshot otherwise.
+        """
+        state = self.conversations.get(conversation_id)
+        if state is None or version is None or version > state.version:
+            return [await self.snapshot(conversation_id)]
+        if version == state.version:
+            return []
+        deltas = [delta for delta in state.deltas if delta["base_version"] >= version]
+        if not deltas or deltas[0]["base_version"] != version:
+            return [await self.snapshot(conversation_id)]
+        return deltas
+
+    def forget(self, conversation_id):
+        self.conversations.pop(conversation_id, None)
@@ -0,0 +1,121 @@
+"""
+This file contains the `HistoryCache` class, which keeps the recent history of each active conversation in memory so the `MessageHandler` does not have to refetch a whole conversation from the database for every message. Each conversation holds a bounded window of its latest messages together with a (timestamp, id) cursor: messages written by this server are appended as they are stored, and every turn reads only the rows after the cursor, which picks up messages written elsewhere and puts the appended ones in database order. Conversations that have been idle for a while, or the least recently used ones once too many are cached, are evicted. The purpose of this file is to keep the cost of a DharmaBot UI turn constant no matter how long the conversation has grown.
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+
+HISTORY_WINDOW = int(os.getenv("DHARMABOT_HISTORY_WINDOW", "200"))
+HISTORY_MAX_CONVERSATIONS = int(os.getenv("DHARMABOT_HISTORY_MAX_CONVERSATIONS", "1000"))
+HISTORY_IDLE_TTL = float(os.getenv("DHARMABOT_HISTORY_IDLE_TTL", "1800"))
+
+
+class ConversationHistory:
+    def __init__(self, window):
+        self.messages = deque(maxlen=window)
+        # (timestamp, id) of the newest message read from the database, the position of the next cursor read
+        self.cursor = None
+        # appended messages at the end of the window that no cursor read has returned yet
+        self.unread = 0
+        # False until the recent messages have been read from the database
+        self.loaded = False
+        self.last_used = time.monotonic()
+
+    def add(self, message):
+        self.messages.append(message)
+        self.cursor = (message["timestamp"], message["id"])
+
+    def add_unread(self, message):
+        self.messages.append(message)
+        self.unread = min(self.unread + 1, len(self.messages))
+
+    def replace_unread(self, messages, clear=False):
+        # the database read returns the appended messages too, in order with anything written elsewhere;
+        # the ones it does not return yet (still in a write-behind buffer) stay unread at the end
+        unread = [self.messages.pop() for _ in range(self.unread)][::-1]
+        if clear:
+            self.messages.clear()
+        read_ids = {message["id"] for message in messages}
+        for message in messages:
+            self.add(message)
+        self.unread = 0
+        for message in unread:
+            if message["id"] not in read_ids:
+                self.add_unread(message)
+
+
+class HistoryCache:
+    def __init__(self, database, window=HISTORY_WINDOW, max_conversations=HISTORY_MAX_CONVERSATIONS,
+                 idle_ttl=HISTORY_IDLE_TTL):
+        self.database = database
+        self.window = window
+        self.max_conversations = max_conversations
+        self.idle_ttl = idle_ttl
+        # least recently used first
+        self.conversations = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "rows_read": 0}
+
+    async def get(self, conversation_id="default"):
+        """
+        The latest `window` messages of a conversation, oldest first.
+        """
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            history = self.conversations[conversation_id] = ConversationHistory(self.window)
+        if not history.loaded:
+            self.stats["misses"] += 1
+            await self._load_recent(history, conversation_id)
+        else:
+            self.stats["hits"] += 1
+            await self._catch_up(history, conversation_id)
+
+        history.last_used = time.monotonic()
+        self.conversations.move_to_end(conversation_id)
+        self.evict()
+        return list(history.messages)
+
+    def append(self, conversation_id, message):
+        """
+        Record a message that was just stored. It is kept until a database read returns it, so it is
+        not lost if it is not readable yet (e.g. queued by a WriteBehindDatabase).
+        """
+        history = self.conversations.get(conversation_id)
+        if history is None:
+            history = self.conversations[conversation_id] = ConversationHistory(self.window)
+        history.add_unread(message)
+
+    def forget(self, conversation_id):
+        self.conversations.pop(conversation_id, None)
+
+    def evict(self):
+        """
+        Drop conversations idle for longer than `idle_ttl`, then the least recently used ones above `max_conversations`.
+        """
+        deadline = time.monotonic() - self.idle_ttl
+        while self.conversations:
+            conversation_id, history = next(iter(self.conversations.items()))
+            if history.last_used >= deadline and len(self.conversations) <= self.max_conversations:
+                break
+            del self.conversations[conversation_id]
+            self.stats["evictions"] += 1
+
+    async def _load_recent(self, history, conversation_id):
+        messages = await self.database.get_recent_messages(conversation_id, self.window)
+        self.stats["rows_read"] += len(messages)
+        history.replace_unread(messages, clear=True)
+        history.loaded = True
+
+    async def _catch_up(self, history, conversation_id):
+        # without a cursor (nothing read yet) the read starts at the beginning of the conversation
+        after_timestamp, after_id = history.cursor or (None, "")
+        messages = await self.database.get_messages_after(conversation_id, after_timestamp, after_id, self.window)
+        self.stats["rows_read"] += len(messages)
+        if len(messages) == self.window:
+            # at least a whole window was written since the last read, only the newest rows matter
+            await self._load_recent(history, conversation_id)
+        elif messages:
+            history.replace_unread(messages)
+
+    def report(self):
+        return {**self.stats, "cached_conversations": len(self.conversations), "window": self.window}
@@ -0,0 +1,127 @@
+"""
+This Python file defines `InMemoryDatabase`, a fake of `AsyncNeo4jDatabase` that keeps conversations, users, agents and messages in plain Python structures. It has the same async methods and returns the same shapes, with an optional simulated round-trip latency, so the `MessageHandler` and `GraphHandler` of DharmaBot UI can be tested and benchmarked without a running Neo4j instance.
+"""
+
+import asyncio
+import bisect
+import uuid
+from datetime import datetime, timezone
+
+from storage import MessageStore
+
+
+class FakeNode(dict):
+    """
+    Stands in for a neo4j Node: item access for properties plus a `labels` set.
+    """
+
+    def __init__(self, labels, **properties):
+        super().__init__(properties)
+        self.labels = frozenset(labels)
+
+
+def _message_dict(message, sender):
+    return {
+        "id": message["id"],
+        "content": message["content"],
+        "timestamp": message["timestamp"].isoformat(),
+        "sender_type": next(iter(sender.labels)),
+        "sender_id": sender["id"]
+    }
+
+
+def _cursor_key(row):
+    message, _ = row
+    return message["timestamp"], message["id"]
+
+
+class InMemoryDatabase(MessageStore):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.conversations = {}
+        self.messages = {}
+        self.senders = {
+            "User": FakeNode(["User"], id="test_user"),
+            "Agent": FakeNode(["Agent"], id="test_agent"),
+        }
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def close(self):
+        pass
+
+    async def test_connection(self):
+        print("Using the in-memory database")
+
+    def _conversation(self, conversation_id):
+        if conversation_id not in self.conversations:
+            self.conversations[conversation_id] = FakeNode(["Conversation"], id=conversation_id)
+            self.messages[conversation_id] = []
+        return self.conversations[conversation_id]
+
+    async def get_messages(self, conversation_id='default'):
+        await self._round_trip()
+        return [_message_dict(message, sender) for message, sender in self.messages.get(conversation_id, [])]
+
+    async def get_messages_after(self, conversation_id='default', after_timestamp=None, after_id='', limit=1000):
+        await self._round_trip()
+        messages = self.messages.get(conversation_id, [])
+        start = 0
+        if after_timestamp is not None:
+            cursor = (datetime.fromisoformat(after_timestamp), after_id)
+            start = bisect.bisect_right(messages, cursor, key=_cursor_key)
+        return [_message_dict(message, sender) for message, sender in messages[start:start + limit]]
+
+    async def get_recent_messages(self, conversation_id='default', limit=100):
+        await self._round_trip()
+        return [_message_dict(message, sender) for message, sender in self.messages.get(conversation_id, [])[-limit:]]
+
+    async def add_message(self, content, sender_type, conversation_id='default'):
+        await self._round_trip()
+        self._conversation(conversation_id)
+        sender = self.senders["User" if sender_type == "User" else "Agent"]
+        message = FakeNode(["Message"], id=str(uuid.uuid4()), content=content, timestamp=datetime.now(timezone.utc))
+        # kept in (timestamp, id) order, the order the cursor reads of Neo4j use
+        bisect.insort(self.messages[conversation_id], (message, sender), key=_cursor_key)
+        return {
+            'id': message['id'],
+            'content': message['content'],
+            'timestamp': message['timestamp'].isoformat(),
+            'sender_type': sender_type
+        }
+
+    async def add_messages(self, messages):
+        await self._round_trip()
+        for row in messages:
+            self._conversation(row["conversation_id"])
+            sender = self.senders["User" if row["sender_type"] == "User" else "Agent"]
+            message = FakeNode(["Message"], id=row["id"], content=row["content"], timestamp=datetime.fromisoformat(row["timestamp"]))
+            bisect.insort(self.messages[row["conversation_id"]], (message, sender), key=_cursor_key)
+
+    async def get_conversation_records(self, conversation_id='default'):
+        await self._round_trip()
+        if conversation_id not in self.conversations:
+            return []
+        conversation = self.conversations[conversation_id]
+        return [{"c": conversation, "m": message, "sender": sender} for message, sender in self.messages[conversation_id]]
+
+    async def get_conversation_graph_data(self, conversation_id='default', limit=None, skip=0):
+        await self._round_trip()
+        rows = self.messages.get(conversation_id)
+        if not rows:
+            return None
+        end = len(rows) - skip
+        page = rows[max(0, end - limit) if limit is not None else 0:max(0, end)]
+        if not page:
+            return None
+        senders = {sender["id"]: next(iter(sender.labels)) for _, sender in page}
+        newest = page[-1][0]
+        return {
+            "conversation_id": conversation_id,
+            "total_messages": len(rows),
+            "messages": [[message["id"], message["content"][:20], sender["id"]] for message, sender in page],
+            "senders": [[sender_id, label] for sender_id, label in senders.items()],
+            "newest": (newest["timestamp"].isoformat(), newest["id"]),
+        }
@@ -10,7 +10,13 @@ import os
 from dotenv import load_dotenv
 import asyncio
 import traceback
-from server.agents.groq_basic import groq_basic 
+from server.agents.groq_basic import groq_basic, agroq_basic, groq_basic_stream
+from server.agents.conversation_memory import ConversationMemory
+from server.agents.model_router import ModelRouter, ROUTER_ENABLED, LLM_TIMEOUT
+from streaming import DeltaStream
+from concurrency import KeyedLock, LLMLimiter
+from history_cache import HistoryCache
+from write_behind import WriteBehindDatabase
 
 load_dotenv()
 
@@ -22,7 +28,7 @@ class MessageHandler:
             model="gpt-3.5-turbo",
             temperature=0.7,
             max_tokens=None,
-            timeout=None,
+            timeout=LLM_TIMEOUT,
             max_retries=2,
             api_key=os.getenv("OPENAI_API_KEY"),
         )
@@ -31,60 +37,159 @@ class MessageHandler:
             temperature=0.7, 
             max_tokens=None,
             groq_api_key=os.getenv("groq_api_key"),
-            timeout=None,
+            timeout=LLM_TIMEOUT,
             max_retries=2,
         )
         self.system_message = SystemMessage(content="You are a helpful AI assistant.")
-        self.message_lock = asyncio.Lock()
+        # Messages of one conversation are handled in order, different conversations run in parallel
+        self.conversation_locks = KeyedLock()
+        # Caps the LLM calls in flight across all conversations
+        self.llm_limiter = LLMLimiter()
+        # "groq_basic" answers with a single LLM call, "dharmaflow" runs the draft -> check -> critique graph
+        self.agent = os.getenv("DHARMABOT_AGENT", "groq_basic")
+        # Recent messages of each active conversation, so a turn does not refetch the whole conversation
+        self.history = HistoryCache(database)
+        # What groq_basic sends of each conversation: a token-budgeted window plus a summary of the rest
+        self.memory = ConversationMemory(self.llm_groq)
+        # Sends each groq_basic call to the faster healthy provider and hedges slow ones on the other
+        self.router = ModelRouter({"groq": self.llm_groq, "openai": self.llm_openai}) if ROUTER_ENABLED else None
+        # A LoopLagMonitor, set by the server once its event loop runs
+        self.loop_lag = None
+        # The BroadcastHub of the server, which sends replies to every client of a conversation
+        self.broadcast = None
 
     async def handle(self, websocket, path):
         self.connected.add(websocket)
         try:
-            chat_history = self.database.get_messages()
+            chat_history = await self.database.get_messages()
             await websocket.send(json.dumps({"type": "chat", "messages": chat_history}))
             
             async for websocket_message in websocket:
                 data = json.loads(websocket_message)
                 if data["type"] == "chat":
-                    async with self.message_lock:
-                        user_message = self.database.add_message(data["content"], data["sender_type"])
+                    async with self.conversation_locks.hold("default"):
+                        user_message = await self.database.add_message(data["content"], data["sender_type"])
                         
                         try:
-                            ai_response = self.generate_ai_response(chat_history + [user_message])
-                            ai_message = self.database.add_message(ai_response, "Agent")
+                            async with self.llm_limiter.slot():
+                                ai_response = await self.agenerate_ai_response(chat_history + [user_message])
+                            ai_message = await self.database.add_message(ai_response, "Agent")
                             
                             await websocket.send(json.dumps({"type": "chat", "message": ai_message}))
                         except Exception as e:
                             print(f"Error generating AI response: {e}")
-                            error_message = self.database.add_message("Sorry, I encountered an error while processing your request.", "Agent")
+                            error_message = await self.database.add_message("Sorry, I encountered an error while processing your request.", "Agent")
                             await websocket.send(json.dumps({"type": "chat", "message": error_message}))
         finally:
             self.connected.remove(websocket)
 
-    async def handle_message(self, content, sender_type):
-        print(f"Handling message: content='{content}', sender_type='{sender_type}'")
-        async with self.message_lock:
+    async def handle_message(self, content, sender_type, conversation_id="default"):
+        print(f"Handling message: content='{content}', sender_type='{sender_type}', conversation_id='{conversation_id}'")
+        async with self.conversation_locks.hold(conversation_id):
             try:
-                user_message = self.database.add_message(content, sender_type)
+                user_message = await self.database.add_message(content, sender_type, conversation_id)
+                self.history.append(conversation_id, user_message)
                 print(f"User message added: {user_message}")
                 
-                chat_history = self.database.get_messages()
+                chat_history = await self.history.get(conversation_id)
                 print(f"Chat history retrieved, length: {len(chat_history)}")
                 
-                ai_response = self.generate_ai_response(chat_history)
+                async with self.llm_limiter.slot():
+                    ai_response = await self.agenerate_ai_response(chat_history, conversation_id)
                 print(f"AI response generated: '{ai_response[:50]}...'")
                 
-                ai_message = self.database.add_message(ai_response, "Agent")
+                ai_message = await self.database.add_message(ai_response, "Agent", conversation_id)
+                self.history.append(conversation_id, ai_message)
                 print(f"AI message added: {ai_message}")
                 
                 return ai_message
             except Exception as e:
                 print(f"Error in handle_message: {e}")
                 print(traceback.format_exc())
-                error_message = self.database.add_message("Sorry, I encountered an error while processing your request.", "Agent")
+                error_message = await self.database.add_message("Sorry, I encountered an error while processing your request.", "Agent", conversation_id)
+                self.history.append(conversation_id, error_message)
                 return error_message
 
-    def generate_ai_response(self, conversation):
-        return groq_basic(conversation, self.system_message, self.llm_openai, self.llm_groq)  # Updated call
+    async def stream_message(self, content, sender_type, send, conversation_id="default", on_user_message=None):
+        """
+        Like `handle_message`, but sends the AI response to `send` as `chat_delta` frames while it is
+        being generated. Returns the stored AI message and the id of the stream it was sent on.
+        `on_user_message` is called with the user message once it is stored.
+        """
+        print(f"Streaming message: content='{content}', sender_type='{sender_type}', conversation_id='{conversation_id}'")
+        async with self.conversation_locks.hold(conversation_id):
+            delta_stream = DeltaStream(send).start()
+            try:
+                user_message = await self.database.add_message(content, sender_type, conversation_id)
+                self.history.append(conversation_id, user_message)
+                if on_user_message is not None:
+                    on_user_message(user_message)
+                chat_history = await self.history.get(conversation_id)
+
+                async with self.llm_limiter.slot():
+                    async for kind, delta in self.stream_ai_response(chat_history, conversation_id):
+                        if kind == "reset":
+                            await delta_stream.reset()
+                        else:
+                            delta_stream.push(delta)
+                await delta_stream.close()
+                print(f"AI response streamed in {delta_stream.frames_sent} frames: '{delta_stream.content[:50]}...'")
+
+                ai_message = await self.database.add_message(delta_stream.content, "Agent", conversation_id)
+                self.history.append(conversation_id, ai_message)
+                return ai_message, delta_stream.stream_id
+            except Exception as e:
+                print(f"Error in stream_message: {e}")
+                print(traceback.format_exc())
+                try:
+                    await delta_stream.close()
+                except Exception:
+                    pass
+                error_message = await self.database.add_message("Sorry, I encountered an error while processing your request.", "Agent", conversation_id)
+                self.history.append(conversation_id, error_message)
+                return error_message, delta_stream.stream_id
+
+    def stream_ai_response(self, conversation, conversation_id="default"):
+        if self.agent == "dharmaflow":
+            # imported lazily so the groq_basic setup does not load the whole LangGraph agent
+            from server.agents.dharmaflow import dharmaflow_stream
+            return dharmaflow_stream(conversation, thread_id=conversation_id)
+        return groq_basic_stream(conversation, self.system_message, self.llm_openai, self.llm_groq, self.memory, conversation_id, self.router)
+
+    def generate_ai_response(self, conversation, conversation_id="default"):
+        return groq_basic(conversation, self.system_message, self.llm_openai, self.llm_groq, self.memory, conversation_id, self.router)  # Updated call
+
+    async def agenerate_ai_response(self, conversation, conversation_id="default"):
+        return await agroq_basic(conversation, self.system_message, self.llm_openai, self.llm_groq, self.memory, conversation_id, self.router)
+
+    def get_metrics(self):
+        metrics = {
+            "conversation_queue_depths": self.conversation_locks.queue_depths(),
+            "max_conversation_queue_depth": self.conversation_locks.max_queue_depth,
+            "active_conversations": len(self.conversation_locks.users),
+            "llm_in_flight": self.llm_limiter.in_flight,
+            "llm_waiting": self.llm_limiter.waiting,
+            "llm_max_waiting": self.llm_limiter.max_waiting,
+            "llm_max_in_flight": self.llm_limiter.max_in_flight,
+            "llm_total_calls": self.llm_limiter.total_calls,
+            "history_cache": self.history.report(),
+            "memory": self.memory.report(),
+        }
+        if self.router is not None:
+            metrics["llm_router"] = self.router.report()
+        if self.loop_lag is not None:
+            metrics["event_loop_lag"] = self.loop_lag.report()
+        if self.broadcast is not None:
+            metrics["broadcast"] = self.broadcast.report()
+        if self.agent == "dharmaflow":
+            from dharmabot.response_cache import response_cache
+            metrics["response_cache"] = response_cache.report()
+            from dharmabot.nodes.speculate import speculation_stats
+            metrics["speculative_drafting"] = dict(speculation_stats)
+            from dharmabot.instrumentation import graph_metrics
+            metrics["graph"] = graph_metrics.report()
+        if isinstance(self.database, WriteBehindDatabase):
+            metrics["write_behind"] = self.database.report()
+        return metrics
 
 __all__ = ['MessageHandler']
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+This Python file contains the schema migrations of the Neo4j graph behind DharmaBot UI. Every hot query looks up a `Conversation`, `User` or `Agent` by id and orders messages by `Message.timestamp`, so without uniqueness constraints and indexes those lookups become label scans as the graph grows. `migrate` applies the numbered migrations that have not been applied yet (each statement is idempotent), and records the schema version on a `SchemaVersion` node; the WebSocket server runs it at startup. `check_index_usage` runs `EXPLAIN` on the hot queries and reports any that would scan a label instead of seeking an index.
+
+Run with `python schema.py [--check]` from `src/server` to migrate (and check) the database configured in `.env`.
+"""
+
+import argparse
+import asyncio
+
+from async_database import (
+    ADD_MESSAGE_QUERY,
+    ADD_MESSAGES_QUERY,
+    CONVERSATION_GRAPH_QUERY,
+    GET_MESSAGES_AFTER_QUERY,
+    GET_MESSAGES_QUERY,
+    GET_RECENT_MESSAGES_QUERY,
+    AsyncNeo4jDatabase,
+)
+from config import load_config
+from storage import supports_queries
+
+# (version, statements), applied in order; a new migration gets the next version
+MIGRATIONS = [
+    (1, [
+        "CREATE CONSTRAINT conversation_id IF NOT EXISTS FOR (c:Conversation) REQUIRE c.id IS UNIQUE",
+        "CREATE CONSTRAINT user_id IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
+        "CREATE CONSTRAINT agent_id IF NOT EXISTS FOR (a:Agent) REQUIRE a.id IS UNIQUE",
+        "CREATE CONSTRAINT message_id IF NOT EXISTS FOR (m:Message) REQUIRE m.id IS UNIQUE",
+        "CREATE INDEX message_timestamp IF NOT EXISTS FOR (m:Message) ON (m.timestamp)",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+GET_SCHEMA_VERSION_QUERY = """
+    OPTIONAL MATCH (s:SchemaVersion {id: 'dharmabot'})
+    RETURN s.version AS version
+"""
+
+SET_SCHEMA_VERSION_QUERY = """
+    MERGE (s:SchemaVersion {id: 'dharmabot'})
+    SET s.version = $version, s.updated_at = datetime()
+"""
+
+SAMPLE_PARAMETERS = {
+    "conversation_id": "default",
+    "content": "",
+    "sender_type": "User",
+    "after_timestamp": None,
+    "after_id": "",
+    "limit": 1,
+    "skip": 0,
+    "messages": [],
+}
+
+HOT_QUERIES = {
+    "get_messages": GET_MESSAGES_QUERY,
+    "get_messages_after": GET_MESSAGES_AFTER_QUERY,
+    "get_recent_messages": GET_RECENT_MESSAGES_QUERY,
+    "add_message": ADD_MESSAGE_QUERY,
+    "add_messages": ADD_MESSAGES_QUERY,
+    "get_conversation_graph": CONVERSATION_GRAPH_QUERY,
+    "setup_demo_conversation": """
+        MERGE (c:Conversation {id: 'default'})
+        MERGE (u:User {id: 'test_user'})
+        MERGE (a:Agent {id: 'test_agent'})
+        RETURN c, u, a
+    """,
+}
+
+SCAN_OPERATORS = {"AllNodesScan", "NodeByLabelScan"}
+SEEK_OPERATORS = {"NodeIndexSeek", "NodeUniqueIndexSeek", "NodeIndexSeekByRange", "NodeUniqueIndexSeekByRange"}
+
+
+async def get_schema_version(db):
+    records = await db.read(GET_SCHEMA_VERSION_QUERY)
+    return records[0]["version"] or 0
+
+
+async def migrate(db):
+    """
+    Apply the migrations newer than the recorded schema version and return the version the database is at.
+    """
+    if not supports_queries(db):
+        raise TypeError(f"Schema migrations need a database that runs Cypher queries, not {type(db).__name__}")
+    current_version = await get_schema_version(db)
+    for version, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        print(f"Applying schema migration {version}")
+        for statement in statements:
+            # schema statements cannot share a transaction with data writes, so each runs on its own
+            await db.run_query(statement)
+        await db.run_query("CALL db.awaitIndexes(300)")
+        await db.run_query(SET_SCHEMA_VERSION_QUERY, {"version": version})
+        current_version = version
+    return current_version
+
+
+def plan_operators(plan):
+    operators = [plan["operatorType"].split("@")[0]]
+    for child in plan.get("children", []):
+        operators.extend(plan_operators(child))
+    return operators
+
+
+async def check_index_usage(db, queries=HOT_QUERIES):
+    """
+    {query name: (uses index seeks only, operators of its plan)} for each hot query.
+    """
+    report = {}
+    for name, query in queries.items():
+        operators = plan_operators(await db.explain(query, SAMPLE_PARAMETERS))
+        uses_index_seeks = not SCAN_OPERATORS.intersection(operators) and bool(SEEK_OPERATORS.intersection(operators))
+        report[name] = (uses_index_seeks, operators)
+    return report
+
+
+async def assert_index_usage(db, queries=HOT_QUERIES):
+    report = await check_index_usage(db, queries)
+    scanning = {name: operators for name, (uses_index_seeks, operators) in report.items() if not uses_index_seeks}
+    if scanning:
+        raise RuntimeError(f"Hot queries not using index seeks: {scanning}")
+    return report
+
+
+async def main(check):
+    config = load_config()
+    db = AsyncNeo4jDatabase(config["URI"], config["USER"], config["PASSWORD"])
+    try:
+        version = await migrate(db)
+        print(f"Schema is at version {version}")
+        if check:
+            for name, (uses_index_seeks, operators) in (await check_index_usage(db)).items():
+                print(f"{'ok  ' if uses_index_seeks else 'SCAN'} {name}: {' -> '.join(operators)}")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true", help="EXPLAIN the hot queries and report index usage")
+    asyncio.run(main(parser.parse_args().check))
@@ -5,26 +5,52 @@ This Python script serves as the backend for the DharmaBot UI, handling WebSocke
 import asyncio
 import websockets
 from config import load_config, print_neo4j_env_vars, test_dns_resolution, resolve_hostname
-from database import Neo4jDatabase
+from storage import create_database
+from write_behind import WRITE_BEHIND, WriteBehindDatabase
+from schema import migrate
 from message_handler import MessageHandler
+from concurrency import LoopLagMonitor
 from graph_handler import GraphHandler
+from broadcast import BroadcastHub
+from wire_protocol import decode_frame, negotiated, server_options
 import json
+import os
+import sys
 import traceback
+from http import HTTPStatus
+from urllib.parse import unquote
+
+def process_request(path, headers):
+    # Plain HTTP GETs for monitoring: /metrics for Prometheus, /metrics/threads/<conversation id> for one thread.
+    # Anything else goes on to the WebSocket handshake.
+    if path != "/metrics" and not path.startswith("/metrics/threads/"):
+        return None
+    # Only the dharmaflow agent runs the graph, the other agents do not load it or its metrics
+    if message_handler.agent != "dharmaflow":
+        return HTTPStatus.NOT_FOUND, [("Content-Type", "text/plain")], b"No graph metrics for this agent\n"
+    from dharmabot.instrumentation import graph_metrics
+    if path == "/metrics":
+        return HTTPStatus.OK, [("Content-Type", "text/plain; version=0.0.4")], graph_metrics.prometheus().encode()
+    summary = graph_metrics.thread_summary(unquote(path[len("/metrics/threads/"):]))
+    if summary is None:
+        return HTTPStatus.NOT_FOUND, [("Content-Type", "text/plain")], b"No metrics for this thread\n"
+    return HTTPStatus.OK, [("Content-Type", "application/json")], json.dumps(summary).encode()
 
 async def handle_connection(websocket, path):
     print(f"New connection established: {websocket.remote_address}")
+    # Everything sent to this client goes through its bounded queue in the hub, a client that cannot keep up is dropped.
+    # Frames are JSON text, or MessagePack for a client that asked for protocol v2 in the handshake.
+    client = hub.connect(websocket, negotiated(websocket))
     try:
         # Send initial chat history
-        chat_history = message_handler.database.get_messages()
-        await websocket.send(json.dumps({"type": "chat", "messages": chat_history}))
+        chat_history = await message_handler.database.get_messages()
+        client.send({"type": "chat", "messages": chat_history})
         print("Initial chat history sent")
 
-        # Send graph data
-        print("Retrieving conversation graph...")
-        graph_data = graph_handler.get_conversation_graph()
-        print(f"Graph data retrieved: {json.dumps(graph_data, indent=2)}")
-        await websocket.send(json.dumps({"type": "graph", "data": graph_data}))
-        print("Graph data sent to client")
+        # The graph of the default conversation, then its updates as they come
+        hub.subscribe(client, "default")
+        client.send_graph("default")
+        print("Graph data queued for the client")
 
         # Keep the connection open and handle incoming messages
         while True:
@@ -33,16 +59,44 @@ async def handle_connection(websocket, path):
                 # This prevents the connection from hanging indefinitely if no message is received
                 message = await asyncio.wait_for(websocket.recv(), timeout=30)
                 print(f"Received message: {message}")
-                data = json.loads(message)
+                data = decode_frame(message)
                 if data["type"] == "chat":
-                    response = await message_handler.handle_message(data["content"], data["sender_type"])
-                    await websocket.send(json.dumps({"type": "chat", "message": response}))
+                    # The response is streamed as chat_delta frames while it is generated, then committed with a chat frame,
+                    # to every client subscribed to the conversation
+                    conversation_id = data.get("conversation_id", "default")
+                    hub.subscribe(client, conversation_id)
+
+                    async def send_frame(frame):
+                        hub.publish(conversation_id, frame)
+
+                    def share_user_message(user_message):
+                        # the sender shows its own message already
+                        hub.publish(conversation_id, {"type": "chat", "message": user_message}, exclude=client)
+
+                    response, stream_id = await message_handler.stream_message(
+                        data["content"], data["sender_type"], send_frame, conversation_id, on_user_message=share_user_message)
+                    hub.publish(conversation_id, {"type": "chat", "message": response, "stream_id": stream_id})
                     print("Chat response sent")
-                    
-                    # Send updated graph after each message
-                    updated_graph_data = graph_handler.get_conversation_graph()
-                    await websocket.send(json.dumps({"type": "graph", "data": updated_graph_data}))
-                    print("Updated graph data sent")
+
+                    # Send updated graph after each message, coalesced with any update still queued
+                    await graph_handler.refresh(conversation_id)
+                    hub.publish_graph(conversation_id)
+                    print("Updated graph data queued")
+                elif data["type"] == "subscribe":
+                    # Follow a conversation without writing to it: its graph now, its replies and graph updates from now on
+                    conversation_id = data.get("conversation_id", "default")
+                    hub.subscribe(client, conversation_id)
+                    client.send_graph(conversation_id)
+                elif data["type"] == "unsubscribe":
+                    hub.unsubscribe(client, data.get("conversation_id", "default"))
+                elif data["type"] in ("graph_resync", "get_graph_data"):
+                    # The client lost track of its graph (or has none yet), send it whole
+                    conversation_id = data.get("conversation_id", "default")
+                    hub.subscribe(client, conversation_id)
+                    client.graph_versions.pop(conversation_id, None)
+                    client.send_graph(conversation_id)
+                elif data["type"] == "metrics":
+                    client.send({"type": "metrics", "data": message_handler.get_metrics()})
             except asyncio.TimeoutError:
                 print("No message received, sending ping")
                 await websocket.ping()
@@ -52,27 +106,50 @@ async def handle_connection(websocket, path):
             except Exception as e:
                 print(f"Error handling message: {e}")
                 print(traceback.format_exc())
-                await websocket.send(json.dumps({"type": "error", "message": str(e)}))
+                client.send({"type": "error", "message": str(e)})
     except Exception as e:
         print(f"Error in handle_connection: {e}")
         print(traceback.format_exc())
+    finally:
+        hub.disconnect(client)
 
 async def main():
     config = load_config()
-    print_neo4j_env_vars()
 
-    hostname = config["URI"].split("://")[1].split(":")[0]
-    print(f"Hostname extracted for DNS resolution: {hostname}")
-    test_dns_resolution(hostname)
-    resolve_hostname(config["URI"])
+    # Constraints and indexes are created (idempotently) at startup unless DHARMABOT_MIGRATE=0
+    run_migrations = False
+    # "sqlite" and "memory" need no Neo4j, the in-memory one loses everything on restart
+    if os.getenv("DHARMABOT_DATABASE", "neo4j") == "neo4j":
+        run_migrations = os.getenv("DHARMABOT_MIGRATE", "1") != "0"
+        print_neo4j_env_vars()
+
+        hostname = config["URI"].split("://")[1].split(":")[0]
+        print(f"Hostname extracted for DNS resolution: {hostname}")
+        test_dns_resolution(hostname)
+        resolve_hostname(config["URI"])
+
+    db = create_database(config)
+
+    if WRITE_BEHIND:
+        # Messages are stored in batches in the background, closing the database flushes them
+        db = WriteBehindDatabase(db)
 
     try:
-        db = Neo4jDatabase(config["URI"], config["USER"], config["PASSWORD"])
-        db.test_connection()
+        await db.test_connection()
+        if run_migrations:
+            print(f"Schema is at version {await migrate(db)}")
 
-        global message_handler, graph_handler
+        global message_handler, graph_handler, hub
         message_handler = MessageHandler(db)
         graph_handler = GraphHandler(db)
+        hub = BroadcastHub(graph_handler)
+        message_handler.broadcast = hub
+        # How late the loop runs, reported in the metrics message
+        message_handler.loop_lag = LoopLagMonitor().start()
+        if message_handler.agent == "dharmaflow":
+            # Create the model clients and open their connections in the background, so the first conversation does not pay for it
+            from dharmabot.model import model_registry
+            model_registry.start_warm_up()
 
         # Start the WebSocket server
         server = await websockets.serve(
@@ -81,21 +158,24 @@ async def main():
             3001,  # Port number to listen on
             ping_interval=20,  # Send a ping every 20 seconds to keep the connection alive
             ping_timeout=60,  # Close the connection if no pong is received within 60 seconds
-            process_request=lambda path, headers: None  # Disable HTTP request processing
+            process_request=process_request,  # Serves the metrics endpoints, other requests are WebSocket handshakes
+            **server_options()  # Offers protocol v2 and the tuned permessage-deflate
         )
         print("WebSocket server started on ws://0.0.0.0:3001")
         await server.wait_closed()
     except Exception as e:
         print(f"Failed to start server: {e}")
         print(traceback.format_exc())
-        db.close()
         exit(1)
+    finally:
+        # The async driver has to be closed on the loop it was created on, and so do the async model clients
+        await db.close()
+        if "dharmabot.model" in sys.modules:
+            await sys.modules["dharmabot.model"].model_registry.aclose()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except Exception as e:
         print(f"Unhandled exception in main: {e}")
-        print(traceback.format_exc())
-    finally:
-        db.close()
\ No newline at end of file
+        print(traceback.format_exc())
\ No newline at end of file
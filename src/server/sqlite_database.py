@@ -0,0 +1,179 @@
+"""
+This Python file defines `SqliteDatabase`, a `MessageStore` backed by a local SQLite file through aiosqlite. Conversations, senders and messages live in three tables, and an index on (conversation_id, timestamp, id) serves every hot read: a conversation's messages in order, the cursor reads and the newest messages. Timestamps are stored as fixed-width UTC ISO strings, so their text order is their time order. The file runs in WAL mode with `synchronous = NORMAL`, the usual durability trade-off for WAL: a commit survives a crash of the process, only a power loss can drop the last ones. The purpose of this file is to let DharmaBot UI run, and be load tested, on a developer machine or in CI without a Neo4j instance, while still persisting to disk.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import aiosqlite
+
+from storage import MessageStore
+
+SCHEMA = """
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS senders (
+        id TEXT PRIMARY KEY,
+        label TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        id TEXT PRIMARY KEY,
+        conversation_id TEXT NOT NULL REFERENCES conversations (id),
+        sender_id TEXT NOT NULL REFERENCES senders (id),
+        content TEXT NOT NULL,
+        timestamp TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, timestamp, id);
+    INSERT OR IGNORE INTO senders (id, label) VALUES ('test_user', 'User'), ('test_agent', 'Agent');
+"""
+
+MESSAGE_COLUMNS = """
+    SELECT m.id, m.content, m.timestamp, s.label, s.id
+    FROM messages m JOIN senders s ON s.id = m.sender_id
+"""
+
+
+def _timestamp(value):
+    """
+    A fixed-width UTC ISO string (microseconds always present) for a datetime or an ISO string.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _message_from_row(row):
+    message_id, content, timestamp, sender_label, sender_id = row
+    return {
+        "id": message_id,
+        "content": content,
+        "timestamp": timestamp,
+        "sender_type": sender_label,
+        "sender_id": sender_id
+    }
+
+
+def _sender_id(sender_type):
+    # the same choice as ADD_MESSAGE_QUERY: users are test_user, everything else test_agent
+    return "test_user" if sender_type == "User" else "test_agent"
+
+
+class SqliteDatabase(MessageStore):
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        # one write at a time on the shared connection, interleaved executemany and commit calls are an API misuse
+        self.write_lock = asyncio.Lock()
+
+    async def _connect(self):
+        if self.connection is None:
+            async with self.write_lock:
+                # the first callers all find no connection, only one of them opens it
+                if self.connection is None:
+                    connection = await aiosqlite.connect(self.path)
+                    await connection.executescript(SCHEMA)
+                    await connection.commit()
+                    self.connection = connection
+        return self.connection
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    async def test_connection(self):
+        await self._connect()
+        print(f"Using the SQLite database at {self.path}")
+
+    async def _fetch_all(self, query, parameters=()):
+        connection = await self._connect()
+        async with connection.execute(query, parameters) as cursor:
+            return await cursor.fetchall()
+
+    async def get_messages(self, conversation_id='default'):
+        rows = await self._fetch_all(
+            MESSAGE_COLUMNS + " WHERE m.conversation_id = ? ORDER BY m.timestamp, m.id", (conversation_id,))
+        return [_message_from_row(row) for row in rows]
+
+    async def get_messages_after(self, conversation_id='default', after_timestamp=None, after_id='', limit=1000):
+        if after_timestamp is None:
+            rows = await self._fetch_all(
+                MESSAGE_COLUMNS + " WHERE m.conversation_id = ? ORDER BY m.timestamp, m.id LIMIT ?",
+                (conversation_id, limit))
+        else:
+            rows = await self._fetch_all(
+                MESSAGE_COLUMNS + " WHERE m.conversation_id = ? AND (m.timestamp, m.id) > (?, ?)"
+                " ORDER BY m.timestamp, m.id LIMIT ?",
+                (conversation_id, _timestamp(after_timestamp), after_id, limit))
+        return [_message_from_row(row) for row in rows]
+
+    async def get_recent_messages(self, conversation_id='default', limit=100):
+        rows = await self._fetch_all(
+            MESSAGE_COLUMNS + " WHERE m.conversation_id = ? ORDER BY m.timestamp DESC, m.id DESC LIMIT ?",
+            (conversation_id, limit))
+        return [_message_from_row(row) for row in reversed(rows)]
+
+    async def add_message(self, content, sender_type, conversation_id='default'):
+        message = {
+            "id": str(uuid.uuid4()),
+            "conversation_id": conversation_id,
+            "content": content,
+            "sender_type": sender_type,
+            "timestamp": _timestamp(datetime.now(timezone.utc)),
+        }
+        await self.add_messages([message])
+        return {
+            'id': message['id'],
+            'content': content,
+            'timestamp': message['timestamp'],
+            'sender_type': sender_type
+        }
+
+    async def add_messages(self, messages):
+        connection = await self._connect()
+        async with self.write_lock:
+            await connection.executemany(
+                "INSERT OR IGNORE INTO conversations (id) VALUES (?)",
+                [(conversation_id,) for conversation_id in {message["conversation_id"] for message in messages}])
+            await connection.executemany(
+                "INSERT INTO messages (id, conversation_id, sender_id, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (message["id"], message["conversation_id"], _sender_id(message["sender_type"]),
+                     message["content"], _timestamp(message["timestamp"]))
+                    for message in messages
+                ])
+            await connection.commit()
+
+    async def get_conversation_graph_data(self, conversation_id='default', limit=None, skip=0):
+        (total_messages,), = await self._fetch_all(
+            "SELECT count(*) FROM messages WHERE conversation_id = ?", (conversation_id,))
+        rows = await self._fetch_all(
+            "SELECT m.id, substr(m.content, 1, 20), m.sender_id, s.label, m.timestamp"
+            " FROM messages m JOIN senders s ON s.id = m.sender_id"
+            " WHERE m.conversation_id = ? ORDER BY m.timestamp DESC, m.id DESC LIMIT ? OFFSET ?",
+            (conversation_id, -1 if limit is None else limit, skip))
+        if not rows:
+            return None
+        rows.reverse()
+        senders = {sender_id: sender_label for _, _, sender_id, sender_label, _ in rows}
+        newest_id, _, _, _, newest_timestamp = rows[-1]
+        return {
+            "conversation_id": conversation_id,
+            "total_messages": total_messages,
+            "messages": [[message_id, content, sender_id] for message_id, content, sender_id, _, _ in rows],
+            "senders": [[sender_id, sender_label] for sender_id, sender_label in senders.items()],
+            "newest": (newest_timestamp, newest_id),
+        }
+
+    async def run_query(self, query, parameters=None):
+        connection = await self._connect()
+        async with self.write_lock:
+            async with connection.execute(query, parameters or ()) as cursor:
+                columns = [column[0] for column in cursor.description or ()]
+                rows = await cursor.fetchall()
+            await connection.commit()
+        return [dict(zip(columns, row)) for row in rows]
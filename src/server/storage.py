@@ -0,0 +1,85 @@
+"""
+This Python file defines `MessageStore`, the storage interface the WebSocket server of DharmaBot UI is written against, and `create_database`, which picks the backend from the environment. The interface was extracted from `AsyncNeo4jDatabase` and covers messages and the conversation graph. Raw queries in the backend's own query language (`run_query`) are not part of it but a capability of the backends that have a query language, Neo4j (Cypher) and SQLite (SQL); callers check for it with `supports_queries`. `AsyncNeo4jDatabase` (Neo4j), `SqliteDatabase` (a local SQLite file) and `InMemoryDatabase` (plain Python structures) implement it, so `MessageHandler` and `GraphHandler` run unchanged on any of them and throughput can be tested without a live Neo4j.
+
+Messages are returned as dicts with id, content, ISO timestamp, sender_type (the sender's label) and sender_id, oldest first. Messages are ordered by (timestamp, id), which is also the cursor of `get_messages_after`.
+"""
+
+import os
+
+
+class MessageStore:
+    async def close(self):
+        pass
+
+    async def test_connection(self):
+        raise NotImplementedError
+
+    async def get_messages(self, conversation_id='default'):
+        """
+        All messages of a conversation.
+        """
+        raise NotImplementedError
+
+    async def get_messages_after(self, conversation_id='default', after_timestamp=None, after_id='', limit=1000):
+        """
+        Up to `limit` messages after the (timestamp, id) cursor, from the beginning without one.
+        """
+        raise NotImplementedError
+
+    async def get_recent_messages(self, conversation_id='default', limit=100):
+        """
+        The last `limit` messages of a conversation.
+        """
+        raise NotImplementedError
+
+    async def add_message(self, content, sender_type, conversation_id='default'):
+        """
+        Store a message, creating the conversation if needed, and return it with its id and timestamp.
+        """
+        raise NotImplementedError
+
+    async def flush_conversation(self, conversation_id='default'):
+        """
+        Wait until every message added to the conversation so far can be read back. The backends store a
+        message before `add_message` returns, a write-behind wrapper may still hold it.
+        """
+        pass
+
+    async def add_messages(self, messages):
+        """
+        Store many messages at once, each a dict with id, conversation_id, content, sender_type and ISO timestamp.
+        """
+        raise NotImplementedError
+
+    async def get_conversation_graph_data(self, conversation_id='default', limit=None, skip=0):
+        """
+        The newest `limit` messages (after skipping the `skip` newest), oldest first, as [id, first 20 characters,
+        sender id] triples, with the distinct [sender id, label] pairs, the total message count and the
+        (timestamp, id) of the newest one. None if the conversation has no messages.
+        """
+        raise NotImplementedError
+
+
+def supports_queries(database):
+    """
+    Whether `database` can `run_query(query, parameters=None)` in its own query language (Cypher, SQL) and
+    return the rows.
+    """
+    return callable(getattr(database, "run_query", None))
+
+
+def create_database(config):
+    """
+    The backend named by DHARMABOT_DATABASE: "neo4j" (the default), "sqlite" (DHARMABOT_SQLITE_PATH) or "memory".
+    """
+    backend = os.getenv("DHARMABOT_DATABASE", "neo4j")
+    if backend == "memory":
+        from memory_database import InMemoryDatabase
+        return InMemoryDatabase()
+    if backend == "sqlite":
+        from sqlite_database import SqliteDatabase
+        return SqliteDatabase(os.getenv("DHARMABOT_SQLITE_PATH", "dharmabot.db"))
+    if backend == "neo4j":
+        from async_database import AsyncNeo4jDatabase
+        return AsyncNeo4jDatabase(config["URI"], config["USER"], config["PASSWORD"])
+    raise ValueError(f"Unknown DHARMABOT_DATABASE: {backend}")
@@ -0,0 +1,99 @@
+"""
+This file contains the `DeltaStream` class, which forwards the tokens of an AI reply to a WebSocket client as incremental `chat_delta` frames while the reply is still being generated. Tokens are coalesced: a background task sends whatever has accumulated at most once per flush interval, so a fast model or a slow socket results in fewer, larger frames instead of one frame per token. The purpose of this file is to lower the perceived latency of DharmaBot UI replies without flooding the connection.
+"""
+
+import asyncio
+import contextlib
+import time
+import uuid
+
+FLUSH_INTERVAL = 0.05
+MAX_DELTA_CHARS = 2048
+
+
+class DeltaStream:
+    """
+    Frames sent for one reply, all sharing a `stream_id`:
+
+        {"type": "chat_delta", "stream_id": ..., "delta": "more text"}   append to the reply shown so far
+        {"type": "chat_reset", "stream_id": ...}                         discard the reply shown so far (e.g. a rejected draft)
+
+    The reply is committed by the caller with the usual {"type": "chat", "message": ..., "stream_id": ...} frame.
+    """
+
+    def __init__(self, send, flush_interval=FLUSH_INTERVAL, max_delta_chars=MAX_DELTA_CHARS):
+        self.send = send
+        self.stream_id = str(uuid.uuid4())
+        self.flush_interval = flush_interval
+        self.max_delta_chars = max_delta_chars
+        self.pending = []
+        self.text = []
+        self.frames_sent = 0
+        # bumped by every reset, so a flush that is part way through a split delta drops the rest of it
+        self.generation = 0
+        self.wake_up = asyncio.Event()
+        self.closed = False
+        # cuts the wait between two flushes short, so closing does not wait out a flush interval
+        self.closing = asyncio.Event()
+        self.flusher = None
+
+    def start(self):
+        self.flusher = asyncio.create_task(self._flush_loop())
+        return self
+
+    def push(self, delta):
+        if not delta:
+            return
+        self.pending.append(delta)
+        self.text.append(delta)
+        self.wake_up.set()
+
+    async def reset(self):
+        self.generation += 1
+        self.pending.clear()
+        self.text.clear()
+        await self._send({"type": "chat_reset", "stream_id": self.stream_id})
+
+    @property
+    def content(self):
+        return "".join(self.text)
+
+    async def _send(self, frame):
+        self.frames_sent += 1
+        await self.send(frame)
+
+    async def _flush(self):
+        while self.pending:
+            delta = "".join(self.pending)
+            self.pending.clear()
+            generation = self.generation
+            # very large bursts are split so a client can render them progressively
+            for start in range(0, len(delta), self.max_delta_chars):
+                if self.generation != generation:
+                    # reset while the earlier parts were being sent: the rest belongs to the discarded reply
+                    break
+                await self._send({"type": "chat_delta", "stream_id": self.stream_id, "delta": delta[start:start + self.max_delta_chars]})
+
+    async def _flush_loop(self):
+        while True:
+            await self.wake_up.wait()
+            self.wake_up.clear()
+            started = time.monotonic()
+            await self._flush()
+            if self.closed:
+                return
+            # tokens that arrive while we wait here are sent together in the next frame
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.closing.wait(), max(0, self.flush_interval - (time.monotonic() - started)))
+
+    async def close(self):
+        """
+        Send whatever is still pending and stop the background task.
+        """
+        self.closed = True
+        self.closing.set()
+        self.wake_up.set()
+        if self.flusher is not None:
+            await self.flusher
+        else:
+            await self._flush()
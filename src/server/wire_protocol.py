@@ -0,0 +1,142 @@
+"""
+This file contains the wire protocols the WebSocket server speaks and the compression it negotiates. Protocol v1 is the original one: every frame is a JSON text message. Protocol v2 is opt-in, a client asks for it with the `dharmabot.v2` WebSocket subprotocol at connect time, and gets every frame as a binary MessagePack message instead; the nodes and links of large `graph` and `graph_delta` frames are also laid out in columns, with the ids and types interned in a string table of the frame (marked by its `strings` field), so a large conversation graph no longer repeats `"source"`, `"target"`, `"type"` and every message id for each link. A client that asks for nothing, or a server without `msgpack` installed, speaks v1, so existing clients are unaffected. Clients of either protocol may send JSON text or MessagePack binary messages.
+
+Compression is permessage-deflate for both protocols, with a smaller window and memory level than zlib's defaults (`DHARMABOT_WS_COMPRESSION`, "tuned", "default" or "off"): the compressor and decompressor state of every connection is what costs memory with thousands of clients, and the frames of a turn compress just as well with a 4 KB window, only whole-graph snapshots lose some of their ratio. `benchmarks/wire_protocol.py` measures both on large conversation graphs.
+"""
+
+import json
+import os
+
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+try:
+    import msgpack
+except ImportError:  # v2 is not offered, every client speaks v1
+    msgpack = None
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+SUBPROTOCOL_V2 = "dharmabot.v2"
+
+WS_COMPRESSION = os.getenv("DHARMABOT_WS_COMPRESSION", "tuned")
+# log2 of the deflate window, 8 to 15, and zlib memory level, 1 to 9, of the "tuned" compression
+WS_WINDOW_BITS = int(os.getenv("DHARMABOT_WS_WINDOW_BITS", "12"))
+WS_MEM_LEVEL = int(os.getenv("DHARMABOT_WS_MEM_LEVEL", "4"))
+WS_COMPRESSION_LEVEL = int(os.getenv("DHARMABOT_WS_COMPRESSION_LEVEL", "6"))
+
+GRAPH_FRAME_TYPES = ("graph", "graph_delta")
+NODE_FIELDS = ("id", "label", "type")
+LINK_FIELDS = ("source", "target", "type")
+# nodes and links from which a graph is sent in columns, the delta of one turn compresses better as rows
+COLUMNAR_MIN_ITEMS = 32
+# fields stored as indexes into the string table of the frame, labels are mostly unique and stay inline
+INTERNED_FIELDS = {"id", "source", "target", "type"}
+
+
+def server_options():
+    """
+    Keyword arguments of `websockets.serve` for the subprotocols and compression.
+    """
+    options = {"subprotocols": [SUBPROTOCOL_V2] if msgpack is not None else []}
+    if WS_COMPRESSION == "off":
+        options["compression"] = None
+    elif WS_COMPRESSION == "tuned":
+        options["compression"] = None
+        options["extensions"] = [ServerPerMessageDeflateFactory(
+            server_max_window_bits=WS_WINDOW_BITS,
+            client_max_window_bits=WS_WINDOW_BITS,
+            compress_settings={"memLevel": WS_MEM_LEVEL, "level": WS_COMPRESSION_LEVEL},
+        )]
+    return options
+
+
+def negotiated(websocket):
+    """
+    The protocol of a connection, from the subprotocol agreed on in its handshake.
+    """
+    return PROTOCOL_V2 if websocket.subprotocol == SUBPROTOCOL_V2 and msgpack is not None else PROTOCOL_V1
+
+
+def to_columns(items, fields, indexes):
+    # `indexes` maps each interned string to its index, dicts keep insertion order so its keys are the string table
+    def intern(string):
+        return indexes.setdefault(string, len(indexes))
+
+    return {
+        field: [intern(item[field]) for item in items] if field in INTERNED_FIELDS else [item[field] for item in items]
+        for field in fields
+    }
+
+
+def from_columns(columns, fields, strings):
+    rows = zip(*(columns[field] for field in fields))
+    return [
+        {field: strings[value] if field in INTERNED_FIELDS else value for field, value in zip(fields, row)}
+        for row in rows
+    ]
+
+
+def graph_items(frame):
+    graphs = (frame["data"],) if frame["type"] == "graph" else (frame["add"], frame["remove"])
+    return sum(len(graph["nodes"]) + len(graph["links"]) for graph in graphs)
+
+
+def columnar(frame):
+    """
+    A graph or graph_delta frame with its nodes and links in columns over one string table.
+    """
+    indexes = {}
+
+    def pack(graph):
+        return {**graph, "nodes": to_columns(graph["nodes"], NODE_FIELDS, indexes),
+                "links": to_columns(graph["links"], LINK_FIELDS, indexes)}
+
+    if frame["type"] == "graph":
+        frame = {**frame, "data": pack(frame["data"])}
+    else:
+        frame = {**frame, "add": pack(frame["add"]), "remove": pack(frame["remove"])}
+    frame["strings"] = list(indexes)
+    return frame
+
+
+def from_columnar(frame):
+    """
+    The frame `columnar` was given.
+    """
+    frame = dict(frame)
+    strings = frame.pop("strings")
+
+    def unpack(graph):
+        return {**graph, "nodes": from_columns(graph["nodes"], NODE_FIELDS, strings),
+                "links": from_columns(graph["links"], LINK_FIELDS, strings)}
+
+    if frame["type"] == "graph":
+        frame["data"] = unpack(frame["data"])
+    else:
+        frame["add"], frame["remove"] = unpack(frame["add"]), unpack(frame["remove"])
+    return frame
+
+
+def encode_frame(frame, protocol=PROTOCOL_V1):
+    """
+    A frame as a WebSocket message: JSON text for v1, MessagePack bytes for v2.
+    """
+    if protocol == PROTOCOL_V2:
+        if frame.get("type") in GRAPH_FRAME_TYPES and graph_items(frame) >= COLUMNAR_MIN_ITEMS:
+            frame = columnar(frame)
+        return msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame)
+
+
+def decode_frame(message):
+    """
+    A frame from a WebSocket message of either protocol.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        if msgpack is None:
+            raise ValueError("Binary messages need msgpack, which is not installed")
+        frame = msgpack.unpackb(message, raw=False)
+        if frame.get("type") in GRAPH_FRAME_TYPES and "strings" in frame:
+            frame = from_columnar(frame)
+        return frame
+    return json.loads(message)
@@ -0,0 +1,179 @@
+"""
+This file contains the `WriteBehindDatabase` class, which wraps the database used by the WebSocket server and turns `add_message` into a write-behind operation. Messages get their id and timestamp in Python and are returned right away, while a background flush stores everything that is pending, across all conversations, with one `add_messages` (UNWIND) transaction once `max_batch` messages are waiting or `max_delay` seconds after the first one. Batches are written one at a time and in the order the messages were added, and timestamps never go backwards within a conversation, so per-conversation ordering is kept. While the database keeps failing, flushes are retried with exponential backoff up to `max_retry_delay`, and once more than `max_pending` messages are waiting the oldest non-durable ones are dropped (and logged), the way `BroadcastHub` bounds its client queues, so an outage cannot grow the queue without limit. Callers that must know a message is stored pass `durable=True`, which flushes at once and waits for the commit, readers that must see a conversation's messages (the graph refresh) call `flush_conversation` first; `close` flushes whatever is left. The purpose of this file is to spend the database round trips and transaction overhead of DharmaBot UI on batches instead of on every single message.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+WRITE_BEHIND = os.getenv("DHARMABOT_WRITE_BEHIND", "1") != "0"
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("DHARMABOT_WRITE_BEHIND_MAX_BATCH", "200"))
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("DHARMABOT_WRITE_BEHIND_MAX_DELAY", "0.05"))
+# messages kept waiting while the database is failing; beyond this the oldest are dropped
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("DHARMABOT_WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_MAX_RETRY_DELAY = float(os.getenv("DHARMABOT_WRITE_BEHIND_MAX_RETRY_DELAY", "30"))
+
+
+class WriteBehindDatabase:
+    """
+    Everything except `add_message`, `flush_conversation` and `close` is passed through to the wrapped database.
+    """
+
+    def __init__(self, database, max_batch=WRITE_BEHIND_MAX_BATCH, max_delay=WRITE_BEHIND_MAX_DELAY,
+                 max_pending=WRITE_BEHIND_MAX_PENDING, max_retry_delay=WRITE_BEHIND_MAX_RETRY_DELAY):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_retry_delay = max_retry_delay
+        # flushes failed in a row, the retry delay doubles with each
+        self.failures = 0
+        # (row, future or None) in the order they were added
+        self.pending = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_timer = None
+        self.flush_tasks = set()
+        # a flush is scheduled that has not taken its batch yet, it will take every message added until then
+        self.flush_queued = False
+        # conversation_id -> timestamp of its newest message, so timestamps only move forward
+        self.last_timestamps = {}
+        self.stats = {"messages": 0, "batches": 0, "largest_batch": 0, "durable_writes": 0, "failed_flushes": 0,
+                      "dropped_messages": 0}
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def _next_timestamp(self, conversation_id):
+        timestamp = datetime.now(timezone.utc)
+        last_timestamp = self.last_timestamps.get(conversation_id)
+        if last_timestamp is not None and timestamp <= last_timestamp:
+            timestamp = last_timestamp + timedelta(microseconds=1)
+        self.last_timestamps[conversation_id] = timestamp
+        return timestamp
+
+    def _flush_delay(self):
+        return min(self.max_delay * 2 ** self.failures, self.max_retry_delay)
+
+    def _drop_overflow(self):
+        """
+        Drop the oldest non-durable messages beyond `max_pending`; durable ones have a caller waiting for them.
+        """
+        overflow = len(self.pending) - self.max_pending
+        if overflow <= 0:
+            return
+        kept = []
+        for row, future in self.pending:
+            if overflow > 0 and future is None:
+                overflow -= 1
+                self.stats["dropped_messages"] += 1
+                print(f"Dropping unstored message {row['id']} of conversation {row['conversation_id']}: "
+                      f"more than {self.max_pending} messages pending")
+                continue
+            kept.append((row, future))
+        self.pending = kept
+
+    async def add_message(self, content, sender_type, conversation_id='default', durable=False):
+        """
+        Queue a message and return it with its id and timestamp. With `durable=True` this only
+        returns once the message (and everything queued before it) is committed.
+        """
+        row = {
+            "id": str(uuid.uuid4()),
+            "conversation_id": conversation_id,
+            "content": content,
+            "sender_type": sender_type,
+            "timestamp": self._next_timestamp(conversation_id).isoformat(),
+        }
+        future = asyncio.get_running_loop().create_future() if durable else None
+        self.pending.append((row, future))
+        self.stats["messages"] += 1
+        self._drop_overflow()
+
+        # a full batch waits out the retry delay too while the database is failing
+        if durable or (len(self.pending) >= self.max_batch and not self.failures and not self.flush_queued):
+            self._schedule_flush()
+        elif self.flush_timer is None:
+            self.flush_timer = asyncio.get_running_loop().call_later(self._flush_delay(), self._schedule_flush)
+
+        if durable:
+            self.stats["durable_writes"] += 1
+            await future
+        return {
+            'id': row['id'],
+            'content': content,
+            'timestamp': row['timestamp'],
+            'sender_type': sender_type
+        }
+
+    def _schedule_flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        self.flush_queued = True
+        task = asyncio.ensure_future(self.flush())
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    async def flush(self):
+        """
+        Write everything pending as one batch. On failure durable callers get the error, the other
+        messages go back to the front of the queue (the order is kept, up to `max_pending`) and are
+        retried after `max_delay`, doubled for every failure in a row.
+        """
+        async with self.flush_lock:
+            batch, self.pending = self.pending, []
+            self.flush_queued = False
+            if not batch:
+                return True
+            try:
+                await self.database.add_messages([row for row, _ in batch])
+            except Exception as e:
+                self.failures += 1
+                print(f"Error flushing {len(batch)} messages, retrying in {self._flush_delay():.2f}s: {e}")
+                self.stats["failed_flushes"] += 1
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                self.pending = [(row, None) for row, future in batch if future is None] + self.pending
+                self._drop_overflow()
+                if self.flush_timer is not None:
+                    # set by an add_message during this flush, before the delay grew
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+                if self.pending:
+                    self.flush_timer = asyncio.get_running_loop().call_later(self._flush_delay(), self._schedule_flush)
+                return False
+            self.failures = 0
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_result(None)
+            return True
+
+    async def flush_conversation(self, conversation_id='default'):
+        """
+        Store the pending messages now if some belong to the conversation, or wait for the batch being
+        written, so that reads of the conversation see every message added to it.
+        """
+        if self.flush_lock.locked() or any(row["conversation_id"] == conversation_id for row, _ in self.pending):
+            return await self.flush()
+        return True
+
+    async def close(self):
+        """
+        Flush what is still pending, then close the wrapped database.
+        """
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not await self.flush():
+            print(f"{len(self.pending)} messages could not be stored before shutdown")
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+        await self.database.close()
+
+    def report(self):
+        return {**self.stats, "pending": len(self.pending)}
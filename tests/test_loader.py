@@ -0,0 +1,83 @@
+"""
+`GithubFileCache` against a patched `requests.get`: the offline snapshot fallback and single-flight fetching.
+"""
+
+import threading
+import time
+
+import pytest
+import requests
+
+from dharmabot import loader
+from dharmabot.loader import SNAPSHOTS, GithubFileCache, load_snapshot
+
+URL = next(iter(SNAPSHOTS))
+
+
+class Response:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.headers = {"ETag": '"1"'}
+
+
+def test_snapshot_served_with_no_network_and_no_cache(tmp_path, monkeypatch):
+    def offline(*args, **kwargs):
+        raise requests.ConnectionError("offline")
+
+    monkeypatch.setattr(loader.requests, "get", offline)
+    cache = GithubFileCache(cache_dir=str(tmp_path))
+
+    # first the fetch fails, then the remembered failure skips the network
+    assert cache.load(URL) == load_snapshot(URL)
+    assert cache.load(URL) == load_snapshot(URL)
+    assert "def test_" in cache.load(URL)
+    assert cache.stats["snapshot_hits"] == 3
+    assert cache.stats["failure_hits"] == 2
+
+
+def test_snapshot_rejected_when_its_hash_does_not_match(monkeypatch):
+    name, _ = SNAPSHOTS[URL]
+    monkeypatch.setitem(SNAPSHOTS, URL, (name, "0" * 64))
+
+    assert load_snapshot(URL) is None
+
+
+@pytest.mark.parametrize("stale", [False, True])
+def test_concurrent_loads_fetch_once(tmp_path, monkeypatch, stale):
+    fetches = []
+
+    def slow_get(*args, **kwargs):
+        fetches.append(1)
+        time.sleep(0.05)
+        return Response("content")
+
+    monkeypatch.setattr(loader.requests, "get", slow_get)
+    cache = GithubFileCache(cache_dir=str(tmp_path))
+    if stale:
+        cache.load(URL)
+        fetches.clear()
+        # past fresh_for but within stale_for: served from memory while one background refresh runs
+        cache.memory[URL]["fetched_at"] -= cache.fresh_for * 2
+        cache._write_entry(URL, cache.memory[URL])
+        cache.stats["fetched"] = 0
+
+    barrier = threading.Barrier(16)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(cache.load(URL))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    while cache.in_flight:
+        time.sleep(0.01)
+
+    assert results == ["content"] * 16
+    assert len(fetches) == 1
+    assert cache.stats["fetched"] + cache.stats["revalidated"] == 1
+    assert cache.stats["stale_hits"] == (16 if stale else 0)
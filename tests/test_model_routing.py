@@ -0,0 +1,102 @@
+"""
+Simulation tests of `ModelRouter` against fake providers with injected latency distributions and error rates.
+"""
+
+import asyncio
+import random
+import time
+
+from langchain_core.messages import AIMessage
+
+from server.agents.model_router import ROUTER_MIN_SAMPLES, ModelRouter
+
+
+class FakeProvider:
+    """
+    Latency is lognormal around `median` seconds; with probability `error_rate` a call fails instead.
+    """
+
+    def __init__(self, name, median, sigma=0.2, error_rate=0.0, seed=0):
+        self.name = name
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.started = []
+        self.cancelled = 0
+
+    async def ainvoke(self, messages):
+        self.started.append(time.perf_counter())
+        if self.rng.random() < self.error_rate:
+            await asyncio.sleep(self.median / 10)
+            raise RuntimeError(f"{self.name} unavailable")
+        try:
+            await asyncio.sleep(self.median * self.rng.lognormvariate(0, self.sigma))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return AIMessage(content=self.name)
+
+
+async def send(router, requests):
+    return [(await router.ainvoke([])).content for _ in range(requests)]
+
+
+def test_prefers_the_faster_healthy_provider():
+    # configured slow first, so the router has to learn the order from the latencies
+    slow, fast = FakeProvider("slow", 0.03, seed=1), FakeProvider("fast", 0.005, seed=2)
+    router = ModelRouter({"slow": slow, "fast": fast}, hedge=False)
+
+    answers = asyncio.run(send(router, 2 * ROUTER_MIN_SAMPLES + 20))
+
+    assert router.ranked() == ["fast", "slow"]
+    # once both are measured every call goes to the fast one
+    assert answers[-20:] == ["fast"] * 20
+
+
+def test_hedges_after_the_p95_delay_and_cancels_the_loser():
+    primary, backup = FakeProvider("primary", 0.01, seed=3), FakeProvider("backup", 0.02, seed=4)
+    router = ModelRouter({"primary": primary, "backup": backup}, hedge=False)
+
+    async def scenario():
+        # measured history of both, the primary answers in about 10 ms
+        await send(router, 2 * ROUTER_MIN_SAMPLES + 10)
+        assert router.ranked()[0] == "primary"
+        router.hedge = True
+        delay = router.hedge_delay("primary")
+        calls_before, hedges_before = len(backup.started), dict(router.hedges)
+        # then its tail: one call takes far longer than its p95
+        primary.median = 1.0
+        start = time.perf_counter()
+        answer = (await router.ainvoke([])).content
+        elapsed = time.perf_counter() - start
+        # the cancelled task gets to run its handler
+        await asyncio.sleep(0)
+        hedges = {key: router.hedges[key] - hedges_before[key] for key in hedges_before}
+        return delay, backup.started[calls_before:], start, answer, elapsed, hedges
+
+    delay, hedged, start, answer, elapsed, hedges = asyncio.run(scenario())
+
+    assert answer == "backup"
+    assert len(hedged) == 1
+    # sent once the primary was slower than its own p95, not before and not much after
+    assert delay <= hedged[0] - start < delay + 0.05
+    assert elapsed < 0.5
+    assert primary.cancelled == 1
+    assert hedges == {"sent": 1, "won": 1}
+    # the cancelled call counts as a latency sample of at least the time it ran
+    assert router.stats["invoke"]["primary"].latencies[-1] >= delay
+
+
+def test_routes_around_a_provider_with_a_high_error_rate():
+    flaky = FakeProvider("flaky", 0.002, error_rate=0.5, seed=5)
+    steady = FakeProvider("steady", 0.01, seed=6)
+    router = ModelRouter({"flaky": flaky, "steady": steady}, hedge=False)
+
+    answers = asyncio.run(send(router, 2 * ROUTER_MIN_SAMPLES + 20))
+
+    # every request is answered, a failed call falls back to the other provider
+    assert len(answers) == 2 * ROUTER_MIN_SAMPLES + 20
+    assert router.stats["invoke"]["flaky"].error_rate() > 0.2
+    assert router.ranked() == ["steady", "flaky"]
+    assert answers[-20:] == ["steady"] * 20